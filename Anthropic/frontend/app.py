@@ -1,21 +1,26 @@
 # app.py
 from reactpy import component
 from frontend.components.profile_form import ProfileForm
-from google import genai
 from dotenv import load_dotenv
-import os
-import json
+from pathlib import Path
+import importlib.util
+import sys
 
 load_dotenv()
 
 # ---------------------------
-# Initialize Gemini client
+# LLM gateway (client, retries, JSON parsing)
 # ---------------------------
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found in environment")
-
-client = genai.Client(api_key=api_key)
+# Shared LLM gateway (the backend/llm package of the main app). Loaded by
+# path, as a top-level package named "llm", because this app's own backend/
+# package shadows the repo's; see the note at the end of its docstring.
+_LLM_DIR = Path(__file__).resolve().parents[2] / "backend" / "llm"
+_spec = importlib.util.spec_from_file_location(
+    "llm", _LLM_DIR / "__init__.py", submodule_search_locations=[str(_LLM_DIR)]
+)
+llm = importlib.util.module_from_spec(_spec)
+sys.modules["llm"] = llm  # for its relative imports
+_spec.loader.exec_module(llm)
 
 # ---------------------------
 # AI Line Generator
@@ -23,7 +28,7 @@ client = genai.Client(api_key=api_key)
 def ai_line_generator(profile: dict) -> list[dict]:
     """
     Generate AI-powered dating app opening lines based on a user's profile.
-    Uses the global `client` instance.
+    Uses the shared `llm` gateway.
     """
     prompt = f"""
 You are a helpful assistant that generates dating app opening lines.
@@ -49,31 +54,15 @@ Follow the JSON structure exactly.
 Output only a valid JSON object that contains no extra text, explanation, or Markdown formatting before or after.
 """
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt
-    )
-
-    def clean_gemini_response(response_text: str) -> str:
-        if not response_text:
-            return ""
-        cleaned = response_text.strip()
-        if cleaned.startswith("```json"):
-            cleaned = cleaned[len("```json"):].strip()
-        elif cleaned.startswith("```"):
-            cleaned = cleaned[len("```"):].strip()
-        if cleaned.endswith("```"):
-            cleaned = cleaned[:-3].strip()
-        return cleaned
-
-    response_text = clean_gemini_response(response.text)
-
     try:
-        data = json.loads(response_text)
-        return data.get("opening_lines", [])
-    except json.JSONDecodeError:
+        data = llm.generate_json(prompt, task="opening_lines")
+    except llm.LLMParseError:
         print("Failed to parse JSON from Gemini response")
         return []
+    except llm.LLMError as e:
+        print(f"Gemini request failed: {e}")
+        return []
+    return data.get("opening_lines", []) if isinstance(data, dict) else []
 
 def handle_profile_submit(profile_data):
     """
@@ -1,18 +1,20 @@
-from google import genai
 from dotenv import load_dotenv
-import os
-import json
+from pathlib import Path
+import importlib.util
+import sys
 
 load_dotenv()
 
-# Get API key from environment
-api_key = os.getenv("GEMINI_API_KEY")
-
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found in environment")
-
-# Initialize the client
-client = genai.Client(api_key=api_key)
+# Shared LLM gateway (the backend/llm package of the main app). Loaded by
+# path, as a top-level package named "llm", because this app's own backend/
+# package shadows the repo's; see the note at the end of its docstring.
+_LLM_DIR = Path(__file__).resolve().parents[1] / "backend" / "llm"
+_spec = importlib.util.spec_from_file_location(
+    "llm", _LLM_DIR / "__init__.py", submodule_search_locations=[str(_LLM_DIR)]
+)
+llm = importlib.util.module_from_spec(_spec)
+sys.modules["llm"] = llm  # for its relative imports
+_spec.loader.exec_module(llm)
 
 profile = {
     "name": "Liam",
@@ -49,44 +51,9 @@ Follow the JSON structure exactly.
 Output only a valid JSON object that contains no extra text, explanation, or Markdown formatting before or after.
 """
 
-response = client.models.generate_content(
-    model="gemini-2.5-flash",
-    contents=prompt
-)
-
-sample_response_text = """{
-    "opening_lines": [
-        {
-            "line": "Hey Alice! Love that you're into hiking ...",
-            "reason": "..."
-        }
-    ]
-}"""
-
-def clean_gemini_response(response_text: str) -> str:
-    """
-    Remove Markdown code fences like ```json and ``` from Gemini's response.
-    """
-    if not response_text:
-        return ""
-    
-    cleaned = response_text.strip()
-    
-    # Remove opening ```json or ``` 
-    if cleaned.startswith("```json"):
-        cleaned = cleaned[len("```json"):].strip()
-    elif cleaned.startswith("```"):
-        cleaned = cleaned[len("```"):].strip()
-    
-    # Remove closing ```
-    if cleaned.endswith("```"):
-        cleaned = cleaned[:-3].strip()
-    
-    return cleaned
-# Parse the JSON output safely
-response_text = clean_gemini_response(response.text)
-print(response_text)
+# The gateway strips code fences and parses the JSON for us
+data = llm.generate_json(prompt, task="opening_lines")
+print(data)
 print("\n")
-data = json.loads(response_text.strip())
 for item in data["opening_lines"]:
     print(item["line"], "-", item["reason"])
@@ -1,17 +1,43 @@
 # backend/ai.py
 import os
 import json
-from typing import Dict, List
+import asyncio
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
-from google import genai
+from . import llm
 
-# Client will read GEMINI_API_KEY or GOOGLE_API_KEY from env if not passed explicitly
-#   export GEMINI_API_KEY="your-key"
-import os
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# Model calls go through the llm package (provider, timeouts, retries, parsing, metrics);
+#   export GEMINI_API_KEY="your-key"      or      LLM_PROVIDER=fake  to run offline
+GEMINI_MODEL = llm.DEFAULT_MODEL  # GEMINI_MODEL env, gemini-2.5-flash as of late 2025
+
+# Rough prompt-size cap for one batched scoring request (~4 chars per token)
+BATCH_TOKEN_BUDGET = int(os.getenv("GEMINI_BATCH_TOKEN_BUDGET", "6000"))
+# How many times to re-ask for candidates the model skipped in its answer
+BATCH_MAX_RETRIES = int(os.getenv("GEMINI_BATCH_MAX_RETRIES", "1"))
+# Cap on candidates per request, so big shortlists fan out over several calls
+BATCH_MAX_SIZE = int(os.getenv("GEMINI_BATCH_MAX_SIZE", "10"))
+
+# Max scoring requests in flight per event loop (the app's, and the gateway
+# loop that runs sync callers), and per-request timeout (seconds). A request
+# waiting on the model holds no thread, so the cap can be generous.
+SCORE_CONCURRENCY = int(os.getenv("GEMINI_SCORE_CONCURRENCY", "256"))
+SCORE_CALL_TIMEOUT = float(os.getenv("GEMINI_SCORE_CALL_TIMEOUT", "10"))
 
+_score_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
 
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")  # good default as of late 2025
+
+def scoring_degraded() -> bool:
+    """
+    True while the model is over its latency / error budget (llm.ProviderHealth)
+    or refused outright by the circuit breaker.
+    """
+    return llm.health.degraded() or llm.breaker.is_open()
 
 
 def profile_to_text(profile: Dict) -> str:
@@ -28,10 +54,25 @@ def profile_to_text(profile: Dict) -> str:
     )
 
 
+def profile_to_dict(profile) -> Dict:
+    """Turn a models.Profile row into the dict shape the prompts expect."""
+    return {
+        "full_name": profile.user.full_name if profile.user is not None else None,
+        "age": profile.age,
+        "gender": profile.gender,
+        "major": profile.major,
+        "class_year": profile.class_year,
+        "campus": profile.campus,
+        "interests": [i for i in (profile.interests or "").split(",") if i],
+        "bio": profile.bio,
+    }
+
+
 def get_match_score(user_profile: Dict, other_profile: Dict) -> float:
     """
     Ask Gemini for a compatibility score between 0 and 100.
     We prompt it to return ONLY a number and then parse.
+    Raises ValueError if the reply isn't a number, rather than guessing.
     """
     user_text = profile_to_text(user_profile)
     other_text = profile_to_text(other_profile)
@@ -47,36 +88,331 @@ def get_match_score(user_profile: Dict, other_profile: Dict) -> float:
         "Score (number only):"
     )
 
-    resp = client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=prompt,
-    )  # response.text contains model text output :contentReference[oaicite:2]{index=2}
-
-    text = (resp.text or "").strip()
+    text = llm.generate(prompt, task="match_score", model=GEMINI_MODEL).strip()
     try:
         score = float(text)
     except ValueError:
-        score = 50.0
+        raise ValueError(f"model returned a non-numeric score: {text[:80]!r}")
 
     return max(0.0, min(100.0, score))
 
 
-def chat_helper(
-    current_user_profile: Dict,
-    other_profile: Dict,
-    recent_messages: List[Dict[str, str]],
-) -> Dict[str, List[str] | str]:
+def score_match(user_profile, other_profile) -> float:
+    """get_match_score for two models.Profile rows."""
+    return get_match_score(profile_to_dict(user_profile), profile_to_dict(other_profile))
+
+
+_BATCH_PROMPT_HEADER = (
+    "You are a compatibility rater for a college-only dating app.\n"
+    "Given Profile A and a list of candidate profiles, rate how compatible "
+    "Profile A is with EACH candidate on a 0-100 scale.\n"
+    "Higher scores mean more shared interests, similar vibe, and likely good conversation.\n\n"
+    "Profile A:\n"
+    "{user_text}\n"
+    "Candidates:\n"
+)
+_BATCH_PROMPT_FOOTER = (
+    "\nRespond ONLY with a JSON array containing one object per candidate, e.g.\n"
+    '[{"user_id": 12, "score": 73}, {"user_id": 40, "score": 18}]\n'
+)
+
+
+def _candidate_block(candidate: Dict) -> str:
+    return f"Candidate user_id={candidate['user_id']}\n{profile_to_text(candidate)}\n"
+
+
+def _split_batches(candidates: List[Dict], prefix_tokens: int) -> List[List[Dict]]:
+    """Greedily pack candidates into batches that fit BATCH_TOKEN_BUDGET."""
+    batches: List[List[Dict]] = []
+    current: List[Dict] = []
+    used = prefix_tokens
+    for cand in candidates:
+        cost = llm.estimate_tokens(_candidate_block(cand))
+        if current and (used + cost > BATCH_TOKEN_BUDGET or len(current) >= BATCH_MAX_SIZE):
+            batches.append(current)
+            current, used = [], prefix_tokens
+        current.append(cand)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_scores(raw: str, wanted_ids: set) -> Dict[int, float]:
+    """Pull {user_id: score} out of the model's JSON array, ignoring junk."""
+    try:
+        data = llm.parse_json(raw)
+    except llm.LLMParseError:
+        return {}
+    if isinstance(data, dict):
+        data = data.get("scores", [])
+    if not isinstance(data, list):
+        return {}
+
+    scores: Dict[int, float] = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        try:
+            uid = int(item["user_id"])
+            score = float(item["score"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if uid in wanted_ids:
+            scores[uid] = max(0.0, min(100.0, score))
+    return scores
+
+
+def _batch_prompt(user_text: str, batch: List[Dict]) -> str:
+    return (
+        _BATCH_PROMPT_HEADER.format(user_text=user_text)
+        + "\n".join(_candidate_block(c) for c in batch)
+        + _BATCH_PROMPT_FOOTER
+    )
+
+
+def batch_prompts(user_profile: Dict, candidates: List[Dict]) -> List[Tuple[List[Dict], str]]:
     """
-    Summarize the other person's profile & suggest 3 non-cringe openers.
-    recent_messages: list of {"from": "me" | "them", "text": "..."}
+    (batch, prompt) for each request iter_match_scores_batch would send for
+    these candidates, for offline scoring (backend/jobs/bulk_score.py).
+    Parse the replies with parse_batch_scores.
+    """
+    user_text = profile_to_text(user_profile)
+    prefix_tokens = llm.estimate_tokens(
+        _BATCH_PROMPT_HEADER.format(user_text=user_text) + _BATCH_PROMPT_FOOTER
+    )
+    return [
+        (batch, _batch_prompt(user_text, batch))
+        for batch in _split_batches(candidates, prefix_tokens)
+    ]
+
+
+async def _score_batch_once(user_text: str, batch: List[Dict]) -> Dict[int, float]:
+    """One scoring request, within SCORE_CONCURRENCY."""
+    loop = asyncio.get_running_loop()
+    slots = _score_slots.get(loop)
+    if slots is None:
+        slots = _score_slots[loop] = asyncio.Semaphore(SCORE_CONCURRENCY)
+    prompt = _batch_prompt(user_text, batch)
+    async with slots:
+        # No gateway retries: aiter_match_scores_batch re-asks for what's missing
+        raw = await llm.agenerate(
+            prompt,
+            task="match_scores",
+            model=GEMINI_MODEL,
+            json_output=True,
+            timeout=SCORE_CALL_TIMEOUT,
+            retries=0,
+        )
+    return parse_batch_scores(raw, {c["user_id"] for c in batch})
+
+
+async def aiter_match_scores_batch(
+    user_profile: Dict,
+    candidates: List[Dict],
+    deadline: Optional[float] = None,
+) -> AsyncIterator[Dict[int, float]]:
+    """
+    Score one user against many candidates with as few model calls as possible,
+    yielding each batch's {user_id: score} as soon as that request finishes.
+    Each candidate dict must carry a "user_id". Batches run concurrently as
+    tasks on the event loop. Candidates the model leaves out are re-asked up
+    to BATCH_MAX_RETRIES times; any still missing when `deadline` (a
+    time.monotonic() value) passes are never yielded, and their requests are
+    cancelled, as they are when the consumer goes away.
+    """
+    user_text = profile_to_text(user_profile)
+    prefix_tokens = llm.estimate_tokens(
+        _BATCH_PROMPT_HEADER.format(user_text=user_text) + _BATCH_PROMPT_FOOTER
+    )
+
+    scored = set()
+    pending = list(candidates)
+    for _ in range(1 + BATCH_MAX_RETRIES):
+        tasks = {
+            asyncio.ensure_future(_score_batch_once(user_text, batch))
+            for batch in _split_batches(pending, prefix_tokens)
+        }
+        try:
+            while tasks:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, tasks = await asyncio.wait(
+                    tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    return  # out of time
+                for task in done:
+                    if task.exception() is not None:
+                        continue  # retried below along with anything the model skipped
+                    batch_scores = task.result()
+                    scored.update(batch_scores)
+                    yield batch_scores
+        finally:
+            for task in tasks:
+                task.cancel()
+        pending = [c for c in pending if c["user_id"] not in scored]
+        if not pending:
+            break
+
+
+def iter_match_scores_batch(
+    user_profile: Dict,
+    candidates: List[Dict],
+    deadline: Optional[float] = None,
+) -> Iterator[Dict[int, float]]:
+    """aiter_match_scores_batch for sync callers."""
+    return llm.iter_sync(aiter_match_scores_batch(user_profile, candidates, deadline))
+
+
+def get_match_scores_batch(
+    user_profile: Dict,
+    candidates: List[Dict],
+    deadline: Optional[float] = None,
+) -> Dict[int, float]:
+    """iter_match_scores_batch collected into one {user_id: score} dict."""
+    scores: Dict[int, float] = {}
+    for batch_scores in iter_match_scores_batch(user_profile, candidates, deadline):
+        scores.update(batch_scores)
+    return scores
+
+
+# --- In-flight pairs ----------------------------------------------------------
+# Scores are mutual, so while one request is scoring (a, b) any other request
+# that needs the same pair (either direction) waits for that answer instead of
+# putting it in its own prompt. A Future resolves to the score, or None if the
+# owner gave up on it (deadline, error) and the waiter should fall back.
+
+_pairs_lock = threading.Lock()
+_pairs_in_flight: Dict[Tuple[int, int], Future] = {}
+
+
+def _pair_key(a: int, b: int) -> Tuple[int, int]:
+    return (a, b) if a < b else (b, a)
+
+
+def _claim_pairs(user_id: int, other_ids: List[int]) -> Tuple[Dict[int, Future], Dict[int, Future]]:
+    """Split other_ids into pairs this caller now owns and pairs already in flight."""
+    owned, joined = {}, {}
+    with _pairs_lock:
+        for other_id in other_ids:
+            key = _pair_key(user_id, other_id)
+            flight = _pairs_in_flight.get(key)
+            if flight is None:
+                owned[other_id] = _pairs_in_flight[key] = Future()
+            else:
+                joined[other_id] = flight
+    return owned, joined
+
+
+def _release_pairs(user_id: int, owned: Dict[int, Future], scores: Optional[Dict[int, float]] = None) -> None:
+    """Publish scores for owned pairs (None if unscored) and stop advertising them."""
+    with _pairs_lock:
+        for other_id in list(scores if scores is not None else owned):
+            flight = owned.pop(other_id, None)
+            if flight is None:
+                continue
+            if _pairs_in_flight.get(_pair_key(user_id, other_id)) is flight:
+                del _pairs_in_flight[_pair_key(user_id, other_id)]
+            flight.set_result(scores.get(other_id) if scores is not None else None)
+
+
+def candidate_dicts(other_profiles) -> List[Dict]:
+    candidates = []
+    for p in other_profiles:
+        cand = profile_to_dict(p)
+        cand["user_id"] = p.user_id
+        candidates.append(cand)
+    return candidates
+
+
+def score_matches(user_profile, other_profiles, deadline: Optional[float] = None) -> Dict[int, float]:
+    """iter_score_matches collected into one {user_id: score} dict."""
+    scores: Dict[int, float] = {}
+    for batch_scores in iter_score_matches(user_profile, other_profiles, deadline):
+        scores.update(batch_scores)
+    return scores
+
+
+def iter_score_matches(
+    user_profile, other_profiles, deadline: Optional[float] = None
+) -> Iterator[Dict[int, float]]:
+    """aiter_score_matches for models.Profile rows (read here, on the caller's thread)."""
+    return llm.iter_sync(
+        aiter_score_matches(
+            user_profile.user_id,
+            profile_to_dict(user_profile),
+            candidate_dicts(other_profiles),
+            deadline,
+        )
+    )
+
+
+async def aiter_score_matches(
+    user_id: int, user_profile: Dict, candidates: List[Dict], deadline: Optional[float] = None
+) -> AsyncIterator[Dict[int, float]]:
+    """
+    aiter_match_scores_batch keyed by user_id, for user_id's profile dict
+    and candidate dicts (profile_to_dict plus "user_id", see candidate_dicts:
+    dicts rather than rows, so nothing here lazy-loads from the DB on the
+    event loop). Pairs another request is already scoring are not re-sent;
+    their scores are yielded when that request gets them (or never, if it
+    gives up).
     """
+    owned, joined = _claim_pairs(user_id, [c["user_id"] for c in candidates])
+    try:
+        mine = [c for c in candidates if c["user_id"] in owned]
+        if mine:
+            async for batch_scores in aiter_match_scores_batch(user_profile, mine, deadline):
+                _release_pairs(user_id, owned, batch_scores)
+                yield batch_scores
+        _release_pairs(user_id, owned)  # unscored: waiters fall back too
+
+        # Never cancel these wrappers: that would cancel the owner's Future
+        waiting = {asyncio.wrap_future(flight): other_id for other_id, flight in joined.items()}
+        abandoned = []
+        while waiting:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = await asyncio.wait(
+                list(waiting), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                return  # out of time
+            batch_scores = {}
+            for flight in done:
+                other_id = waiting.pop(flight)
+                if flight.result() is None:
+                    abandoned.append(other_id)
+                else:
+                    batch_scores[other_id] = flight.result()
+            if batch_scores:
+                yield batch_scores
+
+        # The other request gave up on these before its answer came back
+        if abandoned and (deadline is None or time.monotonic() < deadline):
+            retry = [c for c in candidates if c["user_id"] in set(abandoned)]
+            async for batch_scores in aiter_score_matches(user_id, user_profile, retry, deadline):
+                yield batch_scores
+    finally:
+        # Deadline, error or consumer went away: don't leave waiters hanging
+        _release_pairs(user_id, owned)
+
+
+def _chat_helper_prompt(
+    other_profile: Dict, recent_messages: List[Dict[str, str]], thread_summary: str
+) -> str:
     other_text = profile_to_text(other_profile)
 
     convo_str = ""
-    for msg in recent_messages[-10:]:
+    for msg in recent_messages:  # already bounded by the caller (conversation.py)
         who = "You" if msg["from"] == "me" else other_profile.get("full_name", "Them")
         convo_str += f"{who}: {msg['text']}\n"
 
+    earlier_str = (
+        f"Earlier in this conversation (summary):\n{thread_summary}\n\n"
+        if thread_summary
+        else ""
+    )
+
     # We'll ask for JSON and parse it ourselves
     json_schema_hint = {
         "summary": "string",
@@ -88,6 +424,7 @@ def chat_helper(
         "on an in-college dating app.\n\n"
         "Other person's profile:\n"
         f"{other_text}\n\n"
+        f"{earlier_str}"
         "Recent chat messages (if any):\n"
         f"{convo_str or '(no messages yet)'}\n\n"
         "1) Write a 2–3 sentence summary of the other person's vibe and interests, "
@@ -96,18 +433,44 @@ def chat_helper(
         "Respond ONLY as valid JSON with this structure:\n"
         f"{json.dumps(json_schema_hint, indent=2)}\n"
     )
+    return prompt
 
-    resp = client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=prompt,
-    )
 
-    raw = (resp.text or "").strip()
+async def achat_helper(
+    current_user_profile: Dict,
+    other_profile: Dict,
+    recent_messages: List[Dict[str, str]],
+    thread_summary: str = "",
+) -> Dict[str, List[str] | str]:
+    """
+    Summarize the other person's profile & suggest 3 non-cringe openers.
+    recent_messages: list of {"from": "me" | "them", "text": "..."}
+    thread_summary: rolling summary of the messages before those (conversation.py)
+    """
+    prompt = _chat_helper_prompt(other_profile, recent_messages, thread_summary)
     try:
-        data = json.loads(raw)
-    except json.JSONDecodeError:
+        data = await llm.agenerate_json(prompt, task="chat_helper", model=GEMINI_MODEL)
+    except llm.LLMParseError as e:
         # fallback: treat full text as summary, no openers
-        data = {"summary": raw, "openers": []}
+        data = {"summary": e.raw.strip(), "openers": []}
+    return _chat_helper_result(data)
+
+
+def chat_helper(
+    current_user_profile: Dict,
+    other_profile: Dict,
+    recent_messages: List[Dict[str, str]],
+    thread_summary: str = "",
+) -> Dict[str, List[str] | str]:
+    """achat_helper() for sync callers."""
+    return llm.run_sync(
+        achat_helper(current_user_profile, other_profile, recent_messages, thread_summary)
+    )
+
+
+def _chat_helper_result(data) -> Dict[str, List[str] | str]:
+    if not isinstance(data, dict):
+        data = {"summary": str(data), "openers": []}
 
     summary = data.get("summary", "")
     openers = data.get("openers", [])
@@ -117,3 +480,125 @@ def chat_helper(
     openers = [str(o) for o in openers][:3]
 
     return {"summary": summary, "openers": openers}
+
+
+class _ChatHelperEvents:
+    """Turns streamed chat-helper reply chunks into ("summary", ...) / ("opener", ...) events."""
+
+    def __init__(self):
+        self.parser = llm.JSONStreamParser()
+        self.raw: List[str] = []
+        self.got_summary = False
+        self.openers = 0
+
+    def feed(self, chunk: str) -> List[Tuple]:
+        self.raw.append(chunk)
+        events = []
+        for event in self.parser.feed(chunk):
+            if event[0] == "field" and event[1] == "summary" and not self.got_summary:
+                self.got_summary = True
+                events.append(("summary", str(event[2])))
+            elif event[0] == "item" and event[1] == "openers" and self.openers < 3:
+                self.openers += 1
+                events.append(("opener", event[2], str(event[3])))
+        return events
+
+    def finish(self) -> List[Tuple]:
+        if self.got_summary or self.openers:
+            return []
+        # fallback, as in chat_helper: treat full text as summary, no openers
+        return [("summary", llm.strip_code_fences("".join(self.raw)))]
+
+
+async def aiter_chat_helper(
+    current_user_profile: Dict,
+    other_profile: Dict,
+    recent_messages: List[Dict[str, str]],
+    thread_summary: str = "",
+) -> AsyncIterator[Tuple]:
+    """
+    chat_helper() streamed: yields ("summary", text) and ("opener", index, text)
+    as soon as each is complete in the model's output, in whatever order the
+    model writes them. If the reply isn't the JSON we asked for, the raw
+    text is yielded as the summary at the end. Raises llm.LLMError.
+    """
+    prompt = _chat_helper_prompt(other_profile, recent_messages, thread_summary)
+    events = _ChatHelperEvents()
+    async for chunk in llm.astream(prompt, task="chat_helper", model=GEMINI_MODEL, json_output=True):
+        for event in events.feed(chunk):
+            yield event
+    for event in events.finish():
+        yield event
+
+
+def iter_chat_helper(
+    current_user_profile: Dict,
+    other_profile: Dict,
+    recent_messages: List[Dict[str, str]],
+    thread_summary: str = "",
+) -> Iterator[Tuple]:
+    """aiter_chat_helper() for sync callers."""
+    return llm.iter_sync(
+        aiter_chat_helper(current_user_profile, other_profile, recent_messages, thread_summary)
+    )
+
+
+def chat_helper_inputs(my_profile, other_profile, messages) -> Tuple[Dict, Dict, List[Dict[str, str]]]:
+    """
+    (my profile dict, other profile dict, recent messages) for chat_helper from
+    models rows. Async callers run this on a worker thread (it lazy-loads users).
+    """
+    recent = [
+        {"from": "them" if m.from_user_id == other_profile.user_id else "me", "text": m.text or ""}
+        for m in messages
+    ]
+    return (
+        profile_to_dict(my_profile) if my_profile is not None else {},
+        profile_to_dict(other_profile),
+        recent,
+    )
+
+
+def summarize_and_suggest(
+    my_profile, other_profile, messages, thread_summary: str = ""
+) -> Tuple[str, List[str]]:
+    """
+    chat_helper for models rows: my_profile / other_profile are models.Profile
+    (my_profile may be None), messages are models.Message oldest first.
+    Returns (summary, openers).
+    """
+    result = chat_helper(*chat_helper_inputs(my_profile, other_profile, messages), thread_summary)
+    return result["summary"], result["openers"]
+
+
+async def aupdate_thread_summary(
+    summary: str, new_messages: List[Dict[str, str]], max_words: int
+) -> str:
+    """
+    Fold new messages into a thread's running summary.
+    new_messages: list of {"from": <display name>, "text": "..."}, oldest first.
+    """
+    prompt = _thread_summary_prompt(summary, new_messages, max_words)
+    return (await llm.agenerate(prompt, task="thread_summary", model=GEMINI_MODEL)).strip()
+
+
+def update_thread_summary(
+    summary: str, new_messages: List[Dict[str, str]], max_words: int
+) -> str:
+    """aupdate_thread_summary() for sync callers."""
+    return llm.run_sync(aupdate_thread_summary(summary, new_messages, max_words))
+
+
+def _thread_summary_prompt(summary: str, new_messages: List[Dict[str, str]], max_words: int) -> str:
+    lines = "".join(f"{m['from']}: {m['text']}\n" for m in new_messages)
+    return (
+        "You keep a running summary of a chat between two students on a "
+        "college dating app.\n\n"
+        "Summary so far:\n"
+        f"{summary or '(nothing yet)'}\n\n"
+        "New messages:\n"
+        f"{lines}\n"
+        f"Rewrite the summary to include the new messages in at most {max_words} words. "
+        "Keep names, plans, shared interests and open questions; drop small talk. "
+        "Respond with the summary text only."
+    )
@@ -0,0 +1,437 @@
+# backend/ann.py
+"""
+Approximate nearest-neighbor search over profile embeddings, one index per campus.
+
+IVF (inverted file): vectors are clustered around `n_lists` k-means centroids
+and a query only scans the `probes` lists whose centroids are closest to it,
+re-ranking those rows by exact cosine. More probes = better recall, slower
+queries. Small indexes (< ANN_TRAIN_MIN vectors) skip clustering and are
+searched exactly; the index trains itself once it grows past that and
+re-trains whenever it has grown 4x since the last training.
+
+Indexes are built from the stored profile embeddings on first use, kept up to
+date by upsert_profile (insert / delete), and saved under ANN_INDEX_DIR so a
+restart loads them instead of rebuilding. Each vector remembers the
+embedding_key it was made from; a loaded index, and every index at least every
+ANN_SYNC_SECONDS, is checked against profiles.embedding_key and patched (or
+rebuilt), so edits saved by another worker or lost in a crash before the
+index was written back still reach the shortlists.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Query, Session
+
+from . import models, embeddings
+
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "./ann_index")
+# Number of IVF lists; 0 = sqrt(size) at training time
+ANN_LISTS = int(os.getenv("ANN_LISTS", "0"))
+ANN_PROBES = int(os.getenv("ANN_PROBES", "16"))
+ANN_TRAIN_MIN = int(os.getenv("ANN_TRAIN_MIN", "2000"))
+# Write an index back to disk after this many inserts/deletes
+ANN_SAVE_EVERY = int(os.getenv("ANN_SAVE_EVERY", "200"))
+# Fetch this many times top_k from the index, since SQL filters may drop some;
+# shortlist widens the search (twice as many, then every list) until enough pass
+ANN_OVERSAMPLE = int(os.getenv("ANN_OVERSAMPLE", "2"))
+# Re-check an in-memory index against profiles.embedding_key this often (seconds)
+ANN_SYNC_SECONDS = float(os.getenv("ANN_SYNC_SECONDS", "60"))
+
+_KMEANS_ITERS = 10
+_KMEANS_SAMPLE_PER_LIST = 64
+_CHUNK = 16384
+
+
+def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """argmax cosine centroid per row, chunked to bound the (n, n_lists) temp."""
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _CHUNK):
+        out[start:start + _CHUNK] = np.argmax(vectors[start:start + _CHUNK] @ centroids.T, axis=1)
+    return out
+
+
+def _spherical_kmeans(data: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(_KMEANS_ITERS):
+        assign = _nearest_centroid(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        empty = np.bincount(assign, minlength=k) == 0
+        sums[empty] = data[rng.choice(len(data), int(empty.sum()))]  # re-seed
+        centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, dim: int, n_lists: int = ANN_LISTS, train_min: int = ANN_TRAIN_MIN, seed: int = 0):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.train_min = train_min
+        self._rng = np.random.default_rng(seed)
+        self.centroids: Optional[np.ndarray] = None
+        self._trained_size = 0
+
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)  # -1 marks a free row
+        self._assign = np.zeros(0, dtype=np.int64)  # list of each row
+        self._row_of: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}  # cached np views of _lists
+        self.keys: Dict[int, str] = {}  # id -> embedding_key its vector was made from
+        self.dirty = 0
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    # --- mutation --------------------------------------------------------
+
+    def _grow(self, needed: int) -> None:
+        cap = len(self._ids)
+        if needed <= cap:
+            return
+        new_cap = max(needed, 2 * cap, 64)
+        matrix = np.zeros((new_cap, self.dim), dtype=np.float32)
+        matrix[:cap] = self._matrix
+        self._matrix = matrix
+        ids = np.full(new_cap, -1, dtype=np.int64)
+        ids[:cap] = self._ids
+        self._ids = ids
+        assign = np.full(new_cap, -1, dtype=np.int64)
+        assign[:cap] = self._assign
+        self._assign = assign
+        self._free.extend(range(new_cap - 1, cap - 1, -1))
+
+    def _fill_lists(self, rows: np.ndarray) -> None:
+        """Append rows to their lists, one extend per list."""
+        order = np.argsort(self._assign[rows], kind="stable")
+        lists, starts = np.unique(self._assign[rows][order], return_index=True)
+        for lst, group in zip(lists.tolist(), np.split(rows[order], starts[1:])):
+            self._lists[lst].extend(group.tolist())
+            self._list_arrays.pop(lst, None)
+
+    def add(
+        self, ids: Iterable[int], vectors: np.ndarray, keys: Optional[Iterable[str]] = None
+    ) -> None:
+        """Insert (or replace) many vectors. Vectors should be unit length."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return
+        for i in ids:
+            self.remove(i)
+        self._grow(len(self._row_of) + len(ids))
+        rows = np.array([self._free.pop() for _ in ids], dtype=np.int64)
+        self._matrix[rows] = vectors
+        self._ids[rows] = ids
+        self._row_of.update(zip(ids, rows.tolist()))
+        if keys is not None:
+            self.keys.update(zip(ids, keys))
+        self.dirty += len(ids)
+
+        if self.trained:
+            self._assign[rows] = _nearest_centroid(self._matrix[rows], self.centroids)
+            self._fill_lists(rows)
+        if len(self) >= self.train_min and len(self) >= 4 * self._trained_size:
+            self.train()
+
+    def remove(self, id_: int) -> bool:
+        row = self._row_of.pop(id_, None)
+        if row is None:
+            return False
+        self.keys.pop(id_, None)
+        lst = int(self._assign[row])
+        if lst >= 0:
+            self._lists[lst].remove(row)
+            self._list_arrays.pop(lst, None)
+        self._ids[row] = -1
+        self._assign[row] = -1
+        self._free.append(row)
+        self.dirty += 1
+        return True
+
+    def _live_rows(self) -> np.ndarray:
+        return np.fromiter(self._row_of.values(), dtype=np.int64, count=len(self._row_of))
+
+    def train(self) -> None:
+        """(Re)cluster the current vectors and reassign every row to a list."""
+        rows = self._live_rows()
+        n_lists = self.n_lists or int(np.sqrt(len(rows)))
+        n_lists = max(1, min(n_lists, len(rows)))
+        sample = rows
+        if len(rows) > n_lists * _KMEANS_SAMPLE_PER_LIST:
+            sample = self._rng.choice(rows, n_lists * _KMEANS_SAMPLE_PER_LIST, replace=False)
+        self.centroids = _spherical_kmeans(self._matrix[sample], n_lists, self._rng)
+        self._assign[rows] = _nearest_centroid(self._matrix[rows], self.centroids)
+        self._lists = [[] for _ in range(n_lists)]
+        self._list_arrays = {}
+        self._fill_lists(rows)
+        self._trained_size = len(rows)
+        self.dirty += 1
+
+    # --- search ----------------------------------------------------------
+
+    def _list_rows(self, lst: int) -> np.ndarray:
+        arr = self._list_arrays.get(lst)
+        if arr is None:
+            arr = self._list_arrays[lst] = np.array(self._lists[lst], dtype=np.int64)
+        return arr
+
+    def _candidate_rows(self, query: np.ndarray, probes: Optional[int]) -> np.ndarray:
+        if not self.trained or probes is None:
+            return self._live_rows()
+        probes = max(1, min(probes, len(self.centroids)))
+        sims = self.centroids @ query
+        nearest = np.argpartition(-sims, probes - 1)[:probes]
+        return np.concatenate([self._list_rows(int(lst)) for lst in nearest])
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        probes: Optional[int] = ANN_PROBES,
+        exclude: Optional[int] = None,
+    ) -> List[Tuple[int, float]]:
+        """Approximate top-k (id, cosine), best first. probes=None scans every list (exact)."""
+        query = np.asarray(query, dtype=np.float32)
+        rows = self._candidate_rows(query, probes)
+        if exclude is not None and exclude in self._row_of:
+            rows = rows[rows != self._row_of[exclude]]
+        if len(rows) == 0 or k <= 0:
+            return []
+        sims = self._matrix[rows] @ query
+        if k < len(rows):
+            top = np.argpartition(-sims, k - 1)[:k]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-sims[top], kind="stable")]
+        return [(int(self._ids[rows[i]]), float(sims[i])) for i in top]
+
+    # --- persistence -----------------------------------------------------
+
+    def save(self, path: str) -> None:
+        live = self._live_rows()
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            meta=np.array([self.dim, self.n_lists, self.train_min, self._trained_size]),
+            centroids=self.centroids if self.trained else np.zeros((0, self.dim), np.float32),
+            ids=self._ids[live],
+            vectors=self._matrix[live],
+            assign=self._assign[live],
+            keys=np.array([self.keys.get(int(i), "") for i in self._ids[live]], dtype=str),
+        )
+        os.replace(tmp, path)  # never leave a half-written index behind
+        self.dirty = 0
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        data = np.load(path)
+        dim, n_lists, train_min, trained_size = (int(x) for x in data["meta"])
+        index = cls(dim, n_lists, train_min)
+        ids = data["ids"]
+        n = len(ids)
+        index._grow(n)
+        index._free = list(range(len(index._ids) - 1, n - 1, -1))
+        index._matrix[:n] = data["vectors"]
+        index._ids[:n] = ids
+        index._row_of = {int(i): row for row, i in enumerate(ids)}
+        if "keys" in data.files:  # older files have none: every vector gets re-checked
+            index.keys = {int(i): str(k) for i, k in zip(ids, data["keys"]) if k}
+        if len(data["centroids"]):
+            # Stored assignments: no re-clustering or re-assignment on restart
+            index.centroids = data["centroids"]
+            index._trained_size = trained_size
+            index._assign[:n] = data["assign"]
+            index._lists = [[] for _ in range(len(index.centroids))]
+            index._fill_lists(np.arange(n, dtype=np.int64))
+        return index
+
+
+# --- per-campus registry ---------------------------------------------------
+
+_indexes: Dict[str, IVFIndex] = {}
+_campus_of: Dict[int, str] = {}
+_synced_at: Dict[str, float] = {}  # campus -> time.monotonic() of the last DB check
+_lock = threading.Lock()
+
+
+def _path(campus: str) -> str:
+    safe = "".join(ch if ch.isalnum() else "_" for ch in campus)
+    return os.path.join(ANN_INDEX_DIR, f"{safe}.npz")
+
+
+def _build(db: Session, campus: str) -> IVFIndex:
+    profiles = db.query(models.Profile).filter(models.Profile.campus == campus).all()
+    if embeddings.ensure_embeddings(profiles):
+        db.commit()
+    dim = _dim(profiles)
+    index = IVFIndex(dim)
+    if profiles:
+        index.add(
+            [p.user_id for p in profiles],
+            np.vstack([embeddings.unpack(p.embedding) for p in profiles]),
+            [p.embedding_key for p in profiles],
+        )
+    return index
+
+
+def _sync(db: Session, campus: str, index: IVFIndex) -> IVFIndex:
+    """
+    Patch index to match the campus's stored embeddings: drop profiles that
+    left, (re)add ones that are missing or were re-embedded since. Rebuilt
+    from scratch instead when most of it is out of date.
+    """
+    stored = dict(
+        db.query(models.Profile.user_id, models.Profile.embedding_key)
+        .filter(models.Profile.campus == campus)
+        .all()
+    )
+    stale = [uid for uid, key in stored.items() if key is None or index.keys.get(uid) != key]
+    if len(stale) > len(stored) // 2:
+        return _build(db, campus)
+    for uid in [uid for uid in index._row_of if uid not in stored]:
+        index.remove(uid)
+        if _campus_of.get(uid) == campus:
+            del _campus_of[uid]
+    for start in range(0, len(stale), 500):
+        profiles = (
+            db.query(models.Profile)
+            .filter(models.Profile.user_id.in_(stale[start:start + 500]))
+            .all()
+        )
+        if embeddings.ensure_embeddings(profiles):
+            db.commit()
+        profiles = [p for p in profiles if len(embeddings.unpack(p.embedding)) == index.dim]
+        if profiles:
+            index.add(
+                [p.user_id for p in profiles],
+                np.vstack([embeddings.unpack(p.embedding) for p in profiles]),
+                [p.embedding_key for p in profiles],
+            )
+    return index
+
+
+def _dim(profiles) -> int:
+    for p in profiles:
+        if p.embedding is not None:
+            return len(embeddings.unpack(p.embedding))
+    return embeddings.get_embedder().dim
+
+
+def campus_index(db: Session, campus: str, dim: int) -> IVFIndex:
+    """
+    The campus's index: in memory, else from disk, else built from the DB.
+    An index of the wrong dimension (the embedder changed) is rebuilt; one
+    loaded from disk or not checked for ANN_SYNC_SECONDS is synced with the DB.
+    """
+    with _lock:
+        now = time.monotonic()
+        index = _indexes.get(campus)
+        if index is None:
+            path = _path(campus)
+            index = IVFIndex.load(path) if os.path.exists(path) else None
+        if index is None or (index.dim != dim and len(index)):
+            index = _build(db, campus)
+        elif now - _synced_at.get(campus, float("-inf")) >= ANN_SYNC_SECONDS:
+            index = _sync(db, campus, index)
+        else:
+            return index
+        if index.dim != dim:  # empty index built before any vector existed
+            index = IVFIndex(dim)
+        _indexes[campus] = index
+        _synced_at[campus] = now
+        for user_id in index._row_of:
+            _campus_of[user_id] = campus
+        return index
+
+
+def on_profile_saved(db: Session, profile: models.Profile) -> None:
+    """Move profile's vector into its (possibly new) campus index."""
+    if embeddings.ensure_embeddings([profile]):
+        db.commit()
+    vector = embeddings.unpack(profile.embedding)
+    old_campus = _campus_of.get(profile.user_id)
+    index = campus_index(db, profile.campus, len(vector))
+    with _lock:
+        if old_campus is not None and old_campus != profile.campus and old_campus in _indexes:
+            _indexes[old_campus].remove(profile.user_id)
+            _maybe_save(old_campus)
+        index.add([profile.user_id], vector[None, :], [profile.embedding_key])
+        _campus_of[profile.user_id] = profile.campus
+        _maybe_save(profile.campus)
+
+
+def _maybe_save(campus: str, force: bool = False) -> None:
+    index = _indexes[campus]
+    if index.dirty and (force or index.dirty >= ANN_SAVE_EVERY):
+        os.makedirs(ANN_INDEX_DIR, exist_ok=True)
+        index.save(_path(campus))
+
+
+def save_all() -> None:
+    with _lock:
+        for campus in list(_indexes):
+            _maybe_save(campus, force=True)
+
+
+def neighbor_ids(
+    db: Session, my_profile: models.Profile, k: int, probes: Optional[int] = ANN_PROBES
+) -> List[Tuple[int, float]]:
+    """Approximate top-k (user_id, cosine) for my_profile within its campus."""
+    if embeddings.ensure_embeddings([my_profile]):
+        db.commit()
+    vector = embeddings.unpack(my_profile.embedding)
+    index = campus_index(db, my_profile.campus, len(vector))
+    # on_profile_saved adds / removes rows (and may re-train) under the lock
+    with _lock:
+        return index.search(vector, k, probes=probes, exclude=my_profile.user_id)
+
+
+def shortlist(
+    db: Session,
+    my_profile: models.Profile,
+    candidates: Query,
+    top_k: int,
+    probes: Optional[int] = ANN_PROBES,
+) -> List[Tuple[models.Profile, float]]:
+    """
+    ANN counterpart of embeddings.shortlist. `candidates` is the (unexecuted)
+    candidate query; only the index's nearest ids are loaded from it, so SQL
+    filters still apply without scanning the campus. Scores are cosine in 0..100.
+
+    When the filters drop so many that fewer than top_k pass, the search is
+    widened (twice as many ids; once the probed lists run dry, every list)
+    and only the new ids are checked, until top_k pass or the campus runs out.
+    """
+    if top_k <= 0:
+        return []
+    k = top_k * ANN_OVERSAMPLE
+    checked: Dict[int, float] = {}
+    passed: Dict[int, models.Profile] = {}
+    while True:
+        hits = neighbor_ids(db, my_profile, k, probes)
+        new = [uid for uid, _ in hits if uid not in checked]
+        checked.update(hits)
+        if new:
+            for p in candidates.filter(models.Profile.user_id.in_(new)).all():
+                passed[p.user_id] = p
+        if len(passed) >= top_k:
+            break
+        if len(hits) == k:
+            k *= 2
+        elif probes is not None:
+            probes = None  # the probed lists are exhausted: scan them all
+        else:
+            break  # every indexed profile on the campus has been checked
+    ranked = sorted(
+        ((p, 100.0 * max(0.0, checked[uid])) for uid, p in passed.items()),
+        key=lambda ps: (-ps[1], ps[0].user_id),
+    )
+    return ranked[:top_k]
@@ -0,0 +1,86 @@
+# backend/ann_benchmark.py
+"""
+Recall / latency of the IVF index (ann.py) vs exact cosine search.
+
+    python -m backend.ann_benchmark                       # 10k, 100k, 1M
+    python -m backend.ann_benchmark --sizes 10000 --probes 0 2 4
+
+Profiles are synthetic: unit vectors scattered around random "taste"
+clusters, so neighbors are meaningful the way real profiles' are.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .ann import IVFIndex, ANN_LISTS
+
+
+def synthetic_vectors(n: int, dim: int, rng: np.random.Generator, clusters: int = 200) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)]
+    vectors += 0.4 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def exact_top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    sims = matrix @ query
+    top = np.argpartition(-sims, k - 1)[:k]
+    return top[np.argsort(-sims[top])]
+
+
+def _ms(samples) -> str:
+    samples = np.asarray(samples) * 1000
+    return f"{samples.mean():8.2f} {np.percentile(samples, 95):8.2f}"
+
+
+def run(size: int, args, rng: np.random.Generator) -> None:
+    vectors = synthetic_vectors(size, args.dim, rng)
+    queries = synthetic_vectors(args.queries, args.dim, rng)
+
+    t0 = time.perf_counter()
+    index = IVFIndex(args.dim, n_lists=args.lists)
+    index.add(range(size), vectors)
+    build_s = time.perf_counter() - t0
+
+    exact, exact_times = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        exact.append(set(exact_top_k(vectors, q, args.k).tolist()))
+        exact_times.append(time.perf_counter() - t0)
+
+    n_lists = len(index.centroids) if index.trained else 0
+    print(f"\n{size:,} profiles, dim={args.dim}, lists={n_lists}, k={args.k}, "
+          f"build {build_s:.2f}s")
+    print(f"{'method':>12} {'recall':>7} {'mean ms':>8} {'p95 ms':>8}")
+    print(f"{'exact':>12} {1.0:7.3f} {_ms(exact_times)}")
+    for probes in args.probes:
+        hits, times = 0, []
+        for q, truth in zip(queries, exact):
+            t0 = time.perf_counter()
+            found = index.search(q, args.k, probes=probes)
+            times.append(time.perf_counter() - t0)
+            hits += len(truth & {i for i, _ in found})
+        recall = hits / (args.k * len(queries))
+        print(f"{f'ivf p={probes}':>12} {recall:7.3f} {_ms(times)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--lists", type=int, default=ANN_LISTS, help="0 = sqrt(size)")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for size in args.sizes:
+        run(size, args, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,13 @@ def verify_password(password: str, hashed: str) -> bool:
     return pwd_context.verify(password, hashed)
 
 
+def authenticate_user(db, email: str, password: str) -> Optional[models.User]:
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if user is None or not verify_password(password, user.hashed_password):
+        return None
+    return user
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -45,8 +52,8 @@ def get_current_user(token: str = Depends(oauth2_scheme)) -> models.User:
     if user_id is None:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    db = SessionLocal()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    with SessionLocal() as db:
+        user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     return user
@@ -0,0 +1,111 @@
+# backend/chat_cache.py
+"""
+Cache for /ai/chat-helper results.
+
+A result is keyed by both users, both profiles' fingerprints and the id of
+the last message in their thread, so it stays valid until one of them edits
+their profile or someone sends a message. Lookups go to an in-process LRU
+with a TTL first, then (with CHAT_CACHE_PERSIST=1) to the ai_cache table,
+which survives restarts and is shared by every worker process.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, match_cache
+
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1024"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "86400"))  # seconds
+CHAT_CACHE_PERSIST = os.getenv("CHAT_CACHE_PERSIST", "0") == "1"
+
+
+class LRUCache:
+    """Thread-safe LRU with a per-entry TTL."""
+
+    def __init__(self, maxsize: int = CHAT_CACHE_SIZE, ttl: float = CHAT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+_memory = LRUCache()
+
+
+def chat_helper_key(
+    my_profile: Optional[models.Profile],
+    other_profile: models.Profile,
+    last_message_id: Optional[int],
+) -> str:
+    my_fingerprint = match_cache.profile_fingerprint(my_profile) if my_profile is not None else ""
+    parts = [
+        "chat_helper",
+        str(my_profile.user_id if my_profile is not None else ""),
+        str(other_profile.user_id),
+        my_fingerprint,
+        match_cache.profile_fingerprint(other_profile),
+        str(last_message_id or 0),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def get(db: Session, key: str) -> Optional[Dict]:
+    value = _memory.get(key)
+    if value is not None or not CHAT_CACHE_PERSIST:
+        return value
+
+    row = db.query(models.AICacheEntry).filter(models.AICacheEntry.key == key).first()
+    if row is None:
+        return None
+    remaining = (row.expires_at - datetime.utcnow()).total_seconds()
+    if remaining <= 0:
+        db.delete(row)
+        db.commit()
+        return None
+    value = json.loads(row.value)
+    _memory.put(key, value, ttl=remaining)
+    return value
+
+
+def put(db: Session, key: str, value: Dict) -> None:
+    """Store in memory and, if enabled, in ai_cache. Caller commits."""
+    _memory.put(key, value)
+    if CHAT_CACHE_PERSIST:
+        db.merge(
+            models.AICacheEntry(
+                key=key,
+                value=json.dumps(value),
+                expires_at=datetime.utcnow() + timedelta(seconds=CHAT_CACHE_TTL),
+            )
+        )
@@ -0,0 +1,276 @@
+# backend/conversation.py
+"""
+Bounded chat context for /ai/chat-helper.
+
+Each thread keeps a rolling summary (thread_summaries) of everything before
+its recent window. Messages that have left the window are folded into the
+summary (each exactly once, in CHAT_FOLD_BATCH-sized model calls) mostly in
+the background: once a full batch is waiting, sending a message queues a
+fold_threads job (job_queue.py) and the worker folds them. build_context()
+reads only the newest few messages, folds at most CHAT_MAX_FOLDS_PER_REQUEST
+batches of whatever is left, and returns the summary plus the recent window
+trimmed to CHAT_PROMPT_TOKEN_BUDGET. Prompt size, rows read and model calls
+per request stay the same however long the conversation gets.
+abuild_context() is the same for async endpoints.
+"""
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from . import models, ai, job_queue, llm, match_cache
+from .db import run_db
+
+# Token budget for thread context in the prompt (summary + recent messages)
+CHAT_PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "1200"))
+CHAT_SUMMARY_WORDS = int(os.getenv("CHAT_SUMMARY_WORDS", "120"))
+CHAT_RECENT_MESSAGES = int(os.getenv("CHAT_RECENT_MESSAGES", "10"))
+CHAT_FOLD_BATCH = int(os.getenv("CHAT_FOLD_BATCH", "50"))
+# Summary folds (model calls) a chat-helper request may make; the rest is the worker's
+CHAT_MAX_FOLDS_PER_REQUEST = int(os.getenv("CHAT_MAX_FOLDS_PER_REQUEST", "1"))
+
+
+def thread_filter(user_id: int, other_user_id: int):
+    """SQL condition for messages between the two users, either direction."""
+    return (
+        (models.Message.from_user_id == user_id) & (models.Message.to_user_id == other_user_id)
+    ) | (
+        (models.Message.from_user_id == other_user_id) & (models.Message.to_user_id == user_id)
+    )
+
+
+def _message_tokens(message: models.Message) -> int:
+    return llm.estimate_tokens(message.text or "") + 4  # + speaker label
+
+
+def _clip_words(text: str, max_words: int) -> str:
+    words = text.split()
+    return text if len(words) <= max_words else " ".join(words[:max_words]) + " ..."
+
+
+def _read_window(
+    db: Session, user_id: int, other_user_id: int
+) -> Tuple[str, int, List[models.Message], int]:
+    """
+    (summary, through_message_id, recent window oldest first, id of the
+    window's first message). The id is read here, while the rows are
+    loaded: async callers get them back expired by run_db's commit.
+    """
+    low, high = match_cache.canonical(user_id, other_user_id)
+    row = (
+        db.query(models.ThreadSummary)
+        .filter(models.ThreadSummary.user_id == low)
+        .filter(models.ThreadSummary.other_user_id == high)
+        .first()
+    )
+    summary = row.summary if row is not None else ""
+    through = row.through_message_id if row is not None else 0
+
+    # Recent window: newest messages that fit next to the summary
+    newest = (
+        db.query(models.Message)
+        .filter(thread_filter(user_id, other_user_id))
+        .order_by(models.Message.id.desc())
+        .limit(CHAT_RECENT_MESSAGES)
+        .all()
+    )
+    budget = CHAT_PROMPT_TOKEN_BUDGET - llm.estimate_tokens(summary)
+    recent: List[models.Message] = []
+    used = 0
+    for message in newest:
+        cost = _message_tokens(message)
+        if recent and used + cost > budget:
+            break
+        recent.append(message)
+        used += cost
+    recent.reverse()
+    return summary, through, recent, (recent[0].id if recent else 0)
+
+
+def _read_backlog(
+    db: Session, user_id: int, other_user_id: int, through: int, before_id: int, names: Dict[int, str]
+) -> Tuple[List[Dict[str, str]], int]:
+    """Next CHAT_FOLD_BATCH messages between the summary and the window, as prompt lines."""
+    backlog = (
+        db.query(models.Message)
+        .filter(thread_filter(user_id, other_user_id))
+        .filter(models.Message.id > through)
+        .filter(models.Message.id < before_id)
+        .order_by(models.Message.id.asc())
+        .limit(CHAT_FOLD_BATCH)
+        .all()
+    )
+    lines = [{"from": names.get(m.from_user_id, "Someone"), "text": m.text or ""} for m in backlog]
+    return lines, (backlog[-1].id if backlog else through)
+
+
+def _save_summary(db: Session, user_id: int, other_user_id: int, summary: str, through: int) -> None:
+    """
+    Upsert the thread's summary row. Two requests may fold the same thread at
+    once (both saw no row, or the same one): whichever has folded further
+    wins, the other write is a no-op. Caller commits.
+    """
+    low, high = match_cache.canonical(user_id, other_user_id)
+    now = datetime.utcnow()
+    stmt = insert(models.ThreadSummary).values(
+        user_id=low,
+        other_user_id=high,
+        summary=summary,
+        through_message_id=through,
+        updated_at=now,
+    )
+    table = models.ThreadSummary.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.other_user_id],
+        set_={"summary": summary, "through_message_id": through, "updated_at": now},
+        where=table.c.through_message_id < through,
+    )
+    db.execute(stmt)
+
+
+def _fold(
+    db: Session,
+    user_id: int,
+    other_user_id: int,
+    names: Dict[int, str],
+    summary: str,
+    through: int,
+    before_id: int,
+    max_folds: Optional[int],
+) -> str:
+    """
+    Fold the backlog before before_id into summary, at most max_folds
+    batches (None: all of it), committing after each. Returns the summary;
+    if the model fails, the last one stored.
+    """
+    folds = 0
+    while max_folds is None or folds < max_folds:
+        lines, last_id = _read_backlog(db, user_id, other_user_id, through, before_id, names)
+        if not lines:
+            break
+        try:
+            updated = ai.update_thread_summary(summary, lines, CHAT_SUMMARY_WORDS)
+        except llm.LLMError:
+            break  # keep the older summary; the backlog is folded next time
+        summary = _clip_words(updated, CHAT_SUMMARY_WORDS * 3 // 2)
+        through = last_id
+        _save_summary(db, user_id, other_user_id, summary, through)
+        db.commit()
+        folds += 1
+    return summary
+
+
+def build_context(
+    db: Session, user_id: int, other_user_id: int, names: Dict[int, str]
+) -> Tuple[str, List[models.Message]]:
+    """
+    (thread summary, recent messages oldest first) for a chat-helper prompt.
+    names maps both user ids to display names for the summary. Up to
+    CHAT_MAX_FOLDS_PER_REQUEST summary updates are made and committed; any
+    backlog beyond that is left to the worker (fold_threads).
+    """
+    summary, through, recent, before_id = _read_window(db, user_id, other_user_id)
+    if not recent:
+        return summary, []
+    summary = _fold(
+        db, user_id, other_user_id, names, summary, through, before_id, CHAT_MAX_FOLDS_PER_REQUEST
+    )
+    return summary, recent
+
+
+async def abuild_context(
+    db: Session, user_id: int, other_user_id: int, names: Dict[int, str]
+) -> Tuple[str, List[models.Message]]:
+    """
+    build_context() for async endpoints: DB reads and writes run on worker
+    threads (run_db), summary folds are awaited on the event loop.
+    """
+    summary, through, recent, before_id = await run_db(
+        db, _read_window, db, user_id, other_user_id
+    )
+    if not recent:
+        return summary, []
+
+    for _ in range(CHAT_MAX_FOLDS_PER_REQUEST):
+        lines, last_id = await run_db(
+            db, _read_backlog, db, user_id, other_user_id, through, before_id, names
+        )
+        if not lines:
+            break
+        try:
+            updated = await ai.aupdate_thread_summary(summary, lines, CHAT_SUMMARY_WORDS)
+        except llm.LLMError:
+            break
+        summary = _clip_words(updated, CHAT_SUMMARY_WORDS * 3 // 2)
+        through = last_id
+        await run_db(db, _save_summary, db, user_id, other_user_id, summary, through)
+
+    return summary, recent
+
+
+# --- background folding -------------------------------------------------------
+
+
+def _backlog_at_least(db: Session, user_id: int, other_user_id: int, n: int) -> bool:
+    """
+    True if at least n messages wait between the stored summary and the
+    newest CHAT_RECENT_MESSAGES. Reads at most that many ids.
+    """
+    low, high = match_cache.canonical(user_id, other_user_id)
+    through = (
+        db.query(models.ThreadSummary.through_message_id)
+        .filter(models.ThreadSummary.user_id == low)
+        .filter(models.ThreadSummary.other_user_id == high)
+        .scalar()
+    )
+    nth = (
+        db.query(models.Message.id)
+        .filter(thread_filter(user_id, other_user_id))
+        .filter(models.Message.id > (through or 0))
+        .order_by(models.Message.id.desc())
+        .offset(CHAT_RECENT_MESSAGES + n - 1)
+        .first()
+    )
+    return nth is not None
+
+
+def on_message_sent(db: Session, from_user_id: int, to_user_id: int) -> None:
+    """
+    Queue a fold_threads job for the pair once a full CHAT_FOLD_BATCH has
+    left the recent window, so the chat helper finds the summary up to date.
+    The job belongs to the pair's lower user id. Caller commits.
+    """
+    if _backlog_at_least(db, from_user_id, to_user_id, CHAT_FOLD_BATCH):
+        low, _ = match_cache.canonical(from_user_id, to_user_id)
+        job_queue.enqueue(db, job_queue.JOB_FOLD_THREADS, low, job_queue.PRIORITY_ACTIVE_TODAY)
+
+
+def fold_threads(db: Session, user_id: int) -> int:
+    """
+    Worker side of on_message_sent: fold the whole backlog of every thread
+    between user_id and a higher user id. Returns how many threads were
+    looked at.
+    """
+    sent = (
+        db.query(models.Message.to_user_id)
+        .filter(models.Message.from_user_id == user_id)
+        .filter(models.Message.to_user_id > user_id)
+    )
+    received = (
+        db.query(models.Message.from_user_id)
+        .filter(models.Message.to_user_id == user_id)
+        .filter(models.Message.from_user_id > user_id)
+    )
+    other_ids = sorted({uid for (uid,) in sent.union(received)})
+    names = {
+        uid: full_name or "Someone"
+        for uid, full_name in db.query(models.User.id, models.User.full_name)
+        .filter(models.User.id.in_([user_id] + other_ids))
+    }
+    for other_user_id in other_ids:
+        summary, through, recent, before_id = _read_window(db, user_id, other_user_id)
+        if recent:
+            _fold(db, user_id, other_user_id, names, summary, through, before_id, None)
+    return len(other_ids)
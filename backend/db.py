@@ -1,5 +1,8 @@
 # backend/db.py
-from sqlalchemy import create_engine
+import asyncio
+from typing import Any, Callable
+
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = "sqlite:///./college_match_gemini.db"
@@ -11,3 +14,45 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+
+async def run_db(db, fn: Callable[..., Any], *args) -> Any:
+    """
+    fn(*args) on a worker thread for async endpoints, then end db's
+    transaction: committed, or rolled back if fn raised. The session's pooled
+    connection goes back to the pool instead of being held while the caller
+    awaits a model call.
+    """
+    def call():
+        try:
+            result = fn(*args)
+            db.commit()
+            return result
+        except BaseException:
+            db.rollback()
+            raise
+
+    return await asyncio.to_thread(call)
+
+
+def add_missing_columns(bind=engine):
+    """
+    create_all() only creates missing tables, it never alters existing ones.
+    Add any columns / indexes declared on the models since the DB file was made.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            have = {c["name"] for c in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in have:
+                    continue
+                col_type = col.type.compile(dialect=bind.dialect)
+                conn.execute(
+                    text(f'ALTER TABLE {table.name} ADD COLUMN "{col.name}" {col_type}')
+                )
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
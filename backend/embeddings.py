@@ -0,0 +1,159 @@
+# backend/embeddings.py
+"""
+Profile embeddings for nearest-neighbor matching.
+
+Each profile's text (ai.profile_to_text) is embedded once and stored on the
+row as a packed float32 BLOB, together with a key of (embedder, text) so it
+is only recomputed when the profile or the embedder changes. Matching is then
+one matrix-vector cosine product over the campus.
+
+The embedder is picked with EMBEDDER=hashing (default, deterministic, offline)
+or EMBEDDER=gemini.
+"""
+import hashlib
+import os
+import re
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models, ai, llm
+
+EMBEDDER = os.getenv("EMBEDDER", "hashing")
+HASHING_DIM = int(os.getenv("HASHING_EMBEDDER_DIM", "256"))
+GEMINI_EMBED_MODEL = os.getenv("GEMINI_EMBED_MODEL", "gemini-embedding-001")
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+# "Major:", "Class year:" ... field labels every profile text shares
+_LABEL_RE = re.compile(r"^[A-Za-z ]+:", re.MULTILINE)
+
+
+class Embedder:
+    """Turns texts into L2-normalized float32 vectors of a fixed size."""
+
+    name = "base"
+    dim = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """
+    Feature-hashed bag of words + bigrams. No model, no network, and the same
+    text always maps to the same vector (blake2b, not Python's salted hash()).
+    """
+
+    def __init__(self, dim: int = HASHING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        tokens = _TOKEN_RE.findall(_LABEL_RE.sub(" ", text).lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat in self._features(text):
+                digest = hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest()
+                h = int.from_bytes(digest, "little")
+                # low bits pick the bucket, one high bit picks the sign
+                out[row, h % self.dim] += 1.0 if (h >> 63) else -1.0
+        return _normalize(out)
+
+
+class GeminiEmbedder(Embedder):
+    def __init__(self, model: str = GEMINI_EMBED_MODEL):
+        self.model = model
+        self.name = f"gemini-{model}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.array(llm.embed(texts, model=self.model), dtype=np.float32)
+        self.dim = vectors.shape[1]
+        return _normalize(vectors)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+_embedder = None
+
+
+def get_embedder() -> Embedder:
+    global _embedder
+    if _embedder is None:
+        _embedder = GeminiEmbedder() if EMBEDDER == "gemini" else HashingEmbedder()
+    return _embedder
+
+
+def pack(vector: np.ndarray) -> bytes:
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def unpack(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype="<f4")
+
+
+def _embedding_key(embedder: Embedder, text: str) -> str:
+    return hashlib.sha256(f"{embedder.name}\x1f{text}".encode("utf-8")).hexdigest()
+
+
+def ensure_embeddings(
+    profiles: Sequence[models.Profile], embedder: Optional[Embedder] = None
+) -> int:
+    """
+    (Re)compute embeddings for profiles whose text or embedder changed, in one
+    embed() call. Returns how many were updated. Caller commits.
+    """
+    embedder = embedder or get_embedder()
+    todo = []
+    for p in profiles:
+        text = ai.profile_to_text(ai.profile_to_dict(p))
+        key = _embedding_key(embedder, text)
+        if p.embedding is None or p.embedding_key != key:
+            todo.append((p, text, key))
+    if not todo:
+        return 0
+    vectors = embedder.embed([text for _, text, _ in todo])
+    for (p, _, key), vec in zip(todo, vectors):
+        p.embedding = pack(vec)
+        p.embedding_key = key
+    return len(todo)
+
+
+def similarity_scores(
+    my_profile: models.Profile, candidates: Sequence[models.Profile]
+) -> np.ndarray:
+    """Cosine similarity mapped to 0..100 for each candidate, in input order."""
+    if not candidates:
+        return np.zeros(0)
+    matrix = np.vstack([unpack(p.embedding) for p in candidates])
+    cosine = matrix @ unpack(my_profile.embedding)  # rows are unit length
+    return 100.0 * np.clip(cosine.astype(np.float64), 0.0, 1.0)
+
+
+def shortlist(
+    db: Session,
+    my_profile: models.Profile,
+    candidates: Sequence[models.Profile],
+    top_k: int,
+) -> List[Tuple[models.Profile, float]]:
+    """
+    Embedding counterpart of prerank.shortlist: best top_k by cosine, highest
+    first. Fills in any missing / outdated embeddings first (and commits them).
+    """
+    if top_k <= 0 or not candidates:
+        return []
+    if ensure_embeddings([my_profile, *candidates]):
+        db.commit()
+    scores = similarity_scores(my_profile, candidates)
+    if top_k < len(candidates):
+        idx = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        idx = np.arange(len(candidates))
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    return [(candidates[i], float(scores[i])) for i in idx]
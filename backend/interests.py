@@ -0,0 +1,106 @@
+# backend/interests.py
+"""
+Normalized interest index (interests + profile_interests tables).
+
+upsert_profile keeps it in sync; run `python -m backend.interests` once to
+backfill rows for profiles saved before the tables existed.
+"""
+from typing import Dict, Iterable, List
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Query, Session
+
+from . import models
+
+
+def normalize(name: str) -> str:
+    """The one spelling of an interest, here and in the local ranker (prerank.interest_set)."""
+    return " ".join(name.strip().lower().split())
+
+
+def _lookup(db: Session, names: Iterable[str]) -> Dict[str, int]:
+    return dict(
+        db.query(models.Interest.name, models.Interest.id)
+        .filter(models.Interest.name.in_(list(names)))
+        .all()
+    )
+
+
+def interest_ids(db: Session, names: Iterable[str]) -> List[int]:
+    """Vocabulary ids for names, creating missing entries. Caller commits."""
+    wanted = {normalize(n) for n in names if n and n.strip()}
+    if not wanted:
+        return []
+    existing = _lookup(db, wanted)
+    missing = wanted - existing.keys()
+    if missing:
+        # Another request may be adding the same names right now: whichever
+        # insert lands first wins, the other skips them, both read the ids back
+        db.execute(
+            insert(models.Interest)
+            .values([{"name": name} for name in sorted(missing)])
+            .on_conflict_do_nothing(index_elements=[models.Interest.__table__.c.name])
+        )
+        existing.update(_lookup(db, missing))
+    return [existing[n] for n in wanted]
+
+
+def sync_profile_interests(db: Session, user_id: int, names: Iterable[str]) -> None:
+    """Make user_id's profile_interests rows match names exactly. Caller commits."""
+    new_ids = set(interest_ids(db, names))
+    old_ids = {
+        i for (i,) in db.query(models.ProfileInterest.interest_id)
+        .filter(models.ProfileInterest.user_id == user_id)
+    }
+    if old_ids - new_ids:
+        (
+            db.query(models.ProfileInterest)
+            .filter(models.ProfileInterest.user_id == user_id)
+            .filter(models.ProfileInterest.interest_id.in_(old_ids - new_ids))
+            .delete(synchronize_session=False)
+        )
+    for interest_id in new_ids - old_ids:
+        db.add(models.ProfileInterest(user_id=user_id, interest_id=interest_id))
+
+
+def shared_interest_query(db: Session, my_profile: models.Profile, min_shared: int = 1) -> Query:
+    """
+    Same-campus profiles sharing at least min_shared interests with my_profile,
+    as one indexed join (no campus scan in Python).
+    """
+    mine = models.ProfileInterest.__table__.alias("mine")
+    theirs = models.ProfileInterest.__table__.alias("theirs")
+    return (
+        db.query(models.Profile)
+        .select_from(mine)
+        .join(theirs, theirs.c.interest_id == mine.c.interest_id)
+        .join(models.Profile, models.Profile.user_id == theirs.c.user_id)
+        .filter(mine.c.user_id == my_profile.user_id)
+        .filter(theirs.c.user_id != my_profile.user_id)
+        .filter(models.Profile.campus == my_profile.campus)
+        .group_by(models.Profile.id)
+        .having(func.count(theirs.c.interest_id) >= min_shared)
+    )
+
+
+def backfill(db: Session) -> int:
+    """Index every profile's comma-separated interests. Returns profiles touched."""
+    count = 0
+    for user_id, interests in db.query(models.Profile.user_id, models.Profile.interests):
+        sync_profile_interests(db, user_id, (interests or "").split(","))
+        count += 1
+    db.commit()
+    return count
+
+
+if __name__ == "__main__":
+    from .db import Base, engine, SessionLocal, add_missing_columns
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    db = SessionLocal()
+    try:
+        print(f"indexed interests for {backfill(db)} profiles")
+    finally:
+        db.close()
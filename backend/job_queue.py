@@ -0,0 +1,174 @@
+# backend/job_queue.py
+"""
+SQLite-backed job queue for background match precomputation.
+
+- enqueue() is idempotent per (kind, user_id): re-enqueueing a live job only
+  raises its priority (and flags it to run again if a worker holds it).
+- lease() atomically claims the best ready job for a visibility timeout; a
+  worker that dies without finishing lets the lease expire and the job is
+  picked up again.
+- fail() retries with exponential backoff until max_attempts.
+- a job whose lease expires on its last attempt (the worker died every
+  time) is marked dead instead of being handed out again.
+"""
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, or_, select, text, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+JOB_REFRESH_MATCHES = "refresh_matches"
+JOB_GENERATE_SUGGESTIONS = "generate_suggestions"  # see suggestions.py
+JOB_FOLD_THREADS = "fold_threads"  # see conversation.py
+
+# Higher runs first
+PRIORITY_PROFILE_CHANGE = 100
+PRIORITY_NEW_USER = 80
+PRIORITY_ACTIVE_TODAY = 60
+PRIORITY_ACTIVE_WEEK = 30
+PRIORITY_IDLE = 0
+
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+
+
+def activity_priority(last_seen_at: Optional[datetime], now: Optional[datetime] = None) -> int:
+    """Priority for a sweep job, based on how recently the user was around."""
+    if last_seen_at is None:
+        return PRIORITY_IDLE
+    age = (now or datetime.utcnow()) - last_seen_at
+    if age <= timedelta(days=1):
+        return PRIORITY_ACTIVE_TODAY
+    if age <= timedelta(days=7):
+        return PRIORITY_ACTIVE_WEEK
+    return PRIORITY_IDLE
+
+
+def enqueue(
+    db: Session, kind: str, user_id: int, priority: int = 0, run_after: Optional[datetime] = None
+) -> None:
+    """
+    Queue (kind, user_id) unless an equivalent job is already live. A new
+    job waits until run_after (default now). Caller commits.
+    """
+    now = datetime.utcnow()
+    stmt = insert(models.MatchJob).values(
+        kind=kind,
+        user_id=user_id,
+        dedupe_key=f"{kind}:{user_id}",
+        priority=priority,
+        status="queued",
+        attempts=0,
+        run_after=run_after or now,
+        rerun=False,
+        created_at=now,
+        updated_at=now,
+    )
+    table = models.MatchJob.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.dedupe_key],
+        set_={
+            "priority": text(f"max(priority, {int(priority)})"),
+            # a worker already holds it: make sure it runs once more afterwards
+            "rerun": text("status = 'leased'"),
+            "updated_at": now,
+        },
+    )
+    db.execute(stmt)
+
+
+def lease(db: Session, lease_seconds: int = LEASE_SECONDS) -> Optional[models.MatchJob]:
+    """Claim the highest-priority ready (or abandoned) job, or None."""
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    jobs = models.MatchJob.__table__
+    abandoned = and_(jobs.c.status == "leased", jobs.c.lease_expires_at < now)
+    db.execute(
+        update(jobs)
+        .where(abandoned)
+        .where(jobs.c.attempts >= jobs.c.max_attempts)
+        .values(
+            status="dead",
+            dedupe_key=None,
+            lease_token=None,
+            lease_expires_at=None,
+            last_error="lease expired on the last attempt",
+            updated_at=now,
+        )
+    )
+    ready = (
+        select(jobs.c.id)
+        .where(
+            or_(
+                and_(jobs.c.status == "queued", jobs.c.run_after <= now),
+                abandoned,
+            )
+        )
+        .where(jobs.c.attempts < jobs.c.max_attempts)
+        .order_by(jobs.c.priority.desc(), jobs.c.run_after.asc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    # Single UPDATE so two workers can never claim the same row
+    result = db.execute(
+        update(jobs)
+        .where(jobs.c.id == ready)
+        .values(
+            status="leased",
+            lease_token=token,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=jobs.c.attempts + 1,
+            updated_at=now,
+        )
+    )
+    db.commit()
+    if result.rowcount == 0:
+        return None
+    return db.query(models.MatchJob).filter(models.MatchJob.lease_token == token).first()
+
+
+def _still_ours(db: Session, job: models.MatchJob) -> bool:
+    """Reload the job; False if our lease expired and someone else took it."""
+    token = job.lease_token
+    db.refresh(job)
+    return job.lease_token == token
+
+
+def complete(db: Session, job: models.MatchJob) -> None:
+    now = datetime.utcnow()
+    if not _still_ours(db, job):
+        return
+    if job.rerun:
+        job.status = "queued"
+        job.rerun = False
+        job.attempts = 0
+        job.run_after = now
+    else:
+        job.status = "done"
+        job.dedupe_key = None
+    job.lease_token = None
+    job.lease_expires_at = None
+    job.updated_at = now
+    db.commit()
+
+
+def fail(db: Session, job: models.MatchJob, error: str) -> None:
+    now = datetime.utcnow()
+    if not _still_ours(db, job):
+        return
+    job.last_error = error[:2000]
+    job.lease_token = None
+    job.lease_expires_at = None
+    job.updated_at = now
+    if job.attempts >= job.max_attempts:
+        job.status = "failed"
+        job.dedupe_key = None
+    else:
+        job.status = "queued"
+        job.run_after = now + timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+    db.commit()
@@ -0,0 +1,2 @@
+# backend/jobs/__init__.py
+"""Batch jobs run from the command line (python -m backend.jobs.<name>)."""
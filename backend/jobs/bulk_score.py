@@ -0,0 +1,618 @@
+# backend/jobs/bulk_score.py
+"""
+Bulk model scoring of a campus's candidate pairs through JSONL job files,
+for backfills and new-campus launches.
+
+    python -m backend.jobs.bulk_score export --campus CMU --dir bulk/cmu
+    python -m backend.jobs.bulk_score score --dir bulk/cmu --concurrency 16
+    python -m backend.jobs.bulk_score score --dir bulk/cmu --mode batch
+    python -m backend.jobs.bulk_score load --dir bulk/cmu
+    python -m backend.jobs.bulk_score run --campus CMU --dir bulk/cmu   # all three
+
+export: every user's top-k local candidates (daily_drop's campus arrays and
+ranker, preferences applied) become canonical pairs; pairs whose stored
+match_scores row is still current are skipped. The rest are grouped by their
+lower user id and packed into the same batched prompts /matches sends, one
+request per line, --shard-size requests per file (requests-00000.jsonl, ...).
+manifest.json is written last and marks the export complete. A new export
+replaces the directory's previous one once its results are all loaded (or
+with --force, which discards them).
+
+score: answers each shard into results-00000.jsonl, one line per request,
+flushed as it arrives. A rerun skips keys already answered, so the results
+files are the checkpoint. --mode gateway sends the prompts through
+llm.generate (limiter, breaker, retries) with --concurrency calls in flight,
+waiting out the RPM / TPM limiter rather than failing; --mode batch submits
+each shard as one provider batch job (llm.submit_batch) and keeps its id in
+results-00000.batch, so a rerun polls the same job instead of resubmitting
+(providers without a batch API answer through the llm package's stand-in,
+which keeps replies on disk under LLM_BATCH_DIR for the same reason). Failed requests are
+left out, listed in the manifest under "failed" (key -> last error) and
+retried by the next run. A request still refused by the limiter after
+BULK_SCORE_RATE_LIMIT_RETRIES waits counts as failed; an open circuit
+breaker stops the run.
+
+load: bulk-upserts the results into match_scores (INSERT ... ON CONFLICT, in
+chunks) with the fingerprints captured at export, so a profile edited since
+then leaves its pairs stale for the rescorer. A score stored after a result
+was computed is never overwritten, which also makes reloading harmless. The
+manifest records how much of each results file has been loaded.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, selectinload
+
+from ..db import Base, engine, SessionLocal, add_missing_columns
+from .. import ai, llm, match_cache, models, prerank
+from . import daily_drop
+
+log = logging.getLogger("backend.jobs.bulk_score")
+
+BULK_SCORE_TOP_K = int(os.getenv("BULK_SCORE_TOP_K", str(prerank.DEFAULT_TOP_K)))
+BULK_SCORE_SHARD_SIZE = int(os.getenv("BULK_SCORE_SHARD_SIZE", "1000"))  # requests per file
+BULK_SCORE_CONCURRENCY = int(os.getenv("BULK_SCORE_CONCURRENCY", "8"))
+BULK_SCORE_POLL_SECONDS = float(os.getenv("BULK_SCORE_POLL_SECONDS", "30"))
+BULK_SCORE_LOAD_CHUNK = int(os.getenv("BULK_SCORE_LOAD_CHUNK", "500"))
+# Limiter refusals waited out per request before it is recorded as failed
+BULK_SCORE_RATE_LIMIT_RETRIES = int(os.getenv("BULK_SCORE_RATE_LIMIT_RETRIES", "20"))
+
+TASK = "bulk_scores"  # metrics label, separate from request-time "match_scores"
+MANIFEST = "manifest.json"
+
+
+# --- Files -------------------------------------------------------------------
+
+
+def _results_path(directory: str, shard: str) -> str:
+    return os.path.join(directory, shard.replace("requests-", "results-", 1))
+
+
+def _batch_path(directory: str, shard: str) -> str:
+    return _results_path(directory, shard)[: -len(".jsonl")] + ".batch"
+
+
+def _write_json(path: str, data: Dict) -> None:
+    """Replace path atomically, so a crash never leaves half a file."""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def read_manifest(directory: str) -> Dict:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found: run export first")
+    with open(path) as f:
+        return json.load(f)
+
+
+def _read_requests(directory: str, shard: str) -> List[Dict]:
+    with open(os.path.join(directory, shard)) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _unloaded(directory: str, manifest: Optional[Dict]) -> List[str]:
+    """
+    Files holding work load hasn't picked up: results past what the manifest
+    says was loaded, and batch jobs not collected yet.
+    """
+    loaded = (manifest or {}).get("loaded", {})
+    unloaded = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.startswith("results-") and name.endswith(".batch"):
+            unloaded.append(name)
+        elif name.startswith("results-") and name.endswith(".jsonl"):
+            if os.path.getsize(path) > loaded.get(name, 0):
+                unloaded.append(name)
+    return unloaded
+
+
+def _answered(path: str) -> Set[str]:
+    """Keys already in a results file. A torn last line (crash mid-write) is cut off."""
+    if not os.path.exists(path):
+        return set()
+    keys: Set[str] = set()
+    good = 0
+    with open(path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                keys.add(json.loads(line)["key"])
+            except (ValueError, KeyError):
+                break
+            good += len(line)
+        f.truncate(good)
+    return keys
+
+
+# --- Export ------------------------------------------------------------------
+
+
+def campus_pairs(
+    db: Session, campus: str, top_k: int, workers: Optional[int] = None
+) -> Tuple[List[models.Profile], Set[Tuple[int, int]]]:
+    """(campus profiles, canonical pairs in anyone's local top_k)."""
+    profiles = (
+        db.query(models.Profile)
+        .options(selectinload(models.Profile.user))
+        .filter(models.Profile.campus == campus)
+        .order_by(models.Profile.user_id.asc())
+        .all()
+    )
+    if not profiles:
+        return profiles, set()
+    arrays = daily_drop.encode_campus(profiles)
+    user_ids = arrays["user_ids"]
+    row_of = {int(uid): i for i, uid in enumerate(user_ids)}
+    prefs = daily_drop.load_preferences(db, user_ids.tolist())
+    prefs_by_row = {row_of[u]: p for u, p in prefs.items()}
+
+    pairs: Set[Tuple[int, int]] = set()
+    for _, rows in daily_drop.iter_top_n(
+        arrays, range(len(profiles)), prefs_by_row, top_k, workers
+    ):
+        for user_id, _, other_user_id, _ in rows:
+            pairs.add(match_cache.canonical(user_id, other_user_id))
+    return profiles, pairs
+
+
+def _stored_fingerprints(db: Session, campus: str) -> Dict[Tuple[int, int], Optional[str]]:
+    rows = (
+        db.query(
+            models.MatchScore.user_id, models.MatchScore.other_user_id, models.MatchScore.fingerprint
+        )
+        .join(models.Profile, models.Profile.user_id == models.MatchScore.user_id)
+        .filter(models.Profile.campus == campus)
+    )
+    return {(low, high): fingerprint for low, high, fingerprint in rows}
+
+
+def export(
+    db: Session,
+    campus: str,
+    directory: str,
+    top_k: int = BULK_SCORE_TOP_K,
+    shard_size: int = BULK_SCORE_SHARD_SIZE,
+    workers: Optional[int] = None,
+    rescore_all: bool = False,
+    force: bool = False,
+) -> Dict:
+    """Write the campus's scoring requests to directory. Returns the manifest."""
+    os.makedirs(directory, exist_ok=True)
+    existing = os.listdir(directory)
+    previous = read_manifest(directory) if MANIFEST in existing else None
+    unloaded = _unloaded(directory, previous)
+    if unloaded and not force:
+        raise FileExistsError(
+            f"{directory} has unloaded results from an earlier export ({', '.join(unloaded)}): "
+            "load them, or pass --force to discard them"
+        )
+    # Anything left over belongs to the export being replaced
+    for name in existing:
+        if name == MANIFEST or name.startswith(("requests-", "results-")):
+            os.remove(os.path.join(directory, name))
+
+    t0 = time.perf_counter()
+    profiles, pairs = campus_pairs(db, campus, top_k, workers)
+    by_id = {p.user_id: p for p in profiles}
+    fingerprints = {p.user_id: match_cache.profile_fingerprint(p) for p in profiles}
+    current = {} if rescore_all else _stored_fingerprints(db, campus)
+
+    # lower user id -> [(other user id, pair fingerprint)]
+    todo: Dict[int, List[Tuple[int, str]]] = defaultdict(list)
+    skipped = 0
+    for low, high in sorted(pairs):
+        fingerprint = match_cache.combine_fingerprints(low, fingerprints[low], high, fingerprints[high])
+        if current.get((low, high)) == fingerprint:
+            skipped += 1
+            continue
+        todo[low].append((high, fingerprint))
+
+    shards: List[str] = []
+    requests = in_shard = 0
+    out = None
+    try:
+        for user_id in sorted(todo):
+            fingerprint_of = dict(todo[user_id])
+            candidates = ai.candidate_dicts([by_id[other] for other in fingerprint_of])
+            for n, (batch, prompt) in enumerate(
+                ai.batch_prompts(ai.profile_to_dict(by_id[user_id]), candidates)
+            ):
+                if out is None or in_shard >= shard_size:
+                    if out is not None:
+                        out.close()
+                    shards.append(f"requests-{len(shards):05d}.jsonl")
+                    out = open(os.path.join(directory, shards[-1]), "w")
+                    in_shard = 0
+                line = {
+                    "key": f"{user_id}-{n}",
+                    "user_id": user_id,
+                    "pairs": [[c["user_id"], fingerprint_of[c["user_id"]]] for c in batch],
+                    "prompt": prompt,
+                }
+                out.write(json.dumps(line) + "\n")
+                in_shard += 1
+                requests += 1
+    finally:
+        if out is not None:
+            out.close()
+
+    manifest = {
+        "campus": campus,
+        "top_k": top_k,
+        "created_at": datetime.utcnow().isoformat(),
+        "profiles": len(profiles),
+        "pairs": len(pairs) - skipped,
+        "skipped_current": skipped,
+        "requests": requests,
+        "shards": shards,
+    }
+    _write_json(os.path.join(directory, MANIFEST), manifest)
+    log.info(
+        "%s: %d profiles, %d pairs to score (%d current), %d requests in %d shards, %.2fs",
+        campus, len(profiles), manifest["pairs"], skipped, requests, len(shards),
+        time.perf_counter() - t0,
+    )
+    return manifest
+
+
+# --- Score -------------------------------------------------------------------
+
+
+def _result_line(request: Dict, raw: str) -> Optional[Dict]:
+    """The results line for a reply, or None if it held no usable score."""
+    scores = ai.parse_batch_scores(raw, {other for other, _ in request["pairs"]})
+    if not scores:
+        return None
+    return {
+        "key": request["key"],
+        "user_id": request["user_id"],
+        "scored_at": datetime.utcnow().isoformat(),
+        # pairs the model skipped are left for the next export
+        "scores": [
+            [other, scores[other], fingerprint]
+            for other, fingerprint in request["pairs"]
+            if other in scores
+        ],
+    }
+
+
+def _write_result(
+    out,
+    request: Dict,
+    raw: Optional[str],
+    stats: Dict[str, int],
+    failures: Dict[str, str],
+    error: str = "no usable score in the reply",
+) -> None:
+    line = _result_line(request, raw) if raw is not None else None
+    if line is None:
+        stats["failed"] += 1
+        failures[request["key"]] = error
+        return
+    out.write(json.dumps(line) + "\n")
+    out.flush()
+    stats["answered"] += 1
+    stats["pairs"] += len(line["scores"])
+
+
+def _generate(prompt: str) -> str:
+    """
+    One gateway call. Throughput-bound: the limiter is waited out, up to
+    BULK_SCORE_RATE_LIMIT_RETRIES times, before the RateLimitedError is raised.
+    """
+    for attempt in range(BULK_SCORE_RATE_LIMIT_RETRIES + 1):
+        try:
+            return llm.generate(prompt, task=TASK, model=ai.GEMINI_MODEL, json_output=True)
+        except llm.RateLimitedError as e:
+            if attempt == BULK_SCORE_RATE_LIMIT_RETRIES:
+                raise
+            time.sleep(max(e.retry_after, 0.1))
+
+
+def _score_gateway(
+    directory: str,
+    shards: List[str],
+    concurrency: int,
+    stats: Dict[str, int],
+    failures: Dict[str, str],
+) -> None:
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-score") as pool:
+        for shard in shards:
+            results = _results_path(directory, shard)
+            done = _answered(results)
+            remaining = [r for r in _read_requests(directory, shard) if r["key"] not in done]
+            if not remaining:
+                continue
+            todo = iter(remaining)
+            pending = {}
+
+            def fill():
+                # a bounded window, so a big shard isn't all queued at once
+                while len(pending) < concurrency * 2:
+                    request = next(todo, None)
+                    if request is None:
+                        return
+                    pending[pool.submit(_generate, request["prompt"])] = request
+
+            with open(results, "a") as out:
+                fill()
+                try:
+                    while pending:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for fut in finished:
+                            request = pending.pop(fut)
+                            try:
+                                raw = fut.result()
+                            except llm.CircuitOpenError:
+                                raise
+                            except llm.LLMError as e:
+                                log.warning("%s: %s", request["key"], e)
+                                _write_result(out, request, None, stats, failures, repr(e))
+                                continue
+                            _write_result(out, request, raw, stats, failures)
+                        fill()
+                finally:
+                    for fut in pending:
+                        fut.cancel()
+            log.info("%s done: %d answered, %d failed so far", shard, stats["answered"], stats["failed"])
+
+
+def _score_batch(
+    directory: str,
+    shards: List[str],
+    poll_seconds: float,
+    stats: Dict[str, int],
+    failures: Dict[str, str],
+) -> None:
+    # Submit every shard that needs it first, then collect as jobs finish
+    jobs: Dict[str, Dict] = {}
+    for shard in shards:
+        batch_file = _batch_path(directory, shard)
+        if os.path.exists(batch_file):
+            with open(batch_file) as f:
+                jobs[shard] = json.load(f)
+            continue
+        done = _answered(_results_path(directory, shard))
+        todo = [r for r in _read_requests(directory, shard) if r["key"] not in done]
+        if not todo:
+            continue
+        job_id = llm.submit_batch(
+            [r["prompt"] for r in todo], task=TASK, model=ai.GEMINI_MODEL, json_output=True
+        )
+        jobs[shard] = {"job": job_id, "keys": [r["key"] for r in todo]}
+        _write_json(batch_file, jobs[shard])
+        log.info("%s: %d requests submitted as %s", shard, len(todo), job_id)
+
+    while jobs:
+        for shard, job in list(jobs.items()):
+            batch_file = _batch_path(directory, shard)
+            try:
+                replies = llm.batch_results(job["job"], task=TASK)
+            except llm.LLMError as e:
+                # the next run submits the shard's requests again
+                log.warning("%s: %s", shard, e)
+                stats["failed"] += len(job["keys"])
+                failures.update((key, repr(e)) for key in job["keys"])
+                os.remove(batch_file)
+                del jobs[shard]
+                continue
+            if replies is None:
+                continue
+            requests = {r["key"]: r for r in _read_requests(directory, shard)}
+            results = _results_path(directory, shard)
+            done = _answered(results)
+            with open(results, "a") as out:
+                for key, raw in zip(job["keys"], replies):
+                    if key not in done:
+                        _write_result(out, requests[key], raw, stats, failures)
+            os.remove(batch_file)
+            del jobs[shard]
+            log.info("%s done: %d answered, %d failed so far", shard, stats["answered"], stats["failed"])
+        if jobs:
+            time.sleep(poll_seconds)
+
+
+def _record_failures(directory: str, shards: List[str], failures: Dict[str, str]) -> Dict[str, str]:
+    """
+    Merge this run's failures into manifest["failed"], keeping only keys
+    that are still unanswered. Returns the merged map.
+    """
+    manifest = read_manifest(directory)
+    failed = {**manifest.get("failed", {}), **failures}
+    if failed:
+        answered: Set[str] = set()
+        for shard in shards:
+            answered |= _answered(_results_path(directory, shard))
+        failed = {key: error for key, error in failed.items() if key not in answered}
+    manifest["failed"] = failed
+    _write_json(os.path.join(directory, MANIFEST), manifest)
+    return failed
+
+
+def score(
+    directory: str,
+    mode: str = "gateway",
+    concurrency: int = BULK_SCORE_CONCURRENCY,
+    poll_seconds: float = BULK_SCORE_POLL_SECONDS,
+) -> Dict[str, float]:
+    """Answer every exported request not answered yet. Returns the throughput report."""
+    manifest = read_manifest(directory)
+    stats = {"answered": 0, "failed": 0, "pairs": 0}
+    failures: Dict[str, str] = {}
+    t0 = time.perf_counter()
+    stopped = False
+    try:
+        if mode == "batch":
+            _score_batch(directory, manifest["shards"], poll_seconds, stats, failures)
+        else:
+            _score_gateway(directory, manifest["shards"], concurrency, stats, failures)
+    except llm.CircuitOpenError as e:
+        log.error("stopping, provider unavailable (%s): rerun to resume", e)
+        stopped = True
+    finally:
+        _record_failures(directory, manifest["shards"], failures)
+    elapsed = max(time.perf_counter() - t0, 1e-9)
+    return {
+        **stats,
+        "stopped": stopped,
+        "seconds": elapsed,
+        "requests_per_second": stats["answered"] / elapsed,
+        "pairs_per_second": stats["pairs"] / elapsed,
+    }
+
+
+# --- Load --------------------------------------------------------------------
+
+
+def _upsert(db: Session, rows: List[Dict]) -> None:
+    """One INSERT ... ON CONFLICT for the chunk; newer stored scores win."""
+    stmt = insert(models.MatchScore)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "other_user_id"],
+        set_={
+            "score": stmt.excluded.score,
+            "fingerprint": stmt.excluded.fingerprint,
+            "updated_at": stmt.excluded.updated_at,
+        },
+        where=models.MatchScore.updated_at.is_(None)
+        | (models.MatchScore.updated_at <= stmt.excluded.updated_at),
+    )
+    db.execute(stmt, rows)
+    db.commit()
+
+
+def load(db: Session, directory: str, chunk_size: int = BULK_SCORE_LOAD_CHUNK) -> Dict[str, float]:
+    """Upsert every results line into match_scores. Returns the throughput report."""
+    manifest = read_manifest(directory)
+    t0 = time.perf_counter()
+    rows: List[Dict] = []
+    loaded = 0
+    loaded_bytes: Dict[str, int] = {}
+    for shard in manifest["shards"]:
+        path = _results_path(directory, shard)
+        if not os.path.exists(path):
+            continue
+        name = os.path.basename(path)
+        loaded_bytes[name] = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn by a crash; score trims it on its next run
+                loaded_bytes[name] += len(line)
+                result = json.loads(line)
+                scored_at = datetime.fromisoformat(result["scored_at"])
+                for other, score_value, fingerprint in result["scores"]:
+                    low, high = match_cache.canonical(result["user_id"], other)
+                    rows.append({
+                        "user_id": low,
+                        "other_user_id": high,
+                        "score": score_value,
+                        "fingerprint": fingerprint,
+                        "updated_at": scored_at,
+                    })
+                    if len(rows) >= chunk_size:
+                        _upsert(db, rows)
+                        loaded += len(rows)
+                        rows = []
+    if rows:
+        _upsert(db, rows)
+        loaded += len(rows)
+    manifest["loaded"] = loaded_bytes
+    manifest["loaded_at"] = datetime.utcnow().isoformat()
+    _write_json(os.path.join(directory, MANIFEST), manifest)
+    elapsed = max(time.perf_counter() - t0, 1e-9)
+    log.info("%d scores loaded in %.2fs", loaded, elapsed)
+    return {"rows": loaded, "seconds": elapsed, "rows_per_second": loaded / elapsed}
+
+
+# --- Driver ------------------------------------------------------------------
+
+
+def _unfinished(directory: str) -> bool:
+    """Whether directory holds an export that was never loaded, or has results since."""
+    if not os.path.exists(os.path.join(directory, MANIFEST)):
+        return False
+    manifest = read_manifest(directory)
+    return "loaded_at" not in manifest or bool(_unloaded(directory, manifest))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk model scoring of a campus's candidate pairs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_export_args(p) -> None:
+        p.add_argument("--campus", required=True)
+        p.add_argument("--top-k", type=int, default=BULK_SCORE_TOP_K,
+                       help="local candidates per user that get a model score")
+        p.add_argument("--shard-size", type=int, default=BULK_SCORE_SHARD_SIZE)
+        p.add_argument("--workers", type=int, default=None, help="ranking processes (default: all cores)")
+        p.add_argument("--all", action="store_true", dest="rescore_all",
+                       help="include pairs whose stored score is current")
+
+    def add_score_args(p) -> None:
+        p.add_argument("--mode", choices=("gateway", "batch"), default="gateway")
+        p.add_argument("--concurrency", type=int, default=BULK_SCORE_CONCURRENCY,
+                       help="gateway calls in flight")
+        p.add_argument("--poll-seconds", type=float, default=BULK_SCORE_POLL_SECONDS,
+                       help="batch job polling interval")
+
+    export_cmd = commands.add_parser("export", help="write request shards")
+    add_export_args(export_cmd)
+    export_cmd.add_argument("--force", action="store_true", help="discard unloaded results")
+    add_score_args(commands.add_parser("score", help="answer exported requests (resumable)"))
+    commands.add_parser("load", help="upsert results into match_scores")
+    run_cmd = commands.add_parser("run", help="export (unless an earlier export is unfinished), score, load")
+    add_export_args(run_cmd)
+    add_score_args(run_cmd)
+    for p in commands.choices.values():
+        p.add_argument("--dir", required=True, help="job directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+
+    db = SessionLocal()
+    try:
+        if args.command in ("export", "run"):
+            if args.command == "export" or not _unfinished(args.dir):
+                manifest = export(
+                    db, args.campus, args.dir, top_k=args.top_k, shard_size=args.shard_size,
+                    workers=args.workers, rescore_all=args.rescore_all,
+                    force=getattr(args, "force", False),
+                )
+                print(
+                    f"{manifest['pairs']:,} pairs ({manifest['skipped_current']:,} already current) "
+                    f"in {manifest['requests']:,} requests, {len(manifest['shards'])} shards"
+                )
+        if args.command in ("score", "run"):
+            report = score(args.dir, args.mode, args.concurrency, args.poll_seconds)
+            print(
+                f"{report['answered']:,} requests answered, {report['failed']:,} failed, "
+                f"{report['pairs']:,} pairs in {report['seconds']:.2f}s: "
+                f"{report['requests_per_second']:,.1f} requests/s, "
+                f"{report['pairs_per_second']:,.1f} pairs/s"
+                + (" (stopped early: rerun to resume)" if report["stopped"] else "")
+            )
+        if args.command in ("load", "run"):
+            report = load(db, args.dir)
+            print(f"{report['rows']:,} scores upserted in {report['seconds']:.2f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+# backend/jobs/daily_drop.py
+"""
+Daily drop: every user's top-N local matches for the day, for a whole campus.
+
+    python -m backend.jobs.daily_drop --campus CMU
+    python -m backend.jobs.daily_drop --campus CMU --top-n 30 --workers 8
+    python -m backend.jobs.daily_drop --campus CMU --restart   # ignore the checkpoint
+
+The campus is encoded once into flat NumPy arrays (interest / bio-term CSR
+matrices, major codes, class years, ages, gender codes) that are published
+in shared memory, so each worker process reads the same copy instead of
+unpickling profiles. Users are scored in chunks across a ProcessPoolExecutor
+with the same signals and weights as prerank.local_scores; each user's
+preferences (preferences.py) are applied as hard filters.
+
+Chunks are written in user_id order, one transaction each: the chunk's
+daily_drops rows plus the checkpoint (feed_cursors "daily_drop:<campus>:<date>")
+move together. A rerun after a crash continues after the last written chunk.
+/matches/daily serves the result without scoring anything.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from ..db import Base, engine, SessionLocal, add_missing_columns
+from .. import models, prerank
+
+log = logging.getLogger("backend.jobs.daily_drop")
+
+DAILY_DROP_TOP_N = int(os.getenv("DAILY_DROP_TOP_N", "20"))
+DAILY_DROP_CHUNK = int(os.getenv("DAILY_DROP_CHUNK", "256"))
+
+
+# --- Campus arrays -----------------------------------------------------------
+
+
+def _csr(sets: List[set], vocab: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """(indptr, indices) of a profile x term incidence matrix."""
+    indptr = np.zeros(len(sets) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(s) for s in sets])
+    indices = np.fromiter(
+        (vocab.setdefault(t, len(vocab)) for s in sets for t in s),
+        dtype=np.int32,
+        count=int(indptr[-1]),
+    )
+    return indptr, indices
+
+
+def _codes(values: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Small-int codes for strings, plus the code -> string table; "" (unknown) is 0."""
+    table = {"": 0}
+    codes = np.array([table.setdefault(v, len(table)) for v in values], dtype=np.int32)
+    return codes, np.array(list(table), dtype=object)
+
+
+def encode_campus(profiles: Sequence[models.Profile]) -> Dict[str, np.ndarray]:
+    """Flatten a campus's profiles into the arrays the workers score from."""
+    interests_ptr, interests_idx = _csr([prerank.interest_set(p) for p in profiles], {})
+    bio_ptr, bio_idx = _csr([prerank.bio_terms(p) for p in profiles], {})
+    majors, _ = _codes([(p.major or "").strip().lower() for p in profiles])
+    genders, gender_names = _codes([p.gender or "" for p in profiles])
+    return {
+        "user_ids": np.array([p.user_id for p in profiles], dtype=np.int64),
+        "interests_ptr": interests_ptr,
+        "interests_idx": interests_idx,
+        "bio_ptr": bio_ptr,
+        "bio_idx": bio_idx,
+        "majors": majors,
+        "genders": genders,
+        "gender_names": gender_names,
+        "class_years": np.array(
+            [p.class_year if p.class_year is not None else np.nan for p in profiles],
+            dtype=np.float64,
+        ),
+        "ages": np.array(
+            [p.age if p.age is not None else np.nan for p in profiles], dtype=np.float64
+        ),
+    }
+
+
+def share(arrays: Dict[str, np.ndarray]):
+    """
+    Copy numeric arrays into shared memory. Returns (blocks, spec): keep the
+    blocks alive and unlink them when done; pass spec to attach().
+    """
+    blocks, spec = [], {}
+    for name, arr in arrays.items():
+        if arr.dtype == object:
+            spec[name] = ("inline", arr)  # tiny lookup tables just get pickled
+            continue
+        block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+        blocks.append(block)
+        spec[name] = (block.name, arr.shape, arr.dtype.str)
+    return blocks, spec
+
+
+# Set in each worker process by attach()
+_arrays: Dict[str, np.ndarray] = {}
+_vocab_sizes: Dict[str, int] = {}
+_blocks: List[shared_memory.SharedMemory] = []
+
+
+def _open_block(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to a block share() created, leaving it to the creator to unlink.
+    Pool workers report to their parent's resource tracker, where the block
+    is already registered; any other process has its own tracker, which
+    would unlink the block when that process exits, so it is taken off it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    block = shared_memory.SharedMemory(name=name)
+    if multiprocessing.parent_process() is None:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+def attach(spec) -> None:
+    """ProcessPoolExecutor initializer: read-only views onto the shared arrays."""
+    for name, entry in spec.items():
+        if entry[0] == "inline":
+            _arrays[name] = entry[1]
+            continue
+        block_name, shape, dtype = entry
+        block = _open_block(block_name)
+        _blocks.append(block)
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        view.flags.writeable = False
+        _arrays[name] = view
+    # Row number of every stored term, for the bincount-based Jaccard below
+    for field in ("interests", "bio"):
+        ptr, idx = _arrays[f"{field}_ptr"], _arrays[f"{field}_idx"]
+        _arrays[f"{field}_rows"] = np.repeat(np.arange(len(ptr) - 1), np.diff(ptr))
+        _vocab_sizes[field] = int(idx.max()) + 1 if len(idx) else 0
+
+
+# --- Scoring (worker side) ---------------------------------------------------
+
+
+def _jaccard_row(i: int, field: str) -> np.ndarray:
+    """Jaccard of profile i's term set against every profile's, like prerank._jaccard."""
+    ptr, idx, rows = (_arrays[f"{field}_{k}"] for k in ("ptr", "idx", "rows"))
+    n = len(ptr) - 1
+    mine = idx[ptr[i]:ptr[i + 1]]
+    if len(mine) == 0 or len(idx) == 0:
+        return np.zeros(n)
+    in_mine = np.zeros(_vocab_sizes[field], dtype=bool)
+    in_mine[mine] = True
+    shared = np.bincount(rows, weights=in_mine[idx], minlength=n)
+    union = np.diff(ptr) + len(mine) - shared
+    return np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+
+
+def _eligible(i: int, prefs: Optional[Dict]) -> np.ndarray:
+    """Mask of profiles user i may be shown: not themselves, within their preferences."""
+    n = len(_arrays["user_ids"])
+    mask = np.ones(n, dtype=bool)
+    mask[i] = False
+    if not prefs:
+        return mask
+    if prefs["genders"]:
+        names = _arrays["gender_names"]
+        codes = [c for c, g in enumerate(names) if g in prefs["genders"]]
+        mask &= np.isin(_arrays["genders"], codes)
+    # NaN (unknown) fails every comparison, like NULL in preferences.apply_preferences
+    ages, years = _arrays["ages"], _arrays["class_years"]
+    with np.errstate(invalid="ignore"):
+        if prefs["min_age"] is not None:
+            mask &= ages >= prefs["min_age"]
+        if prefs["max_age"] is not None:
+            mask &= ages <= prefs["max_age"]
+        if prefs["min_class_year"] is not None:
+            mask &= years >= prefs["min_class_year"]
+        if prefs["max_class_year"] is not None:
+            mask &= years <= prefs["max_class_year"]
+    if prefs["excluded"]:
+        mask &= ~np.isin(_arrays["user_ids"], prefs["excluded"])
+    return mask
+
+
+def score_chunk(task) -> List[Tuple[int, int, int, float]]:
+    """
+    Top-N for each user in a chunk of row numbers.
+    Returns (user_id, rank, other_user_id, score) rows.
+    """
+    rows_in, prefs_by_row, top_n = task
+    user_ids = _arrays["user_ids"]
+    majors, years = _arrays["majors"], _arrays["class_years"]
+
+    out = []
+    for i in rows_in:
+        scores = prerank.combine(
+            _jaccard_row(i, "interests"),
+            ((majors == majors[i]) & (majors != 0)).astype(np.float64),
+            prerank.year_similarity(years, years[i]),
+            _jaccard_row(i, "bio"),
+        )
+        mask = _eligible(i, prefs_by_row.get(i))
+        candidates = np.flatnonzero(mask)
+        if len(candidates) == 0:
+            continue
+        cand_scores = scores[candidates]
+        k = min(top_n, len(candidates))
+        top = np.argpartition(-cand_scores, k - 1)[:k] if k < len(candidates) else np.arange(k)
+        # best first, ties broken by lower user_id like /matches
+        top = top[np.lexsort((user_ids[candidates[top]], -cand_scores[top]))]
+        for rank, j in enumerate(top):
+            out.append((int(user_ids[i]), rank, int(user_ids[candidates[j]]), float(cand_scores[j])))
+    return out
+
+
+def iter_top_n(
+    arrays: Dict[str, np.ndarray],
+    rows: Sequence[int],
+    prefs_by_row: Dict[int, Dict],
+    top_n: int,
+    workers: Optional[int] = None,
+    chunk_size: int = DAILY_DROP_CHUNK,
+) -> Iterator[Tuple[List[int], List[Tuple[int, int, int, float]]]]:
+    """
+    Score the given row numbers across a process pool sharing `arrays`,
+    yielding (chunk row numbers, score_chunk rows) in row order.
+    """
+    tasks = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = list(rows[start:start + chunk_size])
+        chunk_prefs = {i: prefs_by_row[i] for i in chunk if i in prefs_by_row}
+        tasks.append((chunk, chunk_prefs, top_n))
+
+    blocks, spec = share(arrays)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(), initializer=attach, initargs=(spec,)
+        ) as pool:
+            # map() yields in submission order, so callers can checkpoint
+            # past a chunk once it is handled
+            for task, out in zip(tasks, pool.map(score_chunk, tasks)):
+                yield task[0], out
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+# --- Driver ------------------------------------------------------------------
+
+
+def checkpoint_name(campus: str, drop_date: date) -> str:
+    return f"daily_drop:{campus}:{drop_date.isoformat()}"
+
+
+def load_preferences(db: Session, user_ids: Sequence[int]) -> Dict[int, Dict]:
+    prefs: Dict[int, Dict] = {}
+    for pref in db.query(models.Preference).filter(models.Preference.user_id.in_(user_ids)):
+        prefs[pref.user_id] = {
+            "genders": [g for g in (pref.genders or "").split(",") if g],
+            "min_age": pref.min_age,
+            "max_age": pref.max_age,
+            "min_class_year": pref.min_class_year,
+            "max_class_year": pref.max_class_year,
+            "excluded": [],
+        }
+    exclusions = db.query(models.PreferenceExclusion).filter(
+        models.PreferenceExclusion.user_id.in_(user_ids)
+    )
+    for ex in exclusions:
+        prefs.setdefault(
+            ex.user_id,
+            {"genders": [], "min_age": None, "max_age": None,
+             "min_class_year": None, "max_class_year": None, "excluded": []},
+        )["excluded"].append(ex.excluded_user_id)
+    return prefs
+
+
+def _write_chunk(
+    db: Session,
+    drop_date: date,
+    user_ids: List[int],
+    rows: List[Tuple[int, int, int, float]],
+    checkpoint: models.FeedCursor,
+) -> None:
+    """Replace these users' drop for the day and advance the checkpoint, atomically."""
+    (
+        db.query(models.DailyDrop)
+        .filter(models.DailyDrop.drop_date == drop_date)
+        .filter(models.DailyDrop.user_id.in_(user_ids))
+        .delete(synchronize_session=False)
+    )
+    if rows:
+        now = datetime.utcnow()
+        db.execute(
+            insert(models.DailyDrop),
+            [
+                {"drop_date": drop_date, "user_id": u, "rank": r,
+                 "other_user_id": o, "score": s, "created_at": now}
+                for u, r, o, s in rows
+            ],
+        )
+    checkpoint.position = user_ids[-1]
+    db.commit()
+
+
+def run(
+    db: Session,
+    campus: str,
+    drop_date: date,
+    top_n: int = DAILY_DROP_TOP_N,
+    workers: Optional[int] = None,
+    chunk_size: int = DAILY_DROP_CHUNK,
+    restart: bool = False,
+) -> Dict[str, float]:
+    """Compute and store the campus's drop. Returns the throughput report."""
+    name = checkpoint_name(campus, drop_date)
+    checkpoint = db.query(models.FeedCursor).filter(models.FeedCursor.name == name).first()
+    if checkpoint is None:
+        checkpoint = models.FeedCursor(name=name, position=0)
+        db.add(checkpoint)
+    if restart:
+        checkpoint.position = 0
+    db.commit()
+
+    t0 = time.perf_counter()
+    profiles = (
+        db.query(models.Profile)
+        .filter(models.Profile.campus == campus)
+        .order_by(models.Profile.user_id.asc())
+        .all()
+    )
+    arrays = encode_campus(profiles)
+    user_ids = arrays["user_ids"]
+    # Rows already written before a crash are skipped
+    todo = np.flatnonzero(user_ids > (checkpoint.position or 0))
+    prefs = load_preferences(db, user_ids[todo].tolist()) if len(todo) else {}
+    encode_s = time.perf_counter() - t0
+    log.info(
+        "%s: %d profiles, %d to score (checkpoint user_id=%s), encoded in %.2fs",
+        campus, len(profiles), len(todo), checkpoint.position, encode_s,
+    )
+
+    row_of = {int(uid): i for i, uid in enumerate(user_ids)}
+    prefs_by_row = {row_of[u]: p for u, p in prefs.items()}
+
+    scored = written = 0
+    t1 = time.perf_counter()
+    # Chunks arrive in order, so the checkpoint only ever moves past chunks
+    # that are fully written
+    for chunk, rows in iter_top_n(arrays, todo.tolist(), prefs_by_row, top_n, workers, chunk_size):
+        chunk_user_ids = [int(user_ids[i]) for i in chunk]
+        _write_chunk(db, drop_date, chunk_user_ids, rows, checkpoint)
+        scored += len(chunk_user_ids)
+        written += len(rows)
+        log.info("%d/%d profiles scored", scored, len(todo))
+
+    elapsed = max(time.perf_counter() - t1, 1e-9)
+    pairs = scored * max(len(profiles) - 1, 0)
+    return {
+        "profiles": scored,
+        "pairs": pairs,
+        "rows_written": written,
+        "seconds": elapsed,
+        "profiles_per_second": scored / elapsed,
+        "pairs_per_second": pairs / elapsed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Precompute a campus's daily top-N matches.")
+    parser.add_argument("--campus", required=True)
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="YYYY-MM-DD (default: today, UTC)")
+    parser.add_argument("--top-n", type=int, default=DAILY_DROP_TOP_N)
+    parser.add_argument("--workers", type=int, default=None, help="default: all CPU cores")
+    parser.add_argument("--chunk-size", type=int, default=DAILY_DROP_CHUNK)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+
+    db = SessionLocal()
+    try:
+        report = run(
+            db,
+            args.campus,
+            args.date or datetime.utcnow().date(),
+            top_n=args.top_n,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            restart=args.restart,
+        )
+    finally:
+        db.close()
+    print(
+        f"{report['profiles']:,} profiles, {report['pairs']:,} pairs, "
+        f"{report['rows_written']:,} rows in {report['seconds']:.2f}s: "
+        f"{report['profiles_per_second']:,.0f} profiles/s, "
+        f"{report['pairs_per_second']:,.0f} pairs/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# backend/llm/__init__.py
+"""
+One gateway for every LLM call in the repo.
+
+Callers hand over a prompt and a task name ("match_scores", "chat_helper",
+...); the gateway owns the provider client, per-call timeouts, retries with
+jittered backoff, a client-side RPM / TPM limiter and circuit breaker (shared
+across processes through a SQLite file), JSON extraction (code fences, stray
+prose), coalescing of identical in-flight calls and per-task metrics
+(latency, sizes, tokens, errors, cache hits; render_metrics() for /metrics).
+stream() hands out reply text as it is generated (retried only before the
+first chunk, never coalesced); JSONStreamParser turns those chunks into
+fields / array items as soon as each one is complete.
+agenerate() / agenerate_json() / astream() are the implementation, awaited
+on the caller's event loop; generate() / generate_json() / stream() run
+them for sync callers on the gateway's own loop thread (run_sync /
+iter_sync, also used by ai.py and matching.py for their sync entry points).
+submit_batch() / batch_results() hand a whole list of prompts to the
+provider's offline batch mode, for bulk jobs.
+
+    errors      LLMError and friends, is_retryable()
+    parsing     parse_json(), JSONStreamParser
+    providers   gemini / fake providers (LLM_PROVIDER), get_provider()
+    telemetry   ProviderHealth, Metrics, render_metrics(), token accounting
+    quota       RateLimiter, CircuitBreaker and their shared state
+    flight      AsyncSingleFlight
+    bridge      run_sync() / iter_sync(): sync callers of async code
+    gateway     the calls
+    batch       submit_batch() / batch_results()
+
+The package only imports the standard library (provider SDKs lazily) and
+itself by relative imports: Anthropic/test.py and Anthropic/frontend/app.py,
+whose own backend/ package shadows this one, load it by path as a top-level
+package named "llm". Keep it that way.
+"""
+from .batch import batch_results, submit_batch
+from .bridge import iter_sync, run_sync
+from .errors import (
+    RETRYABLE_CODES,
+    CircuitOpenError,
+    LLMError,
+    LLMParseError,
+    ProviderError,
+    RateLimitedError,
+    is_retryable,
+)
+from .flight import AsyncSingleFlight
+from .gateway import agenerate, agenerate_json, astream, embed, generate, generate_json, stream
+from .parsing import JSONStreamParser, parse_json, strip_code_fences
+from .providers import (
+    DEFAULT_MODEL,
+    LLM_BATCH_DIR,
+    LLM_PROVIDER,
+    LLM_TIMEOUT,
+    FakeProvider,
+    GeminiProvider,
+    Provider,
+    get_provider,
+    set_provider,
+)
+from .quota import CircuitBreaker, RateLimiter, breaker, limiter
+from .telemetry import (
+    Metrics,
+    ProviderHealth,
+    estimate_tokens,
+    health,
+    metrics,
+    render_metrics,
+    report_usage,
+)
@@ -0,0 +1,57 @@
+# backend/llm/batch.py
+"""
+Batch jobs, for offline jobs (backend/jobs/bulk_score.py): one provider job
+per list of prompts instead of one call each. Batch quota is separate from
+the per-minute one, so only the breaker is consulted, not the limiter.
+"""
+from typing import List, Optional, Sequence
+
+from . import providers, quota, telemetry
+from .errors import CircuitOpenError, LLMError, is_retryable
+from .telemetry import estimate_tokens
+
+
+def submit_batch(
+    prompts: Sequence[str],
+    *,
+    task: str = "generate",
+    model: Optional[str] = None,
+    json_output: bool = False,
+) -> str:
+    """Start a provider batch job over prompts; returns the id for batch_results()."""
+    try:
+        quota.breaker.before_call()
+    except CircuitOpenError:
+        telemetry.metrics.incr(task, "short_circuited")
+        raise
+    prompts = list(prompts)
+    try:
+        job_id = providers.get_provider().submit_batch(
+            prompts, model=model or providers.DEFAULT_MODEL, json_output=json_output, task=task
+        )
+    except Exception as e:
+        quota.breaker.record(ok=not is_retryable(e))
+        telemetry.metrics.incr(task, "errors")
+        raise LLMError(f"{task}: batch submit failed: {e!r}") from e
+    quota.breaker.record(ok=True)
+    telemetry.metrics.incr(task, "batch_requests", len(prompts))
+    telemetry.metrics.incr(task, "prompt_chars", sum(len(p) for p in prompts))
+    telemetry.metrics.incr(task, "prompt_tokens", sum(estimate_tokens(p) for p in prompts))
+    return job_id
+
+
+def batch_results(job_id: str, *, task: str = "generate") -> Optional[List[Optional[str]]]:
+    """
+    Replies of a submit_batch() job in submission order (None where a prompt
+    failed), or None while the job is still running. LLMError if the job
+    itself failed or is unknown to the provider.
+    """
+    try:
+        replies = providers.get_provider().batch_results(job_id)
+    except Exception as e:
+        telemetry.metrics.incr(task, "errors")
+        raise LLMError(f"{task}: batch {job_id} failed: {e!r}") from e
+    if replies is not None:
+        telemetry.metrics.incr(task, "errors", sum(1 for r in replies if r is None))
+        telemetry.metrics.incr(task, "response_chars", sum(len(r) for r in replies if r is not None))
+    return replies
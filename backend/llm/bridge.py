@@ -0,0 +1,91 @@
+# backend/llm/bridge.py
+"""
+Sync callers of async code. The gateway (and ai.py / matching.py on top of
+it) is written once, as coroutines; sync entry points run them on one
+event loop thread per process, so every sync caller shares its quota
+waits, coalescing and task cancellation.
+"""
+import asyncio
+import os
+import queue
+import threading
+from typing import Any, AsyncIterable, Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_pid = 0
+_loop_lock = threading.Lock()
+
+
+def _gateway_loop() -> asyncio.AbstractEventLoop:
+    """The shared loop, started on first use (again in a forked child)."""
+    global _loop, _loop_thread, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True)
+            _loop_thread.start()
+            _loop_pid = os.getpid()
+        if threading.current_thread() is _loop_thread:
+            raise RuntimeError("sync LLM call made from the gateway loop: await the async API")
+        return _loop
+
+
+def run_sync(awaitable: Awaitable[T]) -> T:
+    """Block the calling thread until awaitable finishes on the gateway loop."""
+    async def wrapper() -> T:
+        return await awaitable
+
+    future = asyncio.run_coroutine_threadsafe(wrapper(), _gateway_loop())
+    try:
+        return future.result()
+    finally:
+        future.cancel()  # caller interrupted: don't leave the call running
+
+
+_DONE = object()
+
+
+def iter_sync(aiterable: AsyncIterable[T]) -> Iterator[T]:
+    """
+    Sync iterator over an async one. The async iterator is driven by one
+    task on the gateway loop (so context variables carry over between
+    items) one item per request, like a generator: nothing runs ahead of
+    the consumer. Closing the iterator early cancels the task.
+    """
+    items: "queue.Queue[tuple]" = queue.Queue()
+    wanted = asyncio.Semaphore(0)
+
+    async def pump() -> None:
+        iterator = aiterable.__aiter__()
+        try:
+            while True:
+                await wanted.acquire()
+                try:
+                    item: Any = await iterator.__anext__()
+                except StopAsyncIteration:
+                    items.put((_DONE, None))
+                    return
+                items.put((item, None))
+        except Exception as e:
+            items.put((_DONE, e))
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    loop = _gateway_loop()
+    task = asyncio.run_coroutine_threadsafe(pump(), loop)
+    try:
+        while True:
+            loop.call_soon_threadsafe(wanted.release)
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        task.cancel()
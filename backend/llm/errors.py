@@ -0,0 +1,54 @@
+# backend/llm/errors.py
+"""Errors raised by the gateway, and which provider failures are worth a retry."""
+
+
+class LLMError(Exception):
+    """A call failed after all retries."""
+
+
+class LLMParseError(LLMError):
+    """The model answered, but not with the JSON we asked for."""
+
+    def __init__(self, message: str, raw: str = ""):
+        super().__init__(message)
+        self.raw = raw
+
+
+class RateLimitedError(LLMError):
+    """No quota within LLM_LIMITER_MAX_WAIT; retry_after is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMError):
+    """The provider is failing; calls are refused until the breaker's cooldown ends."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ProviderError(Exception):
+    """Provider-side failure with an HTTP-style status code (used by FakeProvider)."""
+
+    def __init__(self, message: str, code: int):
+        super().__init__(message)
+        self.code = code
+
+
+# Timeouts, dropped connections, quota (429) and server-side (5xx) errors are
+# worth another attempt. Anything else (bad request, auth, a reply that isn't
+# JSON, a bug) will fail the same way again.
+RETRYABLE_CODES = {408, 429}
+
+
+def is_retryable(error: Exception) -> bool:
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES or 500 <= code < 600
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # httpx (under google-genai) raises its own TransportError family
+    return any(cls.__name__ == "TransportError" for cls in type(error).__mro__)
@@ -0,0 +1,55 @@
+# backend/llm/flight.py
+"""Coalescing of identical in-flight calls."""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs
+    fn, everyone on the same event loop arriving while it runs awaits the
+    same future and gets its result or exception. Nothing is cached once
+    the call finishes. Cancelling a waiter doesn't cancel the call; if the
+    leader is cancelled, a waiter takes over.
+    """
+
+    def __init__(self):
+        self._flights: Dict[tuple, asyncio.Future] = {}
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        on_join: Optional[Callable[[], None]] = None,
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        key = (id(loop), key)  # futures can't be awaited from another loop
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                break
+            if on_join is not None:
+                on_join()
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if flight.cancelled():
+                    continue  # leader went away mid-call: retry, maybe as the new leader
+                raise
+
+        flight = self._flights[key] = loop.create_future()
+        try:
+            result = await fn()
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # mark retrieved: having no waiters is fine
+            raise
+        except BaseException:
+            flight.cancel()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
@@ -0,0 +1,288 @@
+# backend/llm/gateway.py
+"""
+The calls themselves. Each one goes breaker check -> quota -> provider, is
+recorded in metrics / health / the breaker, and is retried with jittered
+backoff when the failure is retryable.
+
+The async functions are the implementation: provider calls are awaited on
+the caller's event loop, so an endpoint waiting on the model holds no
+worker thread. generate() / generate_json() / stream() are the same calls
+for sync code, run on the gateway loop (bridge.py).
+"""
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Sequence
+
+from . import providers, quota, telemetry
+from .bridge import iter_sync, run_sync
+from .errors import CircuitOpenError, LLMError, LLMParseError, RateLimitedError, is_retryable
+from .flight import AsyncSingleFlight
+from .parsing import parse_json
+from .telemetry import estimate_tokens, track_usage
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))  # doubles per retry, jittered
+LLM_RETRY_MAX_BACKOFF = float(os.getenv("LLM_RETRY_MAX_BACKOFF", "8"))
+LLM_OUTPUT_TOKENS = int(os.getenv("LLM_OUTPUT_TOKENS", "256"))  # expected reply size, for quota
+
+_aflights = AsyncSingleFlight()
+
+
+def _flight_key(task: str, model: str, json_output: bool, prompt: str) -> str:
+    raw = "\x1f".join((task, model, "json" if json_output else "text", prompt))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _admit(task: str, prompt: str) -> None:
+    """Breaker check, then quota; refusals are counted and raised."""
+    try:
+        await quota.off_loop(quota.breaker.before_call)
+    except CircuitOpenError:
+        telemetry.metrics.incr(task, "short_circuited")
+        raise
+    try:
+        await quota.limiter.acquire(estimate_tokens(prompt) + LLM_OUTPUT_TOKENS)
+    except RateLimitedError:
+        telemetry.metrics.incr(task, "rate_limited")
+        raise
+
+
+def _record_failure(task: str, latency: float, error: Exception) -> None:
+    telemetry.health.record(latency, ok=False)
+    # a rejected request says nothing about the provider's health
+    quota.breaker.record(ok=not is_retryable(error))
+    telemetry.metrics.observe(task, latency)
+    telemetry.metrics.incr(task, "errors")
+    if isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower():
+        telemetry.metrics.incr(task, "timeouts")
+
+
+def _record_success(task: str, latency: float) -> None:
+    telemetry.health.record(latency, ok=True)
+    quota.breaker.record(ok=True)
+    telemetry.metrics.observe(task, latency)
+
+
+async def _call(
+    provider: providers.Provider, prompt: str, task: str, model: str, json_output: bool, timeout: float
+) -> str:
+    """
+    One provider call: breaker check, quota, then the call itself, recorded
+    in `metrics`, `health` and the breaker.
+    """
+    await _admit(task, prompt)
+    telemetry.metrics.incr(task, "calls")
+    usage = track_usage()
+    t0 = time.monotonic()
+    try:
+        text = await provider.agenerate(
+            prompt, model=model, json_output=json_output, timeout=timeout, task=task
+        )
+    except Exception as e:
+        await quota.off_loop(_record_failure, task, time.monotonic() - t0, e)
+        raise
+    await quota.off_loop(_record_success, task, time.monotonic() - t0)
+    telemetry.metrics.observe_sizes(task, prompt, text, tuple(usage) or None)
+    return text
+
+
+def _backoff(attempt: int) -> float:
+    """Seconds to wait before retry number `attempt` (1-based): exponential, jittered."""
+    delay = min(LLM_RETRY_MAX_BACKOFF, LLM_RETRY_BACKOFF * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0.0, delay / 2)
+
+
+async def _with_retries(
+    task: str, retries: Optional[int], attempt_fn: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    Run attempt_fn up to retries + 1 times, retrying only retryable errors
+    (is_retryable), with exponential backoff and jitter. Quota / breaker
+    refusals are not retried here: they already waited or are meant to
+    fail fast. A reply that isn't JSON is counted and raised as is.
+    """
+    retries = LLM_MAX_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        if attempt:
+            telemetry.metrics.incr(task, "retries")
+            await asyncio.sleep(_backoff(attempt))
+        try:
+            return await attempt_fn()
+        except (RateLimitedError, CircuitOpenError):
+            raise
+        except LLMParseError:
+            telemetry.metrics.incr(task, "parse_errors")
+            raise
+        except Exception as e:
+            error = e
+            if not is_retryable(e):
+                break
+    raise LLMError(f"{task}: call failed after {attempt + 1} attempts: {error!r}") from error
+
+
+async def agenerate(
+    prompt: str,
+    *,
+    task: str = "generate",
+    model: Optional[str] = None,
+    json_output: bool = False,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+) -> str:
+    """
+    Reply text for `prompt`. Retryable failures are retried `retries` times
+    (default LLM_MAX_RETRIES) with jittered exponential backoff, then raise
+    LLMError; RateLimitedError / CircuitOpenError when refused up front.
+    """
+    provider = providers.get_provider()
+    model = model or providers.DEFAULT_MODEL
+    timeout = providers.LLM_TIMEOUT if timeout is None else timeout
+    # Identical prompts already in flight share that call's answer
+    return await _aflights.do(
+        _flight_key(task, model, json_output, prompt),
+        lambda: _with_retries(
+            task, retries, lambda: _call(provider, prompt, task, model, json_output, timeout)
+        ),
+        on_join=lambda: telemetry.metrics.incr(task, "coalesced"),
+    )
+
+
+async def agenerate_json(
+    prompt: str,
+    *,
+    task: str = "generate",
+    model: Optional[str] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+) -> Any:
+    """
+    agenerate() in JSON mode, parsed. A reply that isn't JSON raises
+    LLMParseError (with .raw). Coalesced callers share the parsed value,
+    so treat it as read-only.
+    """
+    provider = providers.get_provider()
+    model = model or providers.DEFAULT_MODEL
+    timeout = providers.LLM_TIMEOUT if timeout is None else timeout
+
+    async def attempt() -> Any:
+        return parse_json(await _call(provider, prompt, task, model, True, timeout))
+
+    return await _aflights.do(
+        ("parsed", _flight_key(task, model, True, prompt)),
+        lambda: _with_retries(task, retries, attempt),
+        on_join=lambda: telemetry.metrics.incr(task, "coalesced"),
+    )
+
+
+async def astream(
+    prompt: str,
+    *,
+    task: str = "generate",
+    model: Optional[str] = None,
+    json_output: bool = False,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """
+    Reply text in pieces as the provider produces them. Same breaker, quota,
+    metrics and retries as agenerate(), plus time to first chunk
+    ("first_chunk_*"), except that only failures before the first chunk are
+    retried: chunks already handed out can't be taken back, so a failure
+    mid-reply raises LLMError to the consumer.
+
+    Not coalesced: every consumer pulls its own iterator at its own pace, so
+    sharing one call would mean buffering the reply for the slowest of them.
+    The one streaming caller (the chat helper) answers repeats from
+    chat_cache before it gets here.
+    """
+    provider = providers.get_provider()
+    model = model or providers.DEFAULT_MODEL
+    timeout = providers.LLM_TIMEOUT if timeout is None else timeout
+    retries = LLM_MAX_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        if attempt:
+            telemetry.metrics.incr(task, "retries")
+            await asyncio.sleep(_backoff(attempt))
+        await _admit(task, prompt)
+        telemetry.metrics.incr(task, "calls")
+        usage = track_usage()
+        t0 = time.monotonic()
+        received: List[str] = []
+        try:
+            async for chunk in provider.astream(
+                prompt, model=model, json_output=json_output, timeout=timeout, task=task
+            ):
+                if not received:
+                    telemetry.metrics.observe(task, time.monotonic() - t0, name="first_chunk")
+                received.append(chunk)
+                yield chunk
+        except Exception as e:
+            await quota.off_loop(_record_failure, task, time.monotonic() - t0, e)
+            if received or attempt == retries or not is_retryable(e):
+                raise LLMError(f"{task}: stream failed: {e!r}") from e
+            continue
+        await quota.off_loop(_record_success, task, time.monotonic() - t0)
+        telemetry.metrics.observe_sizes(task, prompt, "".join(received), tuple(usage) or None)
+        return
+
+
+def generate(
+    prompt: str,
+    *,
+    task: str = "generate",
+    model: Optional[str] = None,
+    json_output: bool = False,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+) -> str:
+    """agenerate() for sync callers."""
+    return run_sync(agenerate(
+        prompt, task=task, model=model, json_output=json_output, timeout=timeout, retries=retries
+    ))
+
+
+def generate_json(
+    prompt: str,
+    *,
+    task: str = "generate",
+    model: Optional[str] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+) -> Any:
+    """agenerate_json() for sync callers."""
+    return run_sync(agenerate_json(prompt, task=task, model=model, timeout=timeout, retries=retries))
+
+
+def stream(
+    prompt: str,
+    *,
+    task: str = "generate",
+    model: Optional[str] = None,
+    json_output: bool = False,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+) -> Iterator[str]:
+    """astream() for sync callers: each chunk as the provider produces it."""
+    return iter_sync(astream(
+        prompt, task=task, model=model, json_output=json_output, timeout=timeout, retries=retries
+    ))
+
+
+def embed(texts: Sequence[str], *, model: str, task: str = "embed") -> List[List[float]]:
+    """Embedding vectors for texts (one provider call, no retries)."""
+    provider = providers.get_provider()
+    telemetry.metrics.incr(task, "calls")
+    t0 = time.monotonic()
+    try:
+        vectors = provider.embed(texts, model=model)
+    except Exception:
+        telemetry.metrics.incr(task, "errors")
+        raise
+    finally:
+        telemetry.metrics.observe(task, time.monotonic() - t0)
+    telemetry.metrics.incr(task, "prompt_chars", sum(len(t) for t in texts))
+    telemetry.metrics.incr(task, "prompt_tokens", sum(estimate_tokens(t) for t in texts))
+    return vectors
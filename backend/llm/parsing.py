@@ -0,0 +1,163 @@
+# backend/llm/parsing.py
+"""
+JSON out of model replies: whole replies (parse_json) and streamed ones,
+field by field (JSONStreamParser).
+"""
+import json
+from typing import Any, List, Optional
+
+from .errors import LLMParseError
+
+
+def strip_code_fences(text: str) -> str:
+    """Drop a surrounding ```json ... ``` block, if the model added one."""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def parse_json(text: str) -> Any:
+    """
+    JSON value from a model reply: tolerates code fences and prose around a
+    single top-level object / array. Raises LLMParseError.
+    """
+    cleaned = strip_code_fences(text)
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        pass
+    starts = [i for i in (cleaned.find("{"), cleaned.find("[")) if i >= 0]
+    if starts:
+        start = min(starts)
+        end = cleaned.rfind("}" if cleaned[start] == "{" else "]")
+        if end > start:
+            try:
+                return json.loads(cleaned[start:end + 1])
+            except json.JSONDecodeError:
+                pass
+    raise LLMParseError("model reply is not valid JSON", raw=text or "")
+
+
+class JSONStreamParser:
+    """
+    Incremental parser for a JSON object arriving in chunks. feed() returns
+    the events each chunk completes, as soon as their closing character is
+    seen:
+
+        ("item", key, index, value)   an element of a top-level array
+        ("field", key, value)         a top-level member (after its items)
+
+    Text before the opening brace (a code fence, prose) is skipped. Values
+    that aren't valid JSON are dropped silently; parse_json() on the full
+    reply remains the fallback.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.done = False
+        # top-level member being read: "key" -> "colon" -> "value" -> "after"
+        self._mode = "key"
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._item_index = 0
+
+    def _decode(self, start: int, end: int, events: List[tuple], *head: Any) -> None:
+        try:
+            value = json.loads(self._buf[start:end])
+        except json.JSONDecodeError:
+            return
+        events.append((*head, value))
+
+    def _in_array(self) -> bool:
+        return self._value_start is not None and self._buf[self._value_start] == "["
+
+    def _start_token(self, i: int) -> None:
+        if self._depth == 1:
+            if self._mode == "key" and self._buf[i] == '"':
+                self._key_start = i
+            elif self._mode == "value" and self._value_start is None:
+                self._value_start = i
+                self._item_index = 0
+        elif self._depth == 2 and self._in_array() and self._item_start is None:
+            self._item_start = i
+
+    def _end_field(self, end: int, events: List[tuple]) -> None:
+        self._decode(self._value_start, end, events, "field", self._key)
+        self._mode = "after"
+        self._value_start = None
+
+    def _end_item(self, end: int, events: List[tuple]) -> None:
+        self._decode(self._item_start, end, events, "item", self._key, self._item_index)
+        self._item_index += 1
+        self._item_start = None
+
+    def _end_string(self, i: int, events: List[tuple]) -> None:
+        if self._depth == 1 and self._mode == "key" and self._key_start is not None:
+            self._key = json.loads(self._buf[self._key_start:i + 1])
+            self._key_start = None
+            self._mode = "colon"
+        elif self._depth == 1 and self._mode == "value" and self._value_start is not None:
+            self._end_field(i + 1, events)
+        elif self._depth == 2 and self._in_array() and self._item_start is not None:
+            self._end_item(i + 1, events)
+
+    def _end_scalar(self, i: int, events: List[tuple]) -> None:
+        """A ',' or closing bracket at the current depth ends a pending number / literal."""
+        if self._depth == 1 and self._mode == "value" and self._value_start is not None:
+            self._end_field(i, events)
+        elif self._depth == 2 and self._in_array() and self._item_start is not None:
+            self._end_item(i, events)
+
+    def feed(self, chunk: str) -> List[tuple]:
+        events: List[tuple] = []
+        self._buf += chunk
+        while self._pos < len(self._buf) and not self.done:
+            i, ch = self._pos, self._buf[self._pos]
+            self._pos += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._end_string(i, events)
+                continue
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                continue
+            if ch == '"':
+                self._start_token(i)
+                self._in_string = True
+            elif ch in "{[":
+                self._start_token(i)
+                self._depth += 1
+            elif ch in "}]":
+                self._end_scalar(i, events)
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                elif self._depth == 2 and self._in_array() and self._item_start is not None:
+                    self._end_item(i + 1, events)  # a nested array element closed
+                elif self._depth == 1 and self._value_start is not None:
+                    self._end_field(i + 1, events)
+            elif ch == ",":
+                self._end_scalar(i, events)
+                if self._depth == 1:
+                    self._mode = "key"
+            elif ch == ":" and self._depth == 1 and self._mode == "colon":
+                self._mode = "value"
+            elif not ch.isspace():
+                self._start_token(i)
+        return events
+
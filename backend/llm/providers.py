@@ -0,0 +1,395 @@
+# backend/llm/providers.py
+"""
+Model providers (LLM_PROVIDER):
+    gemini  google-genai client, created on first use (default)
+    fake    deterministic offline answers per task, with configurable latency
+            (LLM_FAKE_LATENCY / LLM_FAKE_JITTER seconds) and error rate
+            (LLM_FAKE_ERROR_RATE), for local tuning and benchmarks
+
+A provider implements agenerate() / astream() (or just the blocking
+generate(), run on a worker thread), plus batch jobs and embeddings.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import weakref
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
+
+from .errors import ProviderError
+from .quota import LLM_DATA_DIR
+from .telemetry import report_usage
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))  # seconds per attempt
+# Stand-in batch jobs (providers without a batch API) keep their replies here
+LLM_BATCH_DIR = os.getenv("LLM_BATCH_DIR", os.path.join(LLM_DATA_DIR, "llm_batches"))
+
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+LLM_FAKE_JITTER = float(os.getenv("LLM_FAKE_JITTER", "0"))
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", "0"))
+LLM_FAKE_CHUNK_CHARS = int(os.getenv("LLM_FAKE_CHUNK_CHARS", "24"))  # streamed reply pieces
+LLM_FAKE_FIRST_CHUNK = float(os.getenv("LLM_FAKE_FIRST_CHUNK", "0.2"))  # share of latency
+
+
+class Provider:
+    """Turns one prompt into reply text (and texts into embedding vectors)."""
+
+    name = "base"
+
+    def generate(self, prompt: str, *, model: str, json_output: bool, timeout: float, task: str) -> str:
+        """Blocking call, for SDKs without an async client; agenerate() runs it on a thread."""
+        raise NotImplementedError
+
+    async def agenerate(
+        self, prompt: str, *, model: str, json_output: bool, timeout: float, task: str
+    ) -> str:
+        """What the gateway calls; by default generate() on a worker thread."""
+        return await asyncio.to_thread(
+            self.generate, prompt, model=model, json_output=json_output, timeout=timeout, task=task
+        )
+
+    async def astream(
+        self, prompt: str, *, model: str, json_output: bool, timeout: float, task: str
+    ) -> AsyncIterator[str]:
+        """Reply text in pieces as it is generated; by default all at once."""
+        yield await self.agenerate(
+            prompt, model=model, json_output=json_output, timeout=timeout, task=task
+        )
+
+    def submit_batch(self, prompts: List[str], *, model: str, json_output: bool, task: str) -> str:
+        """
+        Start an offline batch job over prompts and return its id. By default
+        a stand-in: every prompt is answered right away through generate()
+        and the replies are kept in a file under LLM_BATCH_DIR until
+        batch_results() collects them, so a job outlives the process that
+        submitted it, as a provider's would.
+        """
+        replies: List[Optional[str]] = []
+        for prompt in prompts:
+            try:
+                replies.append(
+                    self.generate(
+                        prompt, model=model, json_output=json_output, timeout=LLM_TIMEOUT, task=task
+                    )
+                )
+            except Exception:
+                replies.append(None)
+        return _hold_batch(replies)
+
+    def batch_results(self, job_id: str) -> Optional[List[Optional[str]]]:
+        """Replies in submission order (None where one failed), or None while still running."""
+        path = _held_batch_path(job_id)
+        try:
+            with open(path) as f:
+                replies = json.load(f)
+        except (FileNotFoundError, ValueError):
+            raise ProviderError(f"unknown batch job {job_id}", code=404)
+        os.remove(path)
+        return replies
+
+    def embed(self, texts: Sequence[str], *, model: str) -> List[List[float]]:
+        raise NotImplementedError
+
+
+def _held_batch_path(job_id: str) -> str:
+    if not re.fullmatch(r"stand-in-[0-9a-f]+", job_id):
+        job_id = "unknown"  # not one of ours: never a path outside LLM_BATCH_DIR
+    return os.path.join(LLM_BATCH_DIR, f"{job_id}.json")
+
+
+def _hold_batch(replies: List[Optional[str]]) -> str:
+    """Keep a stand-in job's replies until collected; returns the job id."""
+    job_id = f"stand-in-{os.urandom(8).hex()}"
+    os.makedirs(LLM_BATCH_DIR, exist_ok=True)
+    path = _held_batch_path(job_id)
+    with open(path + ".tmp", "w") as f:
+        json.dump(replies, f)
+    os.replace(path + ".tmp", path)
+    return job_id
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str] = None):
+        self._api_key = api_key
+        self._client = None
+        # The async client's connections belong to the loop that opened them,
+        # and calls come from both the app's loop and the gateway's (bridge.py)
+        self._aio_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def _new_client(self):
+        from google import genai
+
+        # Client reads GEMINI_API_KEY or GOOGLE_API_KEY if not passed explicitly
+        return genai.Client(
+            api_key=self._api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        )
+
+    @property
+    def client(self):
+        # Created on first use, so importing the gateway needs no key / network
+        with self._lock:
+            if self._client is None:
+                self._client = self._new_client()
+            return self._client
+
+    @property
+    def aio(self):
+        """client.aio of a client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._aio_clients.get(loop)
+            if client is None:
+                client = self._aio_clients[loop] = self._new_client()
+            return client.aio
+
+    @staticmethod
+    def _config(json_output: bool, timeout: float) -> Dict[str, Any]:
+        config: Dict[str, Any] = {"http_options": {"timeout": int(timeout * 1000)}}
+        if json_output:
+            config["response_mime_type"] = "application/json"
+        return config
+
+    @staticmethod
+    def _report_usage(resp) -> None:
+        meta = getattr(resp, "usage_metadata", None)
+        if meta is not None and meta.prompt_token_count is not None:
+            report_usage(meta.prompt_token_count, meta.candidates_token_count or 0)
+
+    # Async client (client.aio): waiting on the model holds no thread
+
+    async def agenerate(
+        self, prompt: str, *, model: str, json_output: bool, timeout: float, task: str
+    ) -> str:
+        resp = await self.aio.models.generate_content(
+            model=model, contents=prompt, config=self._config(json_output, timeout)
+        )
+        self._report_usage(resp)
+        return resp.text or ""
+
+    async def astream(
+        self, prompt: str, *, model: str, json_output: bool, timeout: float, task: str
+    ) -> AsyncIterator[str]:
+        async for chunk in await self.aio.models.generate_content_stream(
+            model=model, contents=prompt, config=self._config(json_output, timeout)
+        ):
+            self._report_usage(chunk)
+            if chunk.text:
+                yield chunk.text
+
+    # Batch mode (client.batches): inline requests, answered within 24h at a
+    # lower price and outside the per-minute quota
+
+    _BATCH_DONE = ("JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED")
+    _BATCH_FAILED = ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED")
+
+    def submit_batch(self, prompts: List[str], *, model: str, json_output: bool, task: str) -> str:
+        config = {"response_mime_type": "application/json"} if json_output else {}
+        job = self.client.batches.create(
+            model=model,
+            src=[
+                {"contents": [{"role": "user", "parts": [{"text": prompt}]}], "config": config}
+                for prompt in prompts
+            ],
+            config={"display_name": f"{task}-{len(prompts)}"},
+        )
+        return job.name
+
+    def batch_results(self, job_id: str) -> Optional[List[Optional[str]]]:
+        job = self.client.batches.get(name=job_id)
+        state = job.state.name if job.state is not None else ""
+        if state in self._BATCH_FAILED:
+            raise ProviderError(f"batch job {job_id}: {state}", code=500)
+        if state not in self._BATCH_DONE:
+            return None
+        return [
+            (r.response.text or "") if r.response is not None and r.error is None else None
+            for r in job.dest.inlined_responses or []
+        ]
+
+    def embed(self, texts: Sequence[str], *, model: str) -> List[List[float]]:
+        resp = self.client.models.embed_content(model=model, contents=list(texts))
+        return [list(e.values) for e in resp.embeddings]
+
+
+def _stable_int(*parts: str) -> int:
+    digest = hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _fake_score(*parts: str) -> int:
+    return _stable_int(*parts) % 101
+
+
+def _fake_match_score(prompt: str) -> str:
+    return str(_fake_score(prompt))
+
+
+def _fake_match_scores(prompt: str) -> str:
+    me = prompt.split("Candidates:", 1)[0]
+    ids = [int(x) for x in re.findall(r"user_id=(\d+)", prompt)]
+    return json.dumps([{"user_id": i, "score": _fake_score(me, str(i))} for i in ids])
+
+
+def _fake_chat_helper(prompt: str) -> str:
+    n = _stable_int(prompt) % 1000
+    return json.dumps({
+        "summary": f"They seem easygoing and curious (fake summary #{n}).",
+        "openers": [f"Fake opener {k} #{n}" for k in range(1, 4)],
+    })
+
+
+def _fake_thread_summary(prompt: str) -> str:
+    new_lines = prompt.split("New messages:", 1)[-1].count("\n")
+    return f"Fake summary #{_stable_int(prompt) % 1000} ({new_lines} new lines folded in)."
+
+
+def _fake_opening_lines(prompt: str) -> str:
+    n = _stable_int(prompt) % 1000
+    return json.dumps({
+        "opening_lines": [
+            {"line": f"Fake opening line {k} #{n}", "reason": "deterministic fake provider"}
+            for k in range(1, 4)
+        ]
+    })
+
+
+def _fake_profile_compare(prompt: str) -> str:
+    return json.dumps({
+        "similarities": ["fake similarity"],
+        "differences": ["fake difference"],
+        "insights": ["fake insight"],
+        "score": 1 + _stable_int(prompt) % 10,
+    })
+
+
+class FakeProvider(Provider):
+    """
+    Offline stand-in: the same prompt always gets the same answer, shaped
+    for its task (see `responders`; register() adds more). Latency and
+    failures are simulated from a per-prompt seed, so runs are repeatable.
+    astream() sends the first chunk after `first_chunk` of the latency and
+    spreads the rest over the remaining chunks.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: float = LLM_FAKE_LATENCY,
+        jitter: float = LLM_FAKE_JITTER,
+        error_rate: float = LLM_FAKE_ERROR_RATE,
+        dim: int = 64,
+        chunk_chars: int = LLM_FAKE_CHUNK_CHARS,
+        first_chunk: float = LLM_FAKE_FIRST_CHUNK,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.dim = dim
+        self.chunk_chars = max(1, chunk_chars)
+        self.first_chunk = first_chunk
+        self.responders: Dict[str, Callable[[str], str]] = {
+            "match_score": _fake_match_score,
+            "match_scores": _fake_match_scores,
+            "bulk_scores": _fake_match_scores,
+            "chat_helper": _fake_chat_helper,
+            "thread_summary": _fake_thread_summary,
+            "opening_lines": _fake_opening_lines,
+            "profile_compare": _fake_profile_compare,
+        }
+
+    def register(self, task: str, responder: Callable[[str], str]) -> None:
+        self.responders[task] = responder
+
+    def _plan(self, prompt: str, json_output: bool, task: str):
+        """(delay, failed, reply) for this prompt."""
+        rng = random.Random(_stable_int(task, prompt))
+        delay = max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+        failed = rng.random() < self.error_rate
+        responder = self.responders.get(task)
+        if responder is None:
+            reply = "{}" if json_output else ""
+        else:
+            reply = responder(prompt)
+        return delay, failed, reply
+
+    def _chunks(self, reply: str) -> List[str]:
+        return [reply[i:i + self.chunk_chars] for i in range(0, len(reply), self.chunk_chars)]
+
+    @staticmethod
+    def _timeout(delay: float, timeout: float) -> TimeoutError:
+        return TimeoutError(f"fake provider: {delay:.2f}s > timeout {timeout:.2f}s")
+
+    @staticmethod
+    def _failure() -> ProviderError:
+        return ProviderError("fake provider: simulated failure", code=503)
+
+    async def agenerate(
+        self, prompt: str, *, model: str, json_output: bool, timeout: float, task: str
+    ) -> str:
+        delay, failed, reply = self._plan(prompt, json_output, task)
+        if delay > timeout:
+            await asyncio.sleep(timeout)
+            raise self._timeout(delay, timeout)
+        await asyncio.sleep(delay)
+        if failed:
+            raise self._failure()
+        return reply
+
+    async def astream(
+        self, prompt: str, *, model: str, json_output: bool, timeout: float, task: str
+    ) -> AsyncIterator[str]:
+        delay, failed, reply = self._plan(prompt, json_output, task)
+        if delay > timeout:
+            await asyncio.sleep(timeout)
+            raise self._timeout(delay, timeout)
+        await asyncio.sleep(delay * self.first_chunk)
+        if failed:
+            raise self._failure()
+        chunks = self._chunks(reply)
+        for n, chunk in enumerate(chunks):
+            if n:
+                await asyncio.sleep(delay * (1 - self.first_chunk) / max(1, len(chunks) - 1))
+            yield chunk
+
+    def submit_batch(self, prompts: List[str], *, model: str, json_output: bool, task: str) -> str:
+        # Batch jobs are asynchronous anyway: no simulated latency, just the failures
+        replies: List[Optional[str]] = []
+        for prompt in prompts:
+            _, failed, reply = self._plan(prompt, json_output, task)
+            replies.append(None if failed else reply)
+        return _hold_batch(replies)
+
+    def embed(self, texts: Sequence[str], *, model: str) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            rng = random.Random(_stable_int(model, text))
+            vectors.append([rng.gauss(0.0, 1.0) for _ in range(self.dim)])
+        return vectors
+
+
+_PROVIDERS = {"gemini": GeminiProvider, "fake": FakeProvider}
+_provider: Optional[Provider] = None
+
+
+def get_provider() -> Provider:
+    global _provider
+    if _provider is None:
+        _provider = _PROVIDERS[LLM_PROVIDER]()
+    return _provider
+
+
+def set_provider(provider: Provider) -> None:
+    """Swap the provider at runtime (benchmarks, scripts)."""
+    global _provider
+    _provider = provider
@@ -0,0 +1,246 @@
+# backend/llm/quota.py
+"""
+Client-side RPM / TPM limiter and circuit breaker. Their state lives in a
+small SQLite file (LLM_STATE_DB, under LLM_DATA_DIR) so every process on
+the host shares one quota and one breaker; with LLM_STATE_DB="" it is per
+process.
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from .errors import CircuitOpenError, RateLimitedError
+
+# Where the gateway keeps its files (limiter / breaker state, stand-in batch jobs)
+LLM_DATA_DIR = os.getenv("LLM_DATA_DIR", ".")
+
+# Client-side quota (0 = unlimited), shared by every process using LLM_STATE_DB
+LLM_RPM = int(os.getenv("LLM_RPM", "1000"))
+LLM_TPM = int(os.getenv("LLM_TPM", "1000000"))
+LLM_LIMITER_MAX_WAIT = float(os.getenv("LLM_LIMITER_MAX_WAIT", "10"))  # then fail fast
+# A process takes quota from the shared buckets in slices (this share of a
+# minute's limit) and hands it out from memory, giving back what it hasn't
+# spent after LLM_LIMITER_SYNC seconds: one write per slice, not per call
+LLM_LIMITER_SLICE = float(os.getenv("LLM_LIMITER_SLICE", "0.02"))
+LLM_LIMITER_SYNC = float(os.getenv("LLM_LIMITER_SYNC", "1"))
+# Circuit breaker: open after this many consecutive failures, probe again after the cooldown
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# SQLite file holding limiter / breaker state across uvicorn workers; "" = per process
+LLM_STATE_DB = os.getenv("LLM_STATE_DB", os.path.join(LLM_DATA_DIR, "llm_state.db"))
+
+
+class _MemoryState:
+    """Per-process stand-in for _SQLiteState."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: Dict[str, float] = {}
+
+    def read(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._rows)
+
+    def atomic(self, fn: Callable[[Dict[str, float]], Any]) -> Any:
+        with self._lock:
+            return fn(self._rows)
+
+
+class _SQLiteState:
+    """
+    Name -> number rows in a small SQLite file. atomic() runs fn on a dict
+    of all rows inside BEGIN IMMEDIATE, so read-modify-write is serialized
+    across threads and processes, then writes back whatever fn changed.
+    read() is a plain snapshot for checks that don't write: no lock taken.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_state (name TEXT PRIMARY KEY, value REAL)")
+            self._local.conn = conn
+        return conn
+
+    def read(self) -> Dict[str, float]:
+        return dict(self._conn().execute("SELECT name, value FROM llm_state"))
+
+    def atomic(self, fn: Callable[[Dict[str, float]], Any]) -> Any:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = dict(conn.execute("SELECT name, value FROM llm_state"))
+            before = dict(rows)
+            result = fn(rows)
+            changed = [(k, v) for k, v in rows.items() if before.get(k) != v]
+            if changed:
+                conn.executemany(
+                    "INSERT INTO llm_state (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                    changed,
+                )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_state = _SQLiteState(LLM_STATE_DB) if LLM_STATE_DB else _MemoryState()
+
+
+async def off_loop(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run quota / breaker bookkeeping from async code: SQLite state goes to a thread."""
+    if isinstance(_state, _MemoryState):
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute token buckets. Each holds up
+    to a minute's quota and refills continuously; a call takes 1 request
+    and its estimated tokens from both, or waits until both can cover it.
+    Calls are served from this process's slice of the buckets while it
+    lasts (see LLM_LIMITER_SLICE).
+    """
+
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM):
+        self.buckets = {"rpm": rpm, "tpm": tpm}
+        self._lock = threading.Lock()
+        self._held: Dict[str, float] = {}  # taken from the shared buckets, not spent yet
+        self._held_at = 0.0
+
+    def _try_take(self, tokens: int) -> float:
+        """Take quota if available (0.0), else seconds until it will be."""
+        costs = {
+            name: min(cost, limit)
+            for (name, limit), cost in zip(self.buckets.items(), (1, tokens))
+            if limit > 0
+        }
+        with self._lock:
+            now = time.monotonic()
+            if now - self._held_at < LLM_LIMITER_SYNC and all(
+                self._held.get(name, 0.0) >= cost for name, cost in costs.items()
+            ):
+                for name, cost in costs.items():
+                    self._held[name] -= cost
+                return 0.0
+            # Slice spent or held too long: give back the rest, take a new one
+            held = self._held
+            wait_for, self._held = _state.atomic(lambda rows: self._exchange(rows, costs, held))
+            self._held_at = now
+            return wait_for
+
+    def _exchange(
+        self, rows: Dict[str, float], costs: Dict[str, float], returned: Dict[str, float]
+    ) -> Tuple[float, Dict[str, float]]:
+        """(seconds to wait, new slice left after this call) against the shared rows."""
+        now = time.time()
+        levels, wait_for = {}, 0.0
+        for name, cost in costs.items():
+            limit = self.buckets[name]
+            level = rows.get(f"bucket:{name}", float(limit))
+            updated = rows.get(f"bucket:{name}:at", now)
+            level = level + max(0.0, now - updated) * limit / 60.0 + returned.get(name, 0.0)
+            levels[name] = level = min(float(limit), level)
+            if level < cost:
+                wait_for = max(wait_for, (cost - level) * 60.0 / limit)
+        held: Dict[str, float] = {}
+        for name, level in levels.items():
+            take = 0.0
+            if not wait_for:
+                take = min(level, max(costs[name], self.buckets[name] * LLM_LIMITER_SLICE))
+                held[name] = take - costs[name]
+            rows[f"bucket:{name}"] = level - take
+            rows[f"bucket:{name}:at"] = now
+        return wait_for, held
+
+    async def acquire(self, tokens: int, max_wait: float = LLM_LIMITER_MAX_WAIT) -> float:
+        """Wait until quota is available; returns seconds waited. Raises RateLimitedError."""
+        waited = 0.0
+        while True:
+            wait_for = await off_loop(self._try_take, tokens)
+            if not wait_for:
+                return waited
+            if waited + wait_for > max_wait:
+                raise RateLimitedError(
+                    f"LLM quota exhausted for the next {wait_for:.1f}s", retry_after=wait_for
+                )
+            # jitter so processes waiting on the same refill don't stampede it
+            pause = wait_for + random.uniform(0.0, 0.05)
+            await asyncio.sleep(pause)
+            waited += pause
+
+
+class CircuitBreaker:
+    """
+    Opens after LLM_BREAKER_FAILURES consecutive failed calls and refuses
+    calls for LLM_BREAKER_COOLDOWN seconds. After that exactly one caller
+    gets through as a probe (the breaker re-arms meanwhile): success closes
+    it, failure keeps it open for another cooldown.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go out now."""
+        # Closed or still cooling down: a plain read decides. Only claiming
+        # the probe (open -> half-open) needs the write lock.
+        open_until = _state.read().get("breaker:open_until", 0.0)
+        if not open_until:
+            return
+        now = time.time()
+        if now < open_until:
+            raise CircuitOpenError("LLM provider circuit is open", retry_after=open_until - now)
+
+        def check(rows: Dict[str, float]) -> float:
+            now = time.time()
+            open_until = rows.get("breaker:open_until", 0.0)
+            if not open_until:
+                return 0.0
+            if now < open_until:
+                return open_until - now
+            rows["breaker:open_until"] = now + self.cooldown  # this caller is the probe
+            return 0.0
+
+        retry_after = _state.atomic(check)
+        if retry_after:
+            raise CircuitOpenError("LLM provider circuit is open", retry_after=retry_after)
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            rows = _state.read()
+            if not rows.get("breaker:failures") and not rows.get("breaker:open_until"):
+                return  # already closed and clean: nothing to write
+
+        def update(rows: Dict[str, float]) -> None:
+            if ok:
+                rows["breaker:failures"] = 0.0
+                rows["breaker:open_until"] = 0.0
+                return
+            failures = rows.get("breaker:failures", 0.0) + 1
+            rows["breaker:failures"] = failures
+            if failures >= self.failures:
+                rows["breaker:open_until"] = time.time() + self.cooldown
+
+        _state.atomic(update)
+
+    def is_open(self) -> bool:
+        return time.time() < _state.read().get("breaker:open_until", 0.0)
+
+
+limiter = RateLimiter()
+breaker = CircuitBreaker()
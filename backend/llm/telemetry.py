@@ -0,0 +1,254 @@
+# backend/llm/telemetry.py
+"""
+What the gateway knows about its calls: provider health (degraded mode),
+per-task metrics with the /metrics rendering, and token accounting.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence
+
+from . import quota
+
+# Degraded mode: when recent calls are too slow or failing too often,
+# latency-bound callers skip the model for LLM_DEGRADED_COOLDOWN seconds
+HEALTH_WINDOW_SECONDS = float(os.getenv("LLM_HEALTH_WINDOW", "60"))
+HEALTH_MIN_CALLS = int(os.getenv("LLM_HEALTH_MIN_CALLS", "5"))
+LATENCY_BUDGET_SECONDS = float(os.getenv("LLM_LATENCY_BUDGET", "4"))  # p90 per call
+MAX_ERROR_RATE = float(os.getenv("LLM_MAX_ERROR_RATE", "0.5"))
+DEGRADED_COOLDOWN = float(os.getenv("LLM_DEGRADED_COOLDOWN", "30"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token), good enough for budgeting."""
+    return len(text) // 4 + 1
+
+
+# Token counts of the call in progress, if the provider reports them. A
+# ContextVar, so concurrent calls on threads or on one event loop don't mix,
+# holding a list the gateway reads back: a provider running on a worker
+# thread (asyncio.to_thread copies the context) fills in the same list.
+_usage: ContextVar[Optional[list]] = ContextVar("llm_usage", default=None)
+
+
+def track_usage() -> list:
+    """Start a call: the list report_usage() fills with (prompt, reply) tokens."""
+    usage: list = []
+    _usage.set(usage)
+    return usage
+
+
+def report_usage(prompt_tokens: int, reply_tokens: int) -> None:
+    """Called by providers with the real token counts of the current call."""
+    usage = _usage.get()
+    if usage is not None:
+        usage[:] = [prompt_tokens, reply_tokens]
+
+
+# --- Health ------------------------------------------------------------------
+
+
+class ProviderHealth:
+    """
+    Rolling window of (latency, ok) for model calls. Trips into degraded mode
+    when the window's p90 latency exceeds LATENCY_BUDGET_SECONDS or its error
+    rate exceeds MAX_ERROR_RATE; after DEGRADED_COOLDOWN the model is tried
+    again and needs HEALTH_MIN_CALLS fresh samples to trip a second time.
+    """
+
+    def __init__(self):
+        self._calls = deque()  # (finished_at, latency, ok)
+        self._lock = threading.Lock()
+        self._degraded_until = 0.0
+
+    def record(self, latency: float, ok: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._calls.append((now, latency, ok))
+            self._prune(now)
+            if len(self._calls) < HEALTH_MIN_CALLS:
+                return
+            latencies = sorted(lat for _, lat, _ in self._calls)
+            p90 = latencies[int(0.9 * (len(latencies) - 1))]
+            errors = sum(1 for _, _, good in self._calls if not good)
+            if p90 > LATENCY_BUDGET_SECONDS or errors / len(self._calls) > MAX_ERROR_RATE:
+                self._degraded_until = now + DEGRADED_COOLDOWN
+                self._calls.clear()
+
+    def _prune(self, now: float) -> None:
+        while self._calls and self._calls[0][0] < now - HEALTH_WINDOW_SECONDS:
+            self._calls.popleft()
+
+    def degraded(self) -> bool:
+        return time.monotonic() < self._degraded_until
+
+
+health = ProviderHealth()
+
+
+# --- Metrics -----------------------------------------------------------------
+
+
+# Histogram buckets (upper bounds) for /metrics
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384)
+
+
+class Histogram:
+    """Fixed-bucket histogram; Metrics holds the lock."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # per bucket, last = +Inf
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class Metrics:
+    """
+    Per-task counters and histograms. snapshot() is a plain dict for logs
+    and benchmarks; render() is the Prometheus text format for /metrics,
+    every series labeled with its task ("match_scores", "chat_helper", ...).
+    """
+
+    FIELDS = (
+        "calls", "errors", "retries", "timeouts", "parse_errors", "coalesced",
+        "rate_limited", "short_circuited",
+        "prompt_chars", "response_chars", "prompt_tokens", "response_tokens",
+        "cache_hits", "cache_misses", "batch_requests",
+    )
+    HELP = {
+        "calls": "Provider calls made.",
+        "errors": "Provider calls that raised.",
+        "retries": "Attempts after the first.",
+        "timeouts": "Provider calls that timed out.",
+        "parse_errors": "Replies that were not the JSON asked for.",
+        "coalesced": "Calls answered by an identical call already in flight.",
+        "rate_limited": "Calls refused by the client-side RPM / TPM limiter.",
+        "short_circuited": "Calls refused by the open circuit breaker.",
+        "prompt_chars": "Characters sent in prompts.",
+        "response_chars": "Characters received in replies.",
+        "prompt_tokens": "Prompt tokens (provider usage, else estimated).",
+        "response_tokens": "Reply tokens (provider usage, else estimated).",
+        "cache_hits": "Results served from a cache instead of a model call.",
+        "cache_misses": "Cache lookups that needed a model call.",
+        "batch_requests": "Prompts submitted in provider batch jobs.",
+    }
+    # observe() name -> (metric, buckets, help)
+    HISTOGRAMS = {
+        "latency": ("llm_call_duration_seconds", LATENCY_BUCKETS, "Provider call latency."),
+        "first_chunk": (
+            "llm_first_chunk_seconds", LATENCY_BUCKETS, "Time to first streamed chunk.",
+        ),
+        "prompt_tokens": ("llm_prompt_tokens", TOKEN_BUCKETS, "Prompt tokens per call."),
+        "response_tokens": ("llm_response_tokens", TOKEN_BUCKETS, "Reply tokens per call."),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, Dict[str, int]] = {}
+        self._histograms: Dict[tuple, Histogram] = {}  # (name, task) -> Histogram
+
+    def _task(self, task: str) -> Dict[str, int]:
+        if task not in self._tasks:
+            self._tasks[task] = {f: 0 for f in self.FIELDS}
+        return self._tasks[task]
+
+    def incr(self, task: str, field: str, n: int = 1) -> None:
+        with self._lock:
+            self._task(task)[field] += n
+
+    def observe(self, task: str, value: float, name: str = "latency") -> None:
+        with self._lock:
+            self._task(task)
+            histogram = self._histograms.get((name, task))
+            if histogram is None:
+                histogram = self._histograms[(name, task)] = Histogram(self.HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def observe_sizes(
+        self, task: str, prompt: str, response: str, usage: Optional[tuple] = None
+    ) -> None:
+        """Prompt / reply size of one successful call; usage = (prompt, reply) tokens if known."""
+        prompt_tokens, response_tokens = usage or (estimate_tokens(prompt), estimate_tokens(response))
+        self.incr(task, "prompt_chars", len(prompt))
+        self.incr(task, "response_chars", len(response))
+        self.incr(task, "prompt_tokens", prompt_tokens)
+        self.incr(task, "response_tokens", response_tokens)
+        self.observe(task, prompt_tokens, name="prompt_tokens")
+        self.observe(task, response_tokens, name="response_tokens")
+
+    def cache_lookup(self, task: str, hits: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            stats = self._task(task)
+            stats["cache_hits"] += hits
+            stats["cache_misses"] += misses
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            out = {task: dict(stats) for task, stats in self._tasks.items()}
+            for (name, task), histogram in self._histograms.items():
+                out[task][f"{name}_sum"] = histogram.sum
+                out[task][f"{name}_max"] = histogram.max
+            return out
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        def labels(task: str, **extra: str) -> str:
+            pairs = [("task", task), *extra.items()]
+            return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + "}"
+
+        lines: List[str] = []
+        with self._lock:
+            tasks = sorted(self._tasks)
+            for field in self.FIELDS:
+                metric = f"llm_{field}_total"
+                lines.append(f"# HELP {metric} {self.HELP[field]}")
+                lines.append(f"# TYPE {metric} counter")
+                for task in tasks:
+                    lines.append(f"{metric}{labels(task)} {self._tasks[task][field]}")
+            for name, (metric, _, help_text) in self.HISTOGRAMS.items():
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for task in tasks:
+                    histogram = self._histograms.get((name, task))
+                    if histogram is None:
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == float("inf") else repr(float(bound))
+                        lines.append(f"{metric}_bucket{labels(task, le=le)} {cumulative}")
+                    lines.append(f"{metric}_sum{labels(task)} {histogram.sum}")
+                    lines.append(f"{metric}_count{labels(task)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+
+def render_metrics() -> str:
+    """/metrics body: per-task counters and histograms plus provider state gauges."""
+    gauges = [
+        "# HELP llm_degraded 1 while latency-bound callers skip the model (ProviderHealth).",
+        "# TYPE llm_degraded gauge",
+        f"llm_degraded {int(health.degraded())}",
+        "# HELP llm_breaker_open 1 while the circuit breaker refuses calls.",
+        "# TYPE llm_breaker_open gauge",
+        f"llm_breaker_open {int(quota.breaker.is_open())}",
+    ]
+    return metrics.render() + "\n".join(gauges) + "\n"
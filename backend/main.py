@@ -1,18 +1,44 @@
 # backend/main.py
 
-from datetime import timedelta
-from typing import List
-
-from fastapi import FastAPI, Depends, HTTPException, status
+import hmac
+import json
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
-from .db import Base, engine, SessionLocal
-from . import models, schemas, auth, ai
+from .db import Base, engine, SessionLocal, add_missing_columns, run_db
+from . import (
+    models,
+    schemas,
+    auth,
+    ai,
+    ann,
+    chat_cache,
+    conversation,
+    embeddings,
+    interests,
+    job_queue,
+    llm,
+    match_cache,
+    matching,
+    pagination,
+    preferences,
+    prerank,
+    suggestions,
+)
 
 # Create DB tables
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine)
 
 app = FastAPI(
     title="TartanDate API",
@@ -33,9 +59,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
+# Overall time budget (seconds) for model scoring in one /matches call;
+# anything still unscored after that gets its local pre-rank score, marked provisional
+MATCHES_SCORING_DEADLINE = float(os.getenv("MATCHES_SCORING_DEADLINE", "12"))
+
+# "precomputed" (default): /matches reads scores filled by `python -m backend.worker`,
+# scoring inline only for users the worker hasn't reached yet (or with
+# min_shared_interests, which the stored lists don't know about)
+# "inline": /matches scores stale pairs itself (no worker needed)
+MATCHES_SCORING = os.getenv("MATCHES_SCORING", "precomputed")
+
+# Only consider people sharing at least this many interests (0 = whole campus)
+MATCHES_MIN_SHARED_INTERESTS = int(os.getenv("MATCHES_MIN_SHARED_INTERESTS", "0"))
+
+
+@app.on_event("shutdown")
+def save_ann_indexes():
+    ann.save_all()
+
+
 # --- Dependency: DB session --------------------------------------------------
 
 
@@ -67,6 +113,8 @@ def register_user(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
     db.add(user)
     db.commit()
     db.refresh(user)
+    job_queue.enqueue(db, job_queue.JOB_REFRESH_MATCHES, user.id, job_queue.PRIORITY_NEW_USER)
+    db.commit()
     return user
 
 
@@ -82,6 +130,9 @@ def login(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
         )
+    # activity feeds the background jobs' priority (job_queue.activity_priority)
+    user.last_seen_at = datetime.utcnow()
+    db.commit()
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": str(user.id)},
@@ -113,6 +164,9 @@ def upsert_profile(
         profile = models.Profile(
             user_id=current_user.id,
         )
+        old_fingerprint = None
+    else:
+        old_fingerprint = match_cache.profile_fingerprint(profile)
 
     profile.age = profile_in.age
     profile.gender = profile_in.gender
@@ -120,12 +174,41 @@ def upsert_profile(
     profile.class_year = profile_in.class_year
     profile.campus = profile_in.campus
     profile.bio = profile_in.bio
-    # interests: assume a simple comma-separated string in DB
+    # interests: comma-separated display copy + normalized index rows
     profile.interests = ",".join(profile_in.interests or [])
+    interests.sync_profile_interests(db, current_user.id, profile_in.interests or [])
 
     db.add(profile)
+    db.flush()
+    new_fingerprint = match_cache.profile_fingerprint(profile)
+    # Edits that leave every scored field alone don't bump the version
+    if old_fingerprint != new_fingerprint:
+        if old_fingerprint is not None:
+            # scores involving this user were computed against the old profile
+            match_cache.invalidate_user(db, current_user.id)
+        profile.version = (profile.version or 0) + 1
+        profile.updated_at = datetime.utcnow()
+        db.add(
+            models.ProfileChange(
+                user_id=current_user.id,
+                version=profile.version,
+                fingerprint=new_fingerprint,
+            )
+        )
+        job_queue.enqueue(
+            db, job_queue.JOB_REFRESH_MATCHES, current_user.id, job_queue.PRIORITY_PROFILE_CHANGE
+        )
     db.commit()
     db.refresh(profile)
+
+    try:
+        if matching.PRERANKER == "ann":
+            ann.on_profile_saved(db, profile)
+        elif matching.PRERANKER == "embedding":
+            if embeddings.ensure_embeddings([profile]):
+                db.commit()
+    except Exception:
+        db.rollback()  # filled in lazily on the next /matches instead
     return profile
 
 
@@ -147,77 +230,251 @@ def get_my_profile(
     return profile
 
 
+# --- Preferences routes ------------------------------------------------------
+
+
+@app.post("/preferences", response_model=schemas.PreferencesOut)
+def save_preferences(
+    prefs_in: schemas.PreferencesIn,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    preferences.save_preferences(db, current_user.id, prefs_in)
+    # The worker's shortlist was picked without these filters; refill it
+    job_queue.enqueue(
+        db, job_queue.JOB_REFRESH_MATCHES, current_user.id, job_queue.PRIORITY_PROFILE_CHANGE
+    )
+    db.commit()
+    return preferences.get_preferences(db, current_user.id)
+
+
+@app.get("/preferences/me", response_model=schemas.PreferencesOut)
+def get_my_preferences(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    return preferences.get_preferences(db, current_user.id)
+
+
 # --- Matching routes ---------------------------------------------------------
 # NOTE: no response_model here; we construct a JSON list manually
 
 
+def _profile_out(p: models.Profile):
+    # Use your existing ProfileOut schema to serialize the profile
+    try:
+        return schemas.ProfileOut.from_orm(p)
+    except Exception:
+        # If from_orm fails (e.g., missing config), fall back to a minimal dict
+        return {
+            "user_id": p.user_id,
+            "age": p.age,
+            "gender": p.gender,
+            "major": p.major,
+            "class_year": p.class_year,
+            "campus": p.campus,
+            "bio": p.bio,
+        }
+
+
 @app.get("/matches")
-def get_matches(
+async def get_matches(
+    response: Response,
+    top_k: int = Query(prerank.DEFAULT_TOP_K, ge=1, le=500),
+    min_shared_interests: int = Query(MATCHES_MIN_SHARED_INTERESTS, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_user),
 ):
     """
-    Return AI-scored matches for the current user as:
+    Return one page of AI-scored matches for the current user, best first.
+    Candidates (optionally only those sharing `min_shared_interests`) are
+    pre-ranked locally and only the best `top_k` are sent to the model.
+    Pass the `X-Next-Cursor` response header back as `cursor` to get the
+    next `limit` matches (header is absent on the last page):
     [
       {
         "profile": <ProfileOut dict>,
-        "score": <float>
+        "score": <float>,
+        "provisional": <bool>
       },
       ...
     ]
+    provisional scores come from the local ranker because the model was
+    slow, failing or out of time; a background job replaces them later.
+
+    Async: DB work runs on worker threads and model calls are awaited, so
+    a request waiting on the model doesn't hold one of the threads.
     """
-    my_profile = (
-        db.query(models.Profile)
-        .filter(models.Profile.user_id == current_user.id)
-        .first()
-    )
+    try:
+        after = pagination.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+
+    def load_profile():
+        my_profile = (
+            db.query(models.Profile)
+            .filter(models.Profile.user_id == current_user.id)
+            .first()
+        )
+        db.query(models.User).filter(models.User.id == current_user.id).update(
+            {"last_seen_at": datetime.utcnow()}
+        )
+        return my_profile
+
+    my_profile = await run_db(db, load_profile)
     if my_profile is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="You must create a profile first",
         )
 
-    # Fetch other profiles (same campus by default)
-    others = (
-        db.query(models.Profile)
-        .filter(models.Profile.user_id != current_user.id)
-        .filter(models.Profile.campus == my_profile.campus)
+    def enqueue_refresh():
+        job_queue.enqueue(
+            db, job_queue.JOB_REFRESH_MATCHES, current_user.id, job_queue.PRIORITY_ACTIVE_TODAY
+        )
+        db.commit()
+
+    ranked = None
+    if MATCHES_SCORING == "precomputed" and not min_shared_interests:
+        # Scores come from the background worker; nothing slow on this path
+        def read_precomputed():
+            # one extra row so top_page can tell whether another page exists
+            ranked = matching.precomputed_matches(db, my_profile, limit + 1, after)
+            enqueue_refresh()
+            return ranked
+
+        ranked = await run_db(db, read_precomputed)
+    if ranked is None:
+        # Inline scoring, also the fallback until the worker has stored anything
+        ranked = await matching.ascore_candidates(
+            db,
+            my_profile,
+            top_k,
+            deadline_seconds=MATCHES_SCORING_DEADLINE,
+            min_shared_interests=min_shared_interests,
+        )
+        if any(source == "local" for _, _, source in ranked):
+            # Upgrade the provisional scores in the background
+            await run_db(db, enqueue_refresh)
+
+    def render_page():
+        page, next_cursor = pagination.top_page(ranked, limit, after)
+        # Only the rows on this page get serialized
+        results = []
+        for p, score, source in page:
+            results.append(
+                {
+                    "profile": _profile_out(p),
+                    "score": score,
+                    "provisional": source == "local",
+                }
+            )
+        return results, next_cursor
+
+    results, next_cursor = await run_db(db, render_page)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+    return results
+
+
+@app.get("/matches/daily")
+def get_daily_matches(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """
+    Today's precomputed drop (python -m backend.jobs.daily_drop), best first.
+    A single indexed read, so it stays fast at peak hours:
+    [{"profile": <ProfileOut dict>, "score": <float>, "rank": <int>}, ...]
+    Empty if the job hasn't run for today yet.
+    """
+    rows = (
+        db.query(models.DailyDrop, models.Profile)
+        .join(models.Profile, models.Profile.user_id == models.DailyDrop.other_user_id)
+        .filter(models.DailyDrop.drop_date == datetime.utcnow().date())
+        .filter(models.DailyDrop.user_id == current_user.id)
+        .order_by(models.DailyDrop.rank.asc())
         .all()
     )
+    return [
+        {"profile": _profile_out(p), "score": drop.score, "rank": drop.rank}
+        for drop, p in rows
+    ]
 
-    results = []
-    for p in others:
-        try:
-            score = ai.score_match(my_profile, p)
-        except Exception:
-            # Fail open with a simple fallback
-            score = 50.0
 
-        # Use your existing ProfileOut schema to serialize the profile
-        try:
-            p_out = schemas.ProfileOut.from_orm(p)
-        except Exception:
-            # If from_orm fails (e.g., missing config), fall back to a minimal dict
-            p_out = {
-                "user_id": p.user_id,
-                "age": p.age,
-                "gender": p.gender,
-                "major": p.major,
-                "class_year": p.class_year,
-                "campus": p.campus,
-                "bio": p.bio,
-            }
-
-        results.append(
-            {
-                "profile": p_out,
-                "score": score,
-            }
-        )
+@app.get("/matches/stream")
+async def stream_matches(
+    top_k: int = Query(prerank.DEFAULT_TOP_K, ge=1, le=500),
+    min_shared_interests: int = Query(MATCHES_MIN_SHARED_INTERESTS, ge=0),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """
+    Streaming /matches as NDJSON: one line per candidate as soon as it is
+    scored, then a final line with the ranked order.
 
-    # Sort by score descending
-    results.sort(key=lambda m: m["score"], reverse=True)
-    return results
+      {"type": "match", "profile": <ProfileOut dict>, "score": <float>,
+       "source": "cache" | "model" | "local", "provisional": <bool>}
+      ...
+      {"type": "done", "order": [<user_id>, ...]}   # best first
+    """
+    def has_profile():
+        return (
+            db.query(models.Profile.id)
+            .filter(models.Profile.user_id == current_user.id)
+            .first()
+        ) is not None
+
+    if not await run_db(db, has_profile):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You must create a profile first",
+        )
+    user_id = current_user.id
+
+    def frame(p, score, source):
+        # on a worker thread: profiles may need a refresh after score commits
+        return p.user_id, {
+            "type": "match",
+            "profile": jsonable_encoder(_profile_out(p)),
+            "score": score,
+            "source": source,
+            "provisional": source == "local",
+        }
+
+    async def frames():
+        # Own session: the request-scoped one may be closed while we stream
+        stream_db = SessionLocal()
+        try:
+            my_profile = await run_db(
+                stream_db,
+                lambda: stream_db.query(models.Profile)
+                .filter(models.Profile.user_id == user_id)
+                .first(),
+            )
+            scored = []
+            async for p, score, source in matching.aiter_scored_candidates(
+                stream_db,
+                my_profile,
+                top_k,
+                deadline_seconds=MATCHES_SCORING_DEADLINE,
+                min_shared_interests=min_shared_interests,
+            ):
+                other_id, out = await run_db(stream_db, frame, p, score, source)
+                scored.append((score, other_id))
+                yield json.dumps(out) + "\n"
+            scored.sort(key=lambda su: (-su[0], su[1]))
+            yield json.dumps({"type": "done", "order": [uid for _, uid in scored]}) + "\n"
+        finally:
+            await run_in_threadpool(stream_db.close)
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
 
 
 # --- Messaging routes --------------------------------------------------------
@@ -246,6 +503,9 @@ def send_message(
         text=message_in.text,
     )
     db.add(msg)
+    db.flush()
+    # A long thread gets its summary folded by the worker, not by the chat helper
+    conversation.on_message_sent(db, current_user.id, message_in.to_user_id)
     db.commit()
     db.refresh(msg)
     return msg
@@ -285,22 +545,10 @@ def get_thread(
 # NOTE: no response_model here; we return a plain dict with summary & openers
 
 
-@app.get("/ai/chat-helper/{other_user_id}")
-def chat_helper(
-    other_user_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(auth.get_current_user),
-):
+def _chat_helper_lookup(db: Session, current_user: models.User, other_user_id: int):
     """
-    Use Gemini to:
-      - Summarize the other user's profile + interests
-      - Suggest 2–3 lines you can say next in the chat
-
-    Returns:
-    {
-      "summary": "...",
-      "openers": ["...", "...", ...]
-    }
+    (my_profile, other_profile, last_message_id, cache_key, cached result
+    or None) for the chat helper; 404 if the other user has no profile.
     """
     my_profile = (
         db.query(models.Profile)
@@ -318,28 +566,69 @@ def chat_helper(
             detail="Other user's profile not found",
         )
 
-    # Load recent messages in this thread
-    msgs = (
-        db.query(models.Message)
-        .filter(
-            (
-                (models.Message.from_user_id == current_user.id)
-                & (models.Message.to_user_id == other_user_id)
-            )
-            | (
-                (models.Message.from_user_id == other_user_id)
-                & (models.Message.to_user_id == current_user.id)
-            )
-        )
-        .order_by(models.Message.created_at.asc())
-        .all()
+    thread = conversation.thread_filter(current_user.id, other_user_id)
+    last_message_id = db.query(func.max(models.Message.id)).filter(thread).scalar()
+
+    # Unchanged profiles and no new message since last time: reuse the answer
+    cache_key = chat_cache.chat_helper_key(my_profile, other_profile, last_message_id)
+    cached = chat_cache.get(db, cache_key)
+    if cached is None:
+        # Usually pre-generated by the worker (suggestions.py): one primary-key read
+        cached = suggestions.lookup(db, my_profile, other_profile, last_message_id)
+    llm.metrics.cache_lookup("chat_helper", hits=int(cached is not None), misses=int(cached is None))
+    return my_profile, other_profile, last_message_id, cache_key, cached
+
+
+def _chat_helper_names(current_user: models.User, other_profile: models.Profile) -> dict:
+    return {
+        current_user.id: current_user.full_name or "Me",
+        other_profile.user_id: (other_profile.user.full_name if other_profile.user else None) or "Them",
+    }
+
+
+def _retry_after(e) -> str:
+    return str(max(1, int(e.retry_after + 0.999)))
+
+
+@app.get("/ai/chat-helper/{other_user_id}")
+async def chat_helper(
+    other_user_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """
+    Use Gemini to:
+      - Summarize the other user's profile + interests
+      - Suggest 2–3 lines you can say next in the chat
+
+    Returns:
+    {
+      "summary": "...",
+      "openers": ["...", "...", ...]
+    }
+    Async like /matches: the model calls hold no worker thread.
+    """
+    my_profile, other_profile, last_message_id, cache_key, cached = await run_db(
+        db, _chat_helper_lookup, db, current_user, other_user_id
     )
+    if cached is not None:
+        return cached
+
+    # Rolling thread summary + the last few messages, within a token budget
+    names = await run_db(db, _chat_helper_names, current_user, other_profile)
 
     try:
-        summary, openers = ai.summarize_and_suggest(
-            my_profile=my_profile,
-            other_profile=other_profile,
-            messages=msgs,
+        thread_summary, msgs = await conversation.abuild_context(
+            db, current_user.id, other_user_id, names
+        )
+        inputs = await run_db(db, ai.chat_helper_inputs, my_profile, other_profile, msgs)
+        result = await ai.achat_helper(*inputs, thread_summary)
+    except (llm.RateLimitedError, llm.CircuitOpenError) as e:
+        # Over quota or provider down: tell the client when to try again
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"AI temporarily unavailable: {e}",
+            headers={"Retry-After": _retry_after(e)},
         )
     except Exception as e:
         raise HTTPException(
@@ -347,4 +636,129 @@ def chat_helper(
             detail=f"AI error: {e}",
         )
 
-    return {"summary": summary, "openers": openers}
+    def save():
+        chat_cache.put(db, cache_key, result)
+        suggestions.store(db, my_profile, other_profile, last_message_id, result)
+
+    await run_db(db, save)
+    return result
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.get("/ai/chat-helper/{other_user_id}/stream")
+async def stream_chat_helper(
+    other_user_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+):
+    """
+    /ai/chat-helper as server-sent events, each sent as soon as the model
+    has finished writing it (a cached answer is replayed at once):
+
+      event: summary   data: {"summary": "..."}
+      event: opener    data: {"index": 0, "text": "..."}     # up to 3
+      event: done      data: {"summary": "...", "openers": [...]}
+      event: error     data: {"detail": "...", "retry_after": <seconds> | null}
+    """
+    def lookup():
+        _, other_profile, last_message_id, cache_key, cached = _chat_helper_lookup(
+            db, current_user, other_user_id
+        )
+        return last_message_id, cache_key, cached, _chat_helper_names(current_user, other_profile)
+
+    last_message_id, cache_key, cached, names = await run_db(db, lookup)
+    user_id = current_user.id
+
+    async def events():
+        if cached is not None:
+            yield _sse("summary", {"summary": cached["summary"]})
+            for i, text in enumerate(cached["openers"]):
+                yield _sse("opener", {"index": i, "text": text})
+            yield _sse("done", cached)
+            return
+
+        # Own session: the request-scoped one may be closed while we stream
+        stream_db = SessionLocal()
+
+        def load_profiles():
+            return tuple(
+                stream_db.query(models.Profile).filter(models.Profile.user_id == uid).first()
+                for uid in (user_id, other_user_id)
+            )
+
+        try:
+            my_profile, other = await run_db(stream_db, load_profiles)
+            summary, openers = "", {}
+            try:
+                thread_summary, msgs = await conversation.abuild_context(
+                    stream_db, user_id, other_user_id, names
+                )
+                inputs = await run_db(stream_db, ai.chat_helper_inputs, my_profile, other, msgs)
+                async for event in ai.aiter_chat_helper(*inputs, thread_summary):
+                    if event[0] == "summary":
+                        summary = event[1]
+                        yield _sse("summary", {"summary": summary})
+                    else:
+                        _, index, text = event
+                        openers[index] = text
+                        yield _sse("opener", {"index": index, "text": text})
+            except (llm.RateLimitedError, llm.CircuitOpenError) as e:
+                yield _sse(
+                    "error",
+                    {"detail": f"AI temporarily unavailable: {e}", "retry_after": e.retry_after},
+                )
+                return
+            except Exception as e:
+                yield _sse("error", {"detail": f"AI error: {e}", "retry_after": None})
+                return
+
+            result = {"summary": summary, "openers": [openers[i] for i in sorted(openers)]}
+
+            def save():
+                chat_cache.put(stream_db, cache_key, result)
+                suggestions.store(stream_db, my_profile, other, last_message_id, result)
+
+            await run_db(stream_db, save)
+            yield _sse("done", result)
+        finally:
+            await run_in_threadpool(stream_db.close)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# With a token, /metrics wants "Authorization: Bearer <token>"; without one
+# it only answers scrapes from the machine itself
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(request: Request):
+    """
+    Prometheus scrape endpoint: LLM calls, latency / token histograms,
+    errors and cache hits per task (see llm.Metrics). Per process, so
+    scrape every worker. Restricted by METRICS_TOKEN, or to localhost.
+    """
+    if METRICS_TOKEN:
+        given = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(given.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid metrics token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+    elif request.client is None or request.client.host not in METRICS_LOCAL_HOSTS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Metrics are only served to localhost unless METRICS_TOKEN is set",
+        )
+    return PlainTextResponse(
+        llm.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,167 @@
+# backend/match_cache.py
+"""
+Pairwise score cache on top of the match_scores table.
+
+Each row remembers a fingerprint of both profiles' scoring inputs, so a cached
+score is only reused while neither profile has changed since it was computed.
+
+Compatibility is mutual, so a pair is stored once under its canonical key
+user_id < other_user_id and serves both directions. Rows written per direction
+before that are never read; delete them once with
+
+    python -m backend.match_cache
+"""
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Everything that ends up in the scoring prompt (see ai.profile_to_text)
+SCORED_FIELDS = ("age", "gender", "major", "class_year", "campus", "interests", "bio")
+
+
+def profile_fingerprint(profile: models.Profile) -> str:
+    """Stable hash of the fields that feed into a match score."""
+    parts = [str(getattr(profile, f) or "") for f in SCORED_FIELDS]
+    full_name = profile.user.full_name if profile.user is not None else ""
+    parts.append(full_name or "")
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def canonical(user_id: int, other_user_id: int) -> Tuple[int, int]:
+    """The (min_id, max_id) key a pair is stored under."""
+    return (user_id, other_user_id) if user_id < other_user_id else (other_user_id, user_id)
+
+
+def pair_fingerprint(
+    user_profile: models.Profile,
+    other_profile: models.Profile,
+    user_fingerprint: Optional[str] = None,
+) -> str:
+    """Fingerprint of an unordered pair (same value whichever side asks)."""
+    return combine_fingerprints(
+        user_profile.user_id,
+        user_fingerprint or profile_fingerprint(user_profile),
+        other_profile.user_id,
+        profile_fingerprint(other_profile),
+    )
+
+
+def combine_fingerprints(
+    user_id: int, user_fingerprint: str, other_user_id: int, other_fingerprint: str
+) -> str:
+    """pair_fingerprint from already computed profile fingerprints (bulk jobs)."""
+    if user_id > other_user_id:
+        user_fingerprint, other_fingerprint = other_fingerprint, user_fingerprint
+    combined = user_fingerprint + other_fingerprint
+    return hashlib.sha256(combined.encode("utf-8")).hexdigest()
+
+
+def other_side(row: models.MatchScore, user_id: int) -> int:
+    return row.other_user_id if row.user_id == user_id else row.user_id
+
+
+def load_scores(
+    db: Session, user_id: int, other_user_ids: Iterable[int]
+) -> Dict[int, models.MatchScore]:
+    """Cached rows pairing user_id with the given users, keyed by the other user."""
+    other_user_ids = list(other_user_ids)
+    if not other_user_ids:
+        return {}
+    rows = (
+        db.query(models.MatchScore)
+        .filter(
+            (
+                (models.MatchScore.user_id == user_id)
+                & models.MatchScore.other_user_id.in_(other_user_ids)
+            )
+            | (
+                (models.MatchScore.other_user_id == user_id)
+                & models.MatchScore.user_id.in_(other_user_ids)
+            )
+        )
+        .all()
+    )
+    return {other_side(row, user_id): row for row in rows}
+
+
+def store_score(
+    db: Session,
+    user_id: int,
+    other_user_id: int,
+    score: float,
+    fingerprint: str,
+    existing: Optional[models.MatchScore] = None,
+) -> models.MatchScore:
+    """Insert or update the cached score for the pair. Caller commits."""
+    low, high = canonical(user_id, other_user_id)
+    row = existing
+    if row is None:
+        row = (
+            db.query(models.MatchScore)
+            .filter(models.MatchScore.user_id == low)
+            .filter(models.MatchScore.other_user_id == high)
+            .first()
+        )
+    if row is None:
+        row = models.MatchScore(user_id=low, other_user_id=high)
+        db.add(row)
+    row.score = score
+    row.fingerprint = fingerprint
+    row.updated_at = datetime.utcnow()
+    return row
+
+
+def invalidate_user(db: Session, user_id: int) -> int:
+    """
+    Mark every cached score involving user_id as stale (fingerprint cleared).
+    Rows and scores are kept so the rescorer knows which pairs to redo and
+    precomputed reads have something to show meanwhile. Caller commits.
+    """
+    return (
+        db.query(models.MatchScore)
+        .filter(
+            (models.MatchScore.user_id == user_id)
+            | (models.MatchScore.other_user_id == user_id)
+        )
+        .update({"fingerprint": None}, synchronize_session=False)
+    )
+
+
+def partner_ids(db: Session, user_id: int) -> List[int]:
+    """Everyone user_id has a stored pair score with."""
+    rows = (
+        db.query(models.MatchScore.user_id, models.MatchScore.other_user_id)
+        .filter(
+            (models.MatchScore.user_id == user_id)
+            | (models.MatchScore.other_user_id == user_id)
+        )
+        .all()
+    )
+    return [b if a == user_id else a for a, b in rows]
+
+
+def drop_non_canonical(db: Session) -> int:
+    """Remove rows written per direction before pairs were stored canonically."""
+    deleted = (
+        db.query(models.MatchScore)
+        .filter(models.MatchScore.user_id >= models.MatchScore.other_user_id)
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
+
+
+if __name__ == "__main__":
+    from .db import Base, engine, SessionLocal, add_missing_columns
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    db = SessionLocal()
+    try:
+        print(f"dropped {drop_non_canonical(db)} non-canonical match_scores rows")
+    finally:
+        db.close()
@@ -0,0 +1,330 @@
+# backend/matching.py
+"""
+Match candidate generation + scoring, shared by /matches and the worker.
+"""
+import heapq
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Query, Session
+
+from . import models, ai, ann, embeddings, interests, llm, match_cache, pagination, preferences, prerank
+from .db import run_db
+
+log = logging.getLogger("backend.matching")
+
+# First-stage ranker: "features" (prerank.py), "embedding" (exact cosine,
+# embeddings.py) or "ann" (approximate cosine via the campus IVF index, ann.py)
+PRERANKER = os.getenv("MATCH_PRERANKER", "features")
+
+
+def candidate_query(
+    db: Session, my_profile: models.Profile, min_shared_interests: int = 0
+) -> Query:
+    """
+    Other profiles eligible to be matched with my_profile (same campus, within
+    the user's preference filters). With min_shared_interests > 0 only people
+    sharing that many interests are returned, via the profile_interests index
+    instead of a campus scan.
+    """
+    if min_shared_interests > 0:
+        query = interests.shared_interest_query(db, my_profile, min_shared_interests)
+    else:
+        query = (
+            db.query(models.Profile)
+            .filter(models.Profile.user_id != my_profile.user_id)
+            .filter(models.Profile.campus == my_profile.campus)
+        )
+    return preferences.apply_preferences(query, db, my_profile.user_id)
+
+
+def candidate_profiles(
+    db: Session, my_profile: models.Profile, min_shared_interests: int = 0
+) -> List[models.Profile]:
+    return candidate_query(db, my_profile, min_shared_interests).all()
+
+
+def shortlist(
+    db: Session,
+    my_profile: models.Profile,
+    candidates: Query,
+    top_k: int = prerank.DEFAULT_TOP_K,
+) -> List[Tuple[models.Profile, float]]:
+    """Best top_k of the candidate query by the configured local ranker, highest first."""
+    if PRERANKER == "ann":
+        return ann.shortlist(db, my_profile, candidates, top_k)
+    if PRERANKER == "embedding":
+        return embeddings.shortlist(db, my_profile, candidates.all(), top_k)
+    return prerank.shortlist(my_profile, candidates.all(), top_k)
+
+
+def _split_cached(
+    db: Session, my_profile: models.Profile, top_k: int, min_shared_interests: int
+) -> Tuple[List[Tuple[models.Profile, float]], Dict[int, models.MatchScore], str,
+           List[Tuple[models.Profile, float]], List[models.Profile]]:
+    """
+    Shortlist the campus and check the score cache: (ranked with local scores,
+    cached rows by user, my fingerprint, [(profile, cached score)] still valid,
+    [profile] needing the model).
+    """
+    ranked = shortlist(db, my_profile, candidate_query(db, my_profile, min_shared_interests), top_k)
+
+    # Reuse cached scores whose fingerprint still matches both profiles
+    cached = match_cache.load_scores(db, my_profile.user_id, [p.user_id for p, _ in ranked])
+    my_fingerprint = match_cache.profile_fingerprint(my_profile)
+
+    fresh, stale = [], []
+    for p, _ in ranked:
+        row = cached.get(p.user_id)
+        if row is not None and row.fingerprint == match_cache.pair_fingerprint(
+            my_profile, p, my_fingerprint
+        ):
+            fresh.append((p, row.score))
+        else:
+            stale.append(p)
+    llm.metrics.cache_lookup("match_scores", hits=len(fresh), misses=len(stale))
+    return ranked, cached, my_fingerprint, fresh, stale
+
+
+def _prepare(
+    db: Session,
+    my_profile: models.Profile,
+    top_k: int,
+    min_shared_interests: int,
+    allow_degraded: bool,
+) -> Dict:
+    """
+    Everything aiter_scored_candidates needs from the DB, read up front on a
+    worker thread: the event loop then only touches plain values.
+    """
+    ranked, cached, my_fingerprint, fresh, stale = _split_cached(
+        db, my_profile, top_k, min_shared_interests
+    )
+    return {
+        "user_id": my_profile.user_id,
+        "ranked": [(p.user_id, p, local) for p, local in ranked],
+        "cached": cached,
+        "fresh": fresh,
+        "stale_ids": {p.user_id for p in stale},
+        "user_dict": ai.profile_to_dict(my_profile),
+        "candidates": ai.candidate_dicts(stale),
+        "fingerprints": {
+            p.user_id: match_cache.pair_fingerprint(my_profile, p, my_fingerprint) for p in stale
+        },
+        "degraded": bool(stale) and allow_degraded and ai.scoring_degraded(),
+    }
+
+
+def _store_scores(db: Session, prep: Dict, batch_scores: Dict[int, float]) -> None:
+    for other_user_id, score in batch_scores.items():
+        match_cache.store_score(
+            db,
+            prep["user_id"],
+            other_user_id,
+            score,
+            prep["fingerprints"][other_user_id],
+            existing=prep["cached"].get(other_user_id),
+        )
+
+
+async def aiter_scored_candidates(
+    db: Session,
+    my_profile: models.Profile,
+    top_k: int = prerank.DEFAULT_TOP_K,
+    deadline_seconds: Optional[float] = None,
+    min_shared_interests: int = 0,
+    allow_degraded: bool = True,
+) -> AsyncIterator[Tuple[models.Profile, float, str]]:
+    """
+    Pre-rank the campus locally, then model-score the top_k shortlist, yielding
+    (profile, score, source) for each candidate as soon as its score is known.
+
+    source is "cache" for stored scores whose fingerprints still match both
+    profiles (yielded first), "model" for stale pairs scored in concurrent
+    batches and written back (yielded batch by batch), and "local" for anything
+    the model didn't score within deadline_seconds (pre-rank score, not cached;
+    provisional until the worker scores it). With allow_degraded, the model is
+    skipped entirely while ai.scoring_degraded() and every stale pair is "local".
+
+    The shortlist and cache reads / writes run on worker threads and model
+    calls are awaited on the event loop, so a request waiting on the model
+    holds no thread. Profiles may be expired by the score commits: serialize
+    them on a worker thread too.
+    """
+    prep = await run_db(
+        db, _prepare, db, my_profile, top_k, min_shared_interests, allow_degraded
+    )
+    for p, score in prep["fresh"]:
+        yield p, score, "cache"
+    stale_ids = prep["stale_ids"]
+    if not stale_ids:
+        return
+    by_user = {user_id: p for user_id, p, _ in prep["ranked"]}
+
+    done = set()
+    if not prep["degraded"]:
+        deadline = None if deadline_seconds is None else time.monotonic() + deadline_seconds
+        try:
+            async for batch_scores in ai.aiter_score_matches(
+                prep["user_id"], prep["user_dict"], prep["candidates"], deadline
+            ):
+                await run_db(db, _store_scores, db, prep, batch_scores)
+                for user_id, score in batch_scores.items():
+                    done.add(user_id)
+                    yield by_user[user_id], score, "model"
+        except (llm.LLMError, SQLAlchemyError) as e:
+            # run_db rolled back any half-written batch; fall back below
+            log.warning("scoring for user %s stopped early: %r", prep["user_id"], e)
+
+    # Degraded, out of time or failed: the local pre-rank score
+    for user_id, p, local in prep["ranked"]:
+        if user_id in stale_ids and user_id not in done:
+            yield p, local, "local"
+
+
+async def ascore_candidates(
+    db: Session,
+    my_profile: models.Profile,
+    top_k: int = prerank.DEFAULT_TOP_K,
+    deadline_seconds: Optional[float] = None,
+    min_shared_interests: int = 0,
+    allow_degraded: bool = True,
+) -> List[Tuple[models.Profile, float, str]]:
+    """aiter_scored_candidates collected as (profile, score, source) rows."""
+    return [
+        row
+        async for row in aiter_scored_candidates(
+            db, my_profile, top_k, deadline_seconds, min_shared_interests, allow_degraded
+        )
+    ]
+
+
+def iter_scored_candidates(
+    db: Session,
+    my_profile: models.Profile,
+    top_k: int = prerank.DEFAULT_TOP_K,
+    deadline_seconds: Optional[float] = None,
+    min_shared_interests: int = 0,
+    allow_degraded: bool = True,
+) -> Iterator[Tuple[models.Profile, float, str]]:
+    """aiter_scored_candidates for sync callers (the worker)."""
+    return llm.iter_sync(
+        aiter_scored_candidates(
+            db, my_profile, top_k, deadline_seconds, min_shared_interests, allow_degraded
+        )
+    )
+
+
+def score_candidates(
+    db: Session,
+    my_profile: models.Profile,
+    top_k: int = prerank.DEFAULT_TOP_K,
+    deadline_seconds: Optional[float] = None,
+    min_shared_interests: int = 0,
+    allow_degraded: bool = True,
+) -> List[Tuple[models.Profile, float, str]]:
+    """iter_scored_candidates collected as (profile, score, source) rows."""
+    return list(
+        iter_scored_candidates(
+            db, my_profile, top_k, deadline_seconds, min_shared_interests, allow_degraded
+        )
+    )
+
+
+def precompute_campus(
+    db: Session, campus: str, top_k: int = prerank.DEFAULT_TOP_K
+) -> int:
+    """
+    Fill match_scores for every user's shortlist on a campus, scoring each
+    unordered pair at most once: pairs are collected in the upper triangle
+    (min_id, max_id) and each lower id is scored in one batched call against
+    all of its stale higher partners. Returns how many pairs the model scored.
+    """
+    profiles = db.query(models.Profile).filter(models.Profile.campus == campus).all()
+    by_user = {p.user_id: p for p in profiles}
+
+    pairs = set()
+    for p in profiles:
+        for other, _ in shortlist(db, p, candidate_query(db, p), top_k):
+            pairs.add(match_cache.canonical(p.user_id, other.user_id))
+
+    existing = {
+        (row.user_id, row.other_user_id): row
+        for row in db.query(models.MatchScore)
+        .filter(models.MatchScore.user_id.in_(list(by_user)))
+        .filter(models.MatchScore.other_user_id.in_(list(by_user)))
+    }
+    fingerprints = {uid: match_cache.profile_fingerprint(p) for uid, p in by_user.items()}
+    stale: Dict[int, List[int]] = {}
+    for low, high in sorted(pairs):
+        fingerprint = match_cache.pair_fingerprint(by_user[low], by_user[high], fingerprints[low])
+        row = existing.get((low, high))
+        if row is None or row.fingerprint != fingerprint:
+            stale.setdefault(low, []).append(high)
+
+    scored = 0
+    for low, highs in stale.items():
+        me = by_user[low]
+        fresh = ai.score_matches(me, [by_user[h] for h in highs])
+        for high, score in fresh.items():
+            match_cache.store_score(
+                db,
+                low,
+                high,
+                score,
+                match_cache.pair_fingerprint(me, by_user[high], fingerprints[low]),
+                existing=existing.get((low, high)),
+            )
+        db.commit()
+        scored += len(fresh)
+    return scored
+
+
+def precomputed_matches(
+    db: Session,
+    my_profile: models.Profile,
+    limit: int = prerank.DEFAULT_TOP_K,
+    after: Optional[pagination.Cursor] = None,
+) -> Optional[List[Tuple[models.Profile, float, str]]]:
+    """
+    Read up to `limit` of the worker's stored scores for my_profile, best first,
+    starting after the keyset cursor (indexed read, no model calls), as
+    (profile, score, "cache") rows. None if nothing is stored for this user
+    yet, so the caller can score inline instead.
+    """
+    # Pairs are stored once (user_id < other_user_id), so "my" rows are split
+    # across two indexed halves; each is read in score order and merged
+    ms = models.MatchScore
+    halves = []
+    for mine, theirs in ((ms.user_id, ms.other_user_id), (ms.other_user_id, ms.user_id)):
+        query = (
+            db.query(models.Profile, ms.score)
+            .join(ms, theirs == models.Profile.user_id)
+            .filter(mine == my_profile.user_id)
+            .filter(models.Profile.campus == my_profile.campus)
+        )
+        query = preferences.apply_preferences(query, db, my_profile.user_id)
+        if after is not None:
+            query = query.filter(
+                (ms.score < after[0]) | ((ms.score == after[0]) & (theirs > after[1]))
+            )
+        halves.append(query.order_by(ms.score.desc(), theirs.asc()).limit(limit).all())
+    rows = heapq.nsmallest(
+        limit, halves[0] + halves[1], key=lambda row: (-row[1], row[0].user_id)
+    )
+    if rows:
+        return [(p, score, "cache") for p, score in rows]
+    has_scores = (
+        db.query(models.MatchScore.id)
+        .filter(
+            (models.MatchScore.user_id == my_profile.user_id)
+            | (models.MatchScore.other_user_id == my_profile.user_id)
+        )
+        .first()
+    )
+    if has_scores:
+        return []  # ran off the end of the stored list
+    return None  # nothing stored yet: the caller scores inline
@@ -1,5 +1,5 @@
 # backend/models.py
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, DateTime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Float, Date, DateTime, Index, Boolean, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -13,6 +13,8 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     full_name = Column(String)
+    # bumped on login / match views; used to prioritize background jobs
+    last_seen_at = Column(DateTime, default=datetime.utcnow)
 
     profile = relationship("Profile", back_populates="user", uselist=False)
 
@@ -28,21 +30,84 @@ class Profile(Base):
     major = Column(String)
     class_year = Column(Integer)
     campus = Column(String)
-    interests = Column(Text)  # comma-separated string
+    # comma-separated display copy; profile_interests is the queryable form
+    interests = Column(Text)
     bio = Column(Text)
+    # packed float32 vector of the profile text (see embeddings.py) and the
+    # (embedder, text) hash it was computed from
+    embedding = Column(LargeBinary)
+    embedding_key = Column(String)
+    # bumped only when a scored field changes (see match_cache.SCORED_FIELDS)
+    version = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="profile")
 
+    __table_args__ = (
+        Index("ix_profiles_user_id", "user_id"),
+        # candidate queries: same campus, then preference hard-filters
+        Index("ix_profiles_campus_gender_age", "campus", "gender", "age"),
+        Index("ix_profiles_campus_class_year", "campus", "class_year"),
+    )
+
+
+class Preference(Base):
+    """Hard filters on who shows up in a user's /matches (all optional)."""
+
+    __tablename__ = "preferences"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    min_age = Column(Integer)
+    max_age = Column(Integer)
+    genders = Column(Text)  # comma-separated; empty = any
+    min_class_year = Column(Integer)
+    max_class_year = Column(Integer)
+
+
+class PreferenceExclusion(Base):
+    __tablename__ = "preference_exclusions"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    excluded_user_id = Column(Integer, primary_key=True)
+
+
+class Interest(Base):
+    __tablename__ = "interests"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)  # normalized (lowercase)
+
+
+class ProfileInterest(Base):
+    __tablename__ = "profile_interests"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    interest_id = Column(Integer, ForeignKey("interests.id"), primary_key=True)
+
+    __table_args__ = (
+        # "who else has interest X" lookups
+        Index("ix_profile_interests_interest_user", "interest_id", "user_id"),
+    )
+
 
 class MatchScore(Base):
     __tablename__ = "match_scores"
 
     id = Column(Integer, primary_key=True, index=True)
+    # one row per unordered pair: user_id < other_user_id (see match_cache.py)
     user_id = Column(Integer, index=True)
     other_user_id = Column(Integer, index=True)
     score = Column(Float)
+    # hash of both profiles' scoring inputs at the time the score was computed
+    fingerprint = Column(String)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_match_scores_pair", "user_id", "other_user_id", unique=True),
+        Index("ix_match_scores_user_score", "user_id", "score"),
+        Index("ix_match_scores_other_score", "other_user_id", "score"),
+    )
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -52,3 +117,118 @@ class Message(Base):
     to_user_id = Column(Integer, index=True)
     text = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # one thread direction, newest last: last-message lookups for chat_cache
+        Index("ix_messages_thread", "from_user_id", "to_user_id", "id"),
+    )
+
+
+class ProfileChange(Base):
+    """Append-only feed of scoring-relevant profile edits (see rescorer.py)."""
+
+    __tablename__ = "profile_changes"
+
+    id = Column(Integer, primary_key=True, index=True)  # feed position
+    user_id = Column(Integer, index=True)
+    version = Column(Integer)
+    fingerprint = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FeedCursor(Base):
+    """
+    How far each consumer has read the profile_changes feed. Batch jobs also
+    keep their resume checkpoint here (e.g. "daily_drop:<campus>:<date>").
+    """
+
+    __tablename__ = "feed_cursors"
+
+    name = Column(String, primary_key=True)
+    position = Column(Integer, default=0)
+
+
+class MatchJob(Base):
+    """Durable work item for the background worker (see backend/worker.py)."""
+
+    __tablename__ = "match_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    user_id = Column(Integer, index=True)
+    # "<kind>:<user_id>" while queued/leased, NULL once finished -> one live job per key
+    dedupe_key = Column(String, unique=True)
+    priority = Column(Integer, default=0)
+    status = Column(String, default="queued")  # queued | leased | done | failed | dead
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    lease_token = Column(String)
+    lease_expires_at = Column(DateTime)
+    # set when the job is re-enqueued while leased, so it runs once more
+    rerun = Column(Boolean, default=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_match_jobs_ready", "status", "priority", "run_after"),
+    )
+
+
+class DailyDrop(Base):
+    """A user's precomputed top-N matches for one day (see backend/jobs/daily_drop.py)."""
+
+    __tablename__ = "daily_drops"
+
+    id = Column(Integer, primary_key=True)
+    drop_date = Column(Date, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    rank = Column(Integer, nullable=False)  # 0 = best
+    other_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    score = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_daily_drops_user_rank", "drop_date", "user_id", "rank", unique=True),
+    )
+
+
+class AICacheEntry(Base):
+    """Persistent tier of chat_cache.py (only used with CHAT_CACHE_PERSIST=1)."""
+
+    __tablename__ = "ai_cache"
+
+    key = Column(String, primary_key=True)
+    value = Column(Text, nullable=False)  # JSON
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class ThreadSummary(Base):
+    """Rolling summary of a message thread (see conversation.py)."""
+
+    __tablename__ = "thread_summaries"
+
+    # canonical pair, user_id < other_user_id
+    user_id = Column(Integer, primary_key=True)
+    other_user_id = Column(Integer, primary_key=True)
+    summary = Column(Text, default="")
+    # every message with id <= this is folded into summary
+    through_message_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class AISuggestion(Base):
+    """Chat-helper summary + openers for user_id about other_user_id (see suggestions.py)."""
+
+    __tablename__ = "ai_suggestions"
+
+    user_id = Column(Integer, primary_key=True)
+    other_user_id = Column(Integer, primary_key=True)
+    # versions: both profiles' fingerprints and the thread's last message when generated
+    user_fingerprint = Column(String, nullable=False)
+    other_fingerprint = Column(String, nullable=False)
+    last_message_id = Column(Integer, default=0)
+    summary = Column(Text, default="")
+    openers = Column(Text, default="[]")  # JSON list
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,55 @@
+# backend/pagination.py
+"""
+Keyset pagination for score-ordered lists (/matches).
+
+Rows are ordered by (score desc, user_id asc); the opaque cursor is the
+(score, user_id) of the last row on the previous page, so later pages stay
+stable even if rows are added in front.
+"""
+import base64
+import heapq
+import json
+from typing import List, Optional, Sequence, Tuple
+
+Cursor = Tuple[float, int]
+
+
+def encode_cursor(score: float, user_id: int) -> str:
+    raw = json.dumps([score, user_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """Inverse of encode_cursor. Raises ValueError on anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, user_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return float(score), int(user_id)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+
+def is_after(score: float, user_id: int, after: Cursor) -> bool:
+    """True if (score, user_id) sorts strictly after the cursor position."""
+    return score < after[0] or (score == after[0] and user_id > after[1])
+
+
+def top_page(
+    ranked: Sequence[Tuple],
+    limit: int,
+    after: Optional[Cursor] = None,
+) -> Tuple[List[Tuple], Optional[str]]:
+    """
+    Best `limit` rows after the cursor (O(n log limit), no full sort),
+    plus the cursor for the next page or None if this is the last one.
+    Rows are (profile, score, ...) tuples; extra fields are passed through.
+    """
+    if after is not None:
+        ranked = [row for row in ranked if is_after(row[1], row[0].user_id, after)]
+    # one extra row tells us whether another page exists
+    page = heapq.nsmallest(limit + 1, ranked, key=lambda row: (-row[1], row[0].user_id))
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    last_profile, last_score = page[-1][:2]
+    return page, encode_cursor(last_score, last_profile.user_id)
@@ -0,0 +1,76 @@
+# backend/preferences.py
+"""
+Per-user match preferences, applied as SQL filters on the candidate query so
+excluded people are never loaded, pre-ranked or scored.
+"""
+from typing import Dict, List
+
+from sqlalchemy.orm import Query, Session
+
+from . import models
+
+
+def _split(genders: str) -> List[str]:
+    return [g for g in (genders or "").split(",") if g]
+
+
+def get_preferences(db: Session, user_id: int) -> Dict:
+    pref = db.query(models.Preference).filter(models.Preference.user_id == user_id).first()
+    excluded = [
+        uid for (uid,) in db.query(models.PreferenceExclusion.excluded_user_id)
+        .filter(models.PreferenceExclusion.user_id == user_id)
+        .order_by(models.PreferenceExclusion.excluded_user_id)
+    ]
+    return {
+        "user_id": user_id,
+        "min_age": pref.min_age if pref else None,
+        "max_age": pref.max_age if pref else None,
+        "genders": _split(pref.genders) if pref else [],
+        "min_class_year": pref.min_class_year if pref else None,
+        "max_class_year": pref.max_class_year if pref else None,
+        "exclude_user_ids": excluded,
+    }
+
+
+def save_preferences(db: Session, user_id: int, prefs_in) -> None:
+    """Replace user_id's preferences and exclusion list. Caller commits."""
+    pref = db.query(models.Preference).filter(models.Preference.user_id == user_id).first()
+    if pref is None:
+        pref = models.Preference(user_id=user_id)
+        db.add(pref)
+    pref.min_age = prefs_in.min_age
+    pref.max_age = prefs_in.max_age
+    pref.genders = ",".join(g.strip() for g in prefs_in.genders if g.strip())
+    pref.min_class_year = prefs_in.min_class_year
+    pref.max_class_year = prefs_in.max_class_year
+
+    (
+        db.query(models.PreferenceExclusion)
+        .filter(models.PreferenceExclusion.user_id == user_id)
+        .delete(synchronize_session=False)
+    )
+    for excluded in set(prefs_in.exclude_user_ids):
+        db.add(models.PreferenceExclusion(user_id=user_id, excluded_user_id=excluded))
+
+
+def apply_preferences(query: Query, db: Session, user_id: int) -> Query:
+    """Narrow a models.Profile query to people user_id wants to see."""
+    pref = db.query(models.Preference).filter(models.Preference.user_id == user_id).first()
+    if pref is not None:
+        genders = _split(pref.genders)
+        if genders:
+            query = query.filter(models.Profile.gender.in_(genders))
+        if pref.min_age is not None:
+            query = query.filter(models.Profile.age >= pref.min_age)
+        if pref.max_age is not None:
+            query = query.filter(models.Profile.age <= pref.max_age)
+        if pref.min_class_year is not None:
+            query = query.filter(models.Profile.class_year >= pref.min_class_year)
+        if pref.max_class_year is not None:
+            query = query.filter(models.Profile.class_year <= pref.max_class_year)
+
+    excluded = (
+        db.query(models.PreferenceExclusion.excluded_user_id)
+        .filter(models.PreferenceExclusion.user_id == user_id)
+    )
+    return query.filter(~models.Profile.user_id.in_(excluded.subquery().select()))
@@ -0,0 +1,120 @@
+# backend/prerank.py
+"""
+Cheap local first stage for /matches.
+
+Scores every candidate against the current user in one NumPy pass and keeps
+only the best top_k for the (expensive) model scorer in ai.py.
+"""
+import os
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from . import models
+from .interests import normalize
+
+DEFAULT_TOP_K = int(os.getenv("PRERANK_TOP_K", "50"))
+
+# Relative weight of each signal; scores end up in 0..100 like the model's
+WEIGHTS = {
+    "interests": 0.45,
+    "major": 0.15,
+    "class_year": 0.15,
+    "bio": 0.25,
+}
+# Class years this far apart (or more) get no class-year credit
+MAX_YEAR_GAP = 4.0
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "at", "be", "but", "for", "i", "i'm", "im", "in",
+    "is", "it", "me", "my", "of", "on", "or", "so", "the", "to", "with", "you",
+}
+
+
+def interest_set(profile: models.Profile) -> set:
+    return {normalize(i) for i in (profile.interests or "").split(",") if i.strip()}
+
+
+def bio_terms(profile: models.Profile) -> set:
+    return {t for t in _TOKEN_RE.findall((profile.bio or "").lower()) if t not in _STOPWORDS}
+
+
+def _jaccard(me: set, others: List[set]) -> np.ndarray:
+    """Jaccard similarity of `me` against every set in `others`, as one array op."""
+    vocab: Dict[str, int] = {t: i for i, t in enumerate(me)}
+    cols = [vocab.setdefault(t, len(vocab)) for s in others for t in s]
+    if not cols:
+        return np.zeros(len(others))
+
+    # (row, term) pairs of a sparse candidate x term incidence matrix
+    rows = np.repeat(np.arange(len(others)), [len(s) for s in others])
+    cols = np.asarray(cols)
+    in_me = cols < len(me)
+
+    shared = np.bincount(rows, weights=in_me, minlength=len(others))
+    sizes = np.bincount(rows, minlength=len(others))
+    union = sizes + len(me) - shared
+    return np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+
+
+def local_scores(
+    my_profile: models.Profile, candidates: Sequence[models.Profile]
+) -> np.ndarray:
+    """Compatibility estimate in 0..100 for each candidate, in input order."""
+    if not candidates:
+        return np.zeros(0)
+
+    interests = _jaccard(interest_set(my_profile), [interest_set(p) for p in candidates])
+    bio = _jaccard(bio_terms(my_profile), [bio_terms(p) for p in candidates])
+
+    my_major = (my_profile.major or "").strip().lower()
+    majors = np.array([(p.major or "").strip().lower() for p in candidates])
+    major = ((majors == my_major) & (majors != "")).astype(np.float64)
+
+    years = np.array(
+        [p.class_year if p.class_year is not None else np.nan for p in candidates],
+        dtype=np.float64,
+    )
+    my_year = my_profile.class_year if my_profile.class_year is not None else np.nan
+    return combine(interests, major, year_similarity(years, my_year), bio)
+
+
+def year_similarity(years: np.ndarray, my_year: float) -> np.ndarray:
+    """1 for the same class year, falling to 0 at MAX_YEAR_GAP; 0 if either is unknown."""
+    year = np.clip(1.0 - np.abs(years - my_year) / MAX_YEAR_GAP, 0.0, 1.0)
+    return np.nan_to_num(year, nan=0.0)
+
+
+def combine(
+    interests: np.ndarray, major: np.ndarray, year: np.ndarray, bio: np.ndarray
+) -> np.ndarray:
+    """Weighted sum of the per-signal similarities (each 0..1), scaled to 0..100."""
+    combined = (
+        WEIGHTS["interests"] * interests
+        + WEIGHTS["major"] * major
+        + WEIGHTS["class_year"] * year
+        + WEIGHTS["bio"] * bio
+    )
+    return 100.0 * combined
+
+
+def shortlist(
+    my_profile: models.Profile,
+    candidates: Sequence[models.Profile],
+    top_k: int = DEFAULT_TOP_K,
+) -> List[Tuple[models.Profile, float]]:
+    """
+    Best top_k candidates by local score, highest first, as (profile, local_score).
+    """
+    scores = local_scores(my_profile, candidates)
+    if top_k <= 0 or len(candidates) == 0:
+        return []
+    if top_k < len(candidates):
+        # argpartition is O(n); only the kept slice gets sorted
+        idx = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        idx = np.arange(len(candidates))
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    return [(candidates[i], float(scores[i])) for i in idx]
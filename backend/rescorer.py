@@ -0,0 +1,101 @@
+# backend/rescorer.py
+"""
+Incremental rescoring driven by the profile_changes feed.
+
+upsert_profile appends a feed row only when a scored field actually changed.
+run_once() reads the feed from this consumer's cursor and, for each changed
+profile, rescores just the pairs involving it: the pairs it already has stored
+scores for plus its current shortlist. One edit therefore costs at most
+O(campus) work, never a global rescore. The background worker calls it on
+every loop.
+"""
+import os
+from typing import Dict, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models, ai, match_cache, matching, prerank
+
+CONSUMER = "rescorer"
+FEED_BATCH = int(os.getenv("RESCORER_FEED_BATCH", "100"))
+
+
+def _cursor(db: Session, name: str) -> models.FeedCursor:
+    cursor = db.query(models.FeedCursor).filter(models.FeedCursor.name == name).first()
+    if cursor is None:
+        cursor = models.FeedCursor(name=name, position=0)
+        db.add(cursor)
+    return cursor
+
+
+def rescore_user(db: Session, profile: models.Profile, top_k: int = prerank.DEFAULT_TOP_K) -> int:
+    """Rescore stale pairs between profile and its partners / shortlist. Returns pairs scored."""
+    partner_ids = set(match_cache.partner_ids(db, profile.user_id))
+    partner_ids.update(
+        p.user_id
+        for p, _ in matching.shortlist(db, profile, matching.candidate_query(db, profile), top_k)
+    )
+    if not partner_ids:
+        return 0
+
+    partners = (
+        db.query(models.Profile)
+        .filter(models.Profile.user_id.in_(list(partner_ids)))
+        .filter(models.Profile.campus == profile.campus)  # moved away: leave the old row stale
+        .all()
+    )
+    cached = match_cache.load_scores(db, profile.user_id, [p.user_id for p in partners])
+    my_fingerprint = match_cache.profile_fingerprint(profile)
+    fingerprints = {
+        p.user_id: match_cache.pair_fingerprint(profile, p, my_fingerprint) for p in partners
+    }
+    stale = [
+        p for p in partners
+        if p.user_id not in cached or cached[p.user_id].fingerprint != fingerprints[p.user_id]
+    ]
+    if not stale:
+        return 0
+
+    fresh = ai.score_matches(profile, stale)
+    for user_id, score in fresh.items():
+        match_cache.store_score(
+            db, profile.user_id, user_id, score, fingerprints[user_id], existing=cached.get(user_id)
+        )
+    db.commit()
+    return len(fresh)
+
+
+def run_once(
+    db: Session, top_k: int = prerank.DEFAULT_TOP_K, consumer: str = CONSUMER
+) -> Tuple[int, int]:
+    """
+    Process up to FEED_BATCH feed entries past the cursor.
+    Returns (changes consumed, pairs scored).
+    """
+    cursor = _cursor(db, consumer)
+    changes = (
+        db.query(models.ProfileChange)
+        .filter(models.ProfileChange.id > (cursor.position or 0))
+        .order_by(models.ProfileChange.id.asc())
+        .limit(FEED_BATCH)
+        .all()
+    )
+    if not changes:
+        db.commit()
+        return 0, 0
+
+    # Several edits to one profile in the batch: only its current state matters
+    latest: Dict[int, models.ProfileChange] = {}
+    for change in changes:
+        latest[change.user_id] = change
+
+    scored = 0
+    for user_id in latest:
+        profile = db.query(models.Profile).filter(models.Profile.user_id == user_id).first()
+        if profile is not None:
+            scored += rescore_user(db, profile, top_k)
+
+    # Only advance once the batch is done, so a crash replays it (scoring is idempotent)
+    cursor.position = changes[-1].id
+    db.commit()
+    return len(changes), scored
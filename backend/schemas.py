@@ -1,6 +1,6 @@
 # backend/schemas.py
 from pydantic import BaseModel, EmailStr
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -37,6 +37,19 @@ class ProfileOut(ProfileCreate):
         orm_mode = True
 
 
+class PreferencesIn(BaseModel):
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+    genders: List[str] = []
+    min_class_year: Optional[int] = None
+    max_class_year: Optional[int] = None
+    exclude_user_ids: List[int] = []
+
+
+class PreferencesOut(PreferencesIn):
+    user_id: int
+
+
 class MatchOut(BaseModel):
     user_id: int
     other_user_id: int
@@ -0,0 +1,124 @@
+# backend/suggestions.py
+"""
+Pre-generated chat-helper suggestions (ai_suggestions).
+
+When the worker refreshes a user's matches it queues a generate_suggestions
+job (deferred to SUGGESTIONS_OFFPEAK_HOURS, if set). That job writes the
+profile summary and openers for every pair in the user's top
+SUGGESTIONS_TOP_N that has no current row yet, so /ai/chat-helper
+usually answers with one primary-key read instead of a model call.
+
+A row is current while both profiles' fingerprints and the thread's last
+message id match what it was generated from. Live chat-helper results are
+written back the same way, so the next read is served from the table too.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, ai, match_cache, matching
+
+SUGGESTIONS_TOP_N = int(os.getenv("SUGGESTIONS_TOP_N", "10"))
+# "start-end" UTC hours, e.g. "2-6"; empty = generate whenever the worker gets to it
+SUGGESTIONS_OFFPEAK_HOURS = os.getenv("SUGGESTIONS_OFFPEAK_HOURS", "")
+
+
+def next_offpeak(now: Optional[datetime] = None) -> datetime:
+    """Earliest time at or after now inside the off-peak window."""
+    now = now or datetime.utcnow()
+    if not SUGGESTIONS_OFFPEAK_HOURS:
+        return now
+    start, end = (int(h) % 24 for h in SUGGESTIONS_OFFPEAK_HOURS.split("-", 1))
+    hour = now.hour
+    inside = start <= hour < end if start <= end else (hour >= start or hour < end)
+    if inside:
+        return now
+    run_at = now.replace(hour=start, minute=0, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+def lookup(
+    db: Session,
+    my_profile: Optional[models.Profile],
+    other_profile: models.Profile,
+    last_message_id: Optional[int],
+) -> Optional[Dict]:
+    """Stored {"summary", "openers"} for the pair if still current, else None."""
+    if my_profile is None:
+        return None
+    row = db.get(models.AISuggestion, (my_profile.user_id, other_profile.user_id))
+    if (
+        row is None
+        or row.last_message_id != (last_message_id or 0)
+        or row.user_fingerprint != match_cache.profile_fingerprint(my_profile)
+        or row.other_fingerprint != match_cache.profile_fingerprint(other_profile)
+    ):
+        return None
+    return {"summary": row.summary, "openers": json.loads(row.openers)}
+
+
+def store(
+    db: Session,
+    my_profile: Optional[models.Profile],
+    other_profile: models.Profile,
+    last_message_id: Optional[int],
+    result: Dict,
+) -> None:
+    """Insert or replace the pair's suggestions. Caller commits."""
+    if my_profile is None:
+        return
+    db.merge(
+        models.AISuggestion(
+            user_id=my_profile.user_id,
+            other_user_id=other_profile.user_id,
+            user_fingerprint=match_cache.profile_fingerprint(my_profile),
+            other_fingerprint=match_cache.profile_fingerprint(other_profile),
+            last_message_id=last_message_id or 0,
+            summary=result["summary"],
+            openers=json.dumps(result["openers"]),
+            created_at=datetime.utcnow(),
+        )
+    )
+
+
+def _has_messages(db: Session, user_id: int, other_user_ids: List[int]) -> set:
+    """The subset of other_user_ids user_id has exchanged messages with."""
+    if not other_user_ids:
+        return set()
+    m = models.Message
+    rows = (
+        db.query(m.from_user_id, m.to_user_id)
+        .filter(
+            ((m.from_user_id == user_id) & m.to_user_id.in_(other_user_ids))
+            | ((m.to_user_id == user_id) & m.from_user_id.in_(other_user_ids))
+        )
+        .distinct()
+        .all()
+    )
+    return {b if a == user_id else a for a, b in rows}
+
+
+def generate_for_user(db: Session, user_id: int, top_n: int = SUGGESTIONS_TOP_N) -> int:
+    """
+    Fill ai_suggestions for user_id's top stored matches that have none
+    current. Threads with messages are left to the live path, which knows
+    the conversation. Commits per pair; returns how many were generated.
+    """
+    my_profile = db.query(models.Profile).filter(models.Profile.user_id == user_id).first()
+    if my_profile is None:
+        return 0
+    stored = matching.precomputed_matches(db, my_profile, limit=top_n)
+    top = [p for p, _, _ in stored or []]  # None: no scores stored yet
+    talking = _has_messages(db, user_id, [p.user_id for p in top])
+    generated = 0
+    for other in top:
+        if other.user_id in talking or lookup(db, my_profile, other, None) is not None:
+            continue
+        summary, openers = ai.summarize_and_suggest(my_profile, other, [])
+        store(db, my_profile, other, None, {"summary": summary, "openers": openers})
+        db.commit()
+        generated += 1
+    return generated
@@ -0,0 +1,149 @@
+# backend/worker.py
+"""
+Background match precomputation worker.
+
+    python -m backend.worker            # run forever
+    python -m backend.worker --once     # drain the queue once and exit
+    python -m backend.worker --precompute-campus CMU   # score a whole campus, then exit
+
+Leases jobs from match_jobs (see job_queue.py) and fills match_scores ahead
+of time, so /matches can serve stored scores. Every --rescore-interval
+seconds (continuously while a backlog lasts) it drains the profile_changes
+feed through rescorer.py, so pairs involving an edited profile are redone
+for everyone, not just its owner. Every --sweep-interval seconds
+it also enqueues a refresh for every profile, prioritized by user activity.
+Each finished refresh queues a low-priority generate_suggestions job that
+pre-writes chat-helper openers for the user's top matches (suggestions.py).
+fold_threads jobs, queued as messages are sent, fold long chat threads into
+their rolling summaries (conversation.py) off the request path.
+Several workers can run side by side against the same DB.
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+
+from .db import Base, engine, SessionLocal, add_missing_columns
+from . import models, conversation, job_queue, matching, rescorer, suggestions
+
+log = logging.getLogger("backend.worker")
+
+WORKER_TOP_K = int(os.getenv("WORKER_TOP_K", "100"))
+
+
+def sweep(db) -> int:
+    """Enqueue a refresh for every user with a profile. Returns how many."""
+    now = datetime.utcnow()
+    rows = (
+        db.query(models.User.id, models.User.last_seen_at)
+        .join(models.Profile, models.Profile.user_id == models.User.id)
+        .all()
+    )
+    for user_id, last_seen_at in rows:
+        job_queue.enqueue(
+            db,
+            job_queue.JOB_REFRESH_MATCHES,
+            user_id,
+            job_queue.activity_priority(last_seen_at, now),
+        )
+    db.commit()
+    return len(rows)
+
+
+def run_job(db, job: models.MatchJob) -> None:
+    if job.kind == job_queue.JOB_GENERATE_SUGGESTIONS:
+        generated = suggestions.generate_for_user(db, job.user_id)
+        log.info("generated suggestions for %d pairs of user %s", generated, job.user_id)
+        return
+    if job.kind == job_queue.JOB_FOLD_THREADS:
+        conversation.fold_threads(db, job.user_id)
+        return
+    if job.kind != job_queue.JOB_REFRESH_MATCHES:
+        raise ValueError(f"unknown job kind {job.kind!r}")
+    profile = db.query(models.Profile).filter(models.Profile.user_id == job.user_id).first()
+    if profile is None:
+        return  # no profile yet; upsert_profile will enqueue again
+    # No latency budget here: wait for the model even while /matches is
+    # degraded, and retry later (job_queue.fail backs off) if it still fails
+    ranked = matching.score_candidates(db, profile, top_k=WORKER_TOP_K, allow_degraded=False)
+    provisional = sum(1 for _, _, source in ranked if source == "local")
+    if provisional:
+        raise RuntimeError(f"{provisional} candidates left with provisional scores")
+    # New pairs in the top matches get openers ahead of time, off-peak
+    job_queue.enqueue(
+        db,
+        job_queue.JOB_GENERATE_SUGGESTIONS,
+        job.user_id,
+        job_queue.PRIORITY_IDLE,
+        run_after=suggestions.next_offpeak(),
+    )
+    db.commit()
+
+
+def work_once(db) -> bool:
+    """Lease and run one job. False if the queue had nothing ready."""
+    job = job_queue.lease(db)
+    if job is None:
+        return False
+    try:
+        run_job(db, job)
+    except Exception as e:
+        db.rollback()
+        log.exception("job %s (%s user=%s) failed", job.id, job.kind, job.user_id)
+        job_queue.fail(db, job, repr(e))
+    else:
+        job_queue.complete(db, job)
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Precompute match scores in the background.")
+    parser.add_argument("--once", action="store_true", help="exit when no job is ready")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--sweep-interval", type=float, default=3600.0)
+    parser.add_argument("--rescore-interval", type=float, default=10.0)
+    parser.add_argument(
+        "--precompute-campus",
+        metavar="CAMPUS",
+        help="score every shortlisted pair on CAMPUS once, then exit",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+
+    db = SessionLocal()
+    if args.precompute_campus:
+        try:
+            scored = matching.precompute_campus(db, args.precompute_campus, top_k=WORKER_TOP_K)
+            log.info("scored %d pairs on %s", scored, args.precompute_campus)
+        finally:
+            db.close()
+        return
+
+    last_sweep = last_rescore = 0.0
+    try:
+        while True:
+            if time.monotonic() - last_sweep >= args.sweep_interval:
+                log.info("sweep enqueued %d users", sweep(db))
+                last_sweep = time.monotonic()
+            changes = 0
+            if time.monotonic() - last_rescore >= args.rescore_interval:
+                changes, _ = rescorer.run_once(db, top_k=WORKER_TOP_K)
+                if changes < rescorer.FEED_BATCH:
+                    last_rescore = time.monotonic()  # caught up; a full batch means more waiting
+            if work_once(db) or changes:
+                continue
+            if args.once:
+                break
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
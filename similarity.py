@@ -1,11 +1,6 @@
-import google.generativeai as genai
 import json
-import os
-import time
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-
-model = genai.GenerativeModel("gemini-2.5-flash")
+from backend import llm  # reads GEMINI_API_KEY / GOOGLE_API_KEY, or LLM_PROVIDER=fake
 
 profile_a = {
     "name": "Alice",
@@ -38,15 +33,14 @@ json
 }}
 """
 
-response = model.generate_content(prompt)
-
-t = response.text
+t = llm.generate(prompt, task="profile_compare", json_output=True)
 
 print(t)
 
 try:
-    j = json.loads(t.rstrip())
-except Exception as e:
+    j = llm.parse_json(t)
+except llm.LLMParseError as e:
     print(e)
+    raise SystemExit(1)
 
 print(j["similarities"])
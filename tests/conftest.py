@@ -0,0 +1,83 @@
+# tests/conftest.py
+"""
+Shared fixtures. The backend reads its settings from the environment at
+import time and opens ./college_match_gemini.db relative to the working
+directory, so both are set up here, before anything imports it: every
+test session runs in a scratch directory with the fake model provider.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("LLM_STATE_DB", "")
+os.environ.setdefault("LLM_FAKE_LATENCY", "0")
+os.environ.setdefault("LLM_FAKE_FIRST_CHUNK", "0")
+os.chdir(tempfile.mkdtemp(prefix="tartandate-tests-"))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import ann, auth, chat_cache, llm, main, models
+from backend.db import Base, SessionLocal, engine
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    """Empty tables, and none of the previous test's model / index state."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    # Each singleton lives in its own module; the package re-exports it too
+    llm.quota._state = llm.quota._MemoryState()
+    llm.metrics = llm.telemetry.metrics = llm.Metrics()
+    llm.health = llm.telemetry.health = llm.ProviderHealth()
+    llm.gateway._aflights = llm.AsyncSingleFlight()
+    llm.set_provider(llm.FakeProvider())
+    chat_cache._memory = chat_cache.LRUCache()
+    ann._indexes.clear()
+    ann._campus_of.clear()
+    ann._synced_at.clear()
+    shutil.rmtree(ann.ANN_INDEX_DIR, ignore_errors=True)
+    yield
+
+
+@pytest.fixture
+def db():
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app, raise_server_exceptions=False)
+
+
+@pytest.fixture
+def make_user(db):
+    """make_user(name, **profile_fields) -> User with a profile, committed."""
+    def make(name: str, **fields) -> models.User:
+        user = models.User(
+            email=f"{name}@example.com",
+            hashed_password=auth.get_password_hash("pw"),
+            full_name=name.title(),
+        )
+        db.add(user)
+        db.flush()
+        profile = dict(
+            age=20, gender="other", major="CS", class_year=2027, campus="pittsburgh",
+            interests="hiking, chess", bio=f"I am {name}.",
+        )
+        profile.update(fields)
+        db.add(models.Profile(user_id=user.id, **profile))
+        db.commit()
+        return user
+
+    return make
+
+
+def auth_headers(user: models.User) -> dict:
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': str(user.id)})}"}
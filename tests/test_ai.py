@@ -0,0 +1,158 @@
+# tests/test_ai.py
+"""The model call sites, end to end through the fake provider (LLM_PROVIDER=fake)."""
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from conftest import ROOT
+
+from backend import ai, llm, matching, models
+
+OTHER = {"full_name": "Bo", "age": 21, "interests": ["chess"], "bio": "hi"}
+RECENT = [{"from": "them", "text": "hey"}, {"from": "me", "text": "hi!"}]
+
+
+def test_chat_helper_sync_and_async_agree():
+    result = ai.chat_helper({}, OTHER, RECENT)
+    assert result["summary"].startswith("They seem easygoing")
+    assert len(result["openers"]) == 3
+    assert asyncio.run(ai.achat_helper({}, OTHER, RECENT)) == result
+
+
+def test_streamed_chat_helper_sync_and_async_agree():
+    async def collect():
+        return [event async for event in ai.aiter_chat_helper({}, OTHER, RECENT)]
+
+    events = list(ai.iter_chat_helper({}, OTHER, RECENT))
+    assert [e[0] for e in events] == ["summary", "opener", "opener", "opener"]
+    assert events == asyncio.run(collect())
+
+
+def test_update_thread_summary():
+    summary = ai.update_thread_summary("", [{"from": "Al", "text": "hi"}], max_words=50)
+    assert summary.startswith("Fake summary")
+
+
+def test_score_matches_scores_every_candidate_once(make_user):
+    me = make_user("me")
+    others = [make_user(f"u{i}") for i in range(12)]  # more than one batch
+    profiles = [u.profile for u in others]
+
+    scores = ai.score_matches(me.profile, profiles)
+    assert sorted(scores) == sorted(u.id for u in others)
+    assert all(0 <= s <= 100 for s in scores.values())
+    assert llm.metrics.snapshot()["match_scores"]["calls"] == 2
+
+
+def test_closing_the_sync_iterator_early_releases_its_pairs(make_user):
+    me = make_user("me")
+    others = [make_user(f"u{i}").profile for i in range(12)]
+
+    batches = ai.iter_score_matches(me.profile, others)
+    next(batches)
+    batches.close()  # cancels the task on the gateway loop, which releases them
+    for _ in range(1000):
+        if not ai._pairs_in_flight:
+            break
+        time.sleep(0.001)
+    assert not ai._pairs_in_flight
+
+
+def test_score_candidates_stores_model_scores(make_user, db):
+    me = make_user("me")
+    others = [make_user(f"u{i}") for i in range(3)]
+
+    rows = matching.score_candidates(db, me.profile, allow_degraded=False)
+    assert sorted(p.user_id for p, _, _ in rows) == sorted(u.id for u in others)
+    assert {source for _, _, source in rows} == {"model"}
+    assert db.query(models.MatchScore).count() == 3
+
+    again = matching.score_candidates(db, me.profile, allow_degraded=False)
+    assert {source for _, _, source in again} == {"cache"}
+
+
+def test_scripts_outside_the_backend_load_the_gateway(tmp_path):
+    env = dict(os.environ, LLM_PROVIDER="fake", LLM_STATE_DB="", PYTHONPATH=ROOT)
+    for script in ("Anthropic/test.py", "similarity.py"):
+        out = subprocess.run(
+            [sys.executable, os.path.join(ROOT, script)],
+            check=True, env=env, cwd=tmp_path, capture_output=True, text=True,
+        ).stdout
+        assert "fake" in out
+
+
+def test_a_failed_score_write_falls_back_to_local_and_is_logged(make_user, db, monkeypatch, caplog):
+    me = make_user("me")
+    make_user("u1")
+
+    def locked(*args):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(matching, "_store_scores", locked)
+    rows = asyncio.run(matching.ascore_candidates(db, me.profile))
+    assert [source for _, _, source in rows] == ["local"]
+    assert "stopped early" in caplog.text
+
+
+def test_token_usage_reported_from_a_worker_thread_is_recorded():
+    class Counted(llm.Provider):
+        def generate(self, prompt, *, model, json_output, timeout, task):
+            llm.report_usage(7, 3)  # runs under asyncio.to_thread
+            return "ok"
+
+    llm.set_provider(Counted())
+    llm.generate("p", task="t")
+    stats = llm.metrics.snapshot()["t"]
+    assert (stats["prompt_tokens"], stats["response_tokens"]) == (7, 3)
+
+
+def test_batch_scoring_re_asks_only_for_what_the_model_left_out(monkeypatch):
+    monkeypatch.setattr(ai, "BATCH_MAX_SIZE", 3)
+    candidates = [dict(OTHER, user_id=i) for i in range(1, 6)]
+    asked = []
+
+    def leaves_out_2(prompt):
+        ids = [int(x) for x in re.findall(r"user_id=(\d+)", prompt)]
+        asked.append(sorted(ids))
+        answered = [i for i in ids if i != 2 or len(ids) == 1]  # answered when asked alone
+        return json.dumps([{"user_id": i, "score": 250 if i == 1 else i} for i in answered])
+
+    llm.get_provider().register("match_scores", leaves_out_2)
+    scores = ai.get_match_scores_batch({"full_name": "Al"}, candidates)
+    assert sorted(asked) == [[1, 2, 3], [2], [4, 5]]
+    assert scores == {1: 100.0, 2: 2.0, 3: 3.0, 4: 4.0, 5: 5.0}  # clamped to 0..100
+
+
+def test_parse_batch_scores_ignores_junk():
+    raw = '```json\n{"scores": [{"user_id": "3", "score": -4}, {"user_id": 9, "score": 50}, ' \
+          '{"user_id": 4}, "junk", {"user_id": 5, "score": "x"}]}\n```'
+    assert ai.parse_batch_scores(raw, {3, 4, 5}) == {3: 0.0}
+    assert ai.parse_batch_scores("not json", {1}) == {}
+
+
+def test_batches_run_concurrently_and_the_deadline_falls_back_to_local(make_user, db, monkeypatch):
+    monkeypatch.setattr(ai, "BATCH_MAX_SIZE", 3)
+    me = make_user("me")
+    others = [make_user(f"u{i}") for i in range(7)]  # three batches
+    llm.set_provider(llm.FakeProvider(latency=0.3, jitter=0))
+
+    t0 = time.monotonic()
+    rows = matching.score_candidates(db, me.profile, allow_degraded=False)
+    assert time.monotonic() - t0 < 0.6  # close to one call, not the sum of three
+    assert {source for _, _, source in rows} == {"model"}
+    assert llm.metrics.snapshot()["match_scores"]["calls"] == 3
+
+    db.query(models.MatchScore).delete()
+    db.commit()
+    t0 = time.monotonic()
+    rows = matching.score_candidates(db, me.profile, deadline_seconds=0.05, allow_degraded=False)
+    assert time.monotonic() - t0 < 0.25
+    assert sorted(p.user_id for p, _, _ in rows) == sorted(u.id for u in others)
+    assert {source for _, _, source in rows} == {"local"}
+    assert db.query(models.MatchScore).count() == 0  # provisional scores aren't cached
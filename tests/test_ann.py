@@ -0,0 +1,91 @@
+# tests/test_ann.py
+import os
+
+import numpy as np
+
+from backend import ann, embeddings, models
+
+
+def _index_ids(campus: str):
+    return set(ann._indexes[campus]._row_of)
+
+
+def test_index_roundtrips_ids_and_embedding_keys(tmp_path):
+    index = ann.IVFIndex(4)
+    vectors = np.eye(4, dtype=np.float32)
+    index.add([1, 2, 3, 4], vectors, ["a", "b", "c", "d"])
+    index.remove(3)
+    path = str(tmp_path / "x.npz")
+    index.save(path)
+
+    loaded = ann.IVFIndex.load(path)
+    assert set(loaded._row_of) == {1, 2, 4}
+    assert loaded.keys == {1: "a", 2: "b", 4: "d"}
+    assert [i for i, _ in loaded.search(vectors[1], 1)] == [2]
+
+
+def test_loaded_index_is_reconciled_with_profiles(db, make_user):
+    users = [make_user(f"u{i}") for i in range(6)]
+    me = db.query(models.Profile).filter_by(user_id=users[0].id).one()
+    ann.neighbor_ids(db, me, k=10)
+    ann.save_all()
+    assert os.path.exists(ann._path("pittsburgh"))
+
+    # Behind the saved index's back (another worker, or a crash before it was
+    # written again): one profile edited, one deleted, one added
+    edited = db.query(models.Profile).filter_by(user_id=users[1].id).one()
+    edited.bio = "Something else entirely."
+    embeddings.ensure_embeddings([edited])
+    db.query(models.Profile).filter_by(user_id=users[2].id).delete()
+    db.commit()
+    newcomer = make_user("newcomer")
+
+    ann._indexes.clear()
+    ann._campus_of.clear()
+    ann._synced_at.clear()
+    found = dict(ann.neighbor_ids(db, me, k=10))
+
+    assert newcomer.id in found
+    assert users[2].id not in found
+    index = ann._indexes["pittsburgh"]
+    assert index.keys[users[1].id] == edited.embedding_key
+    assert _index_ids("pittsburgh") == {u.id for u in users if u is not users[2]} | {newcomer.id}
+
+
+def test_in_memory_index_resyncs_after_interval(db, make_user, monkeypatch):
+    first = make_user("first")
+    me = db.query(models.Profile).filter_by(user_id=first.id).one()
+    ann.neighbor_ids(db, me, k=10)
+    late = make_user("late")
+
+    monkeypatch.setattr(ann, "ANN_SYNC_SECONDS", 3600.0)
+    ann.neighbor_ids(db, me, k=10)
+    assert late.id not in _index_ids("pittsburgh")
+
+    monkeypatch.setattr(ann, "ANN_SYNC_SECONDS", 0.0)
+    ann.neighbor_ids(db, me, k=10)
+    assert late.id in _index_ids("pittsburgh")
+    assert ann._campus_of[late.id] == "pittsburgh"
+
+
+def test_shortlist_widens_until_top_k_pass_the_sql_filters(db, make_user, monkeypatch):
+    me = make_user("me")
+    others = [make_user(f"u{i}", bio=f"Profile number {i} likes topic {i % 5}.") for i in range(30)]
+    wanted = {u.id for u in others[-4:]}
+    for u in others[-4:]:
+        u.profile.gender = "woman"
+    db.commit()
+
+    ann.neighbor_ids(db, me.profile, k=1)
+    index = ann._indexes["pittsburgh"]
+    index.n_lists, index.train_min = 6, 1
+    index.train()  # clustered, so one probe sees only part of the campus
+    monkeypatch.setattr(ann, "ANN_OVERSAMPLE", 1)
+
+    women = db.query(models.Profile).filter(models.Profile.gender == "woman")
+    found = ann.shortlist(db, me.profile, women, top_k=4, probes=1)
+    assert {p.user_id for p, _ in found} == wanted
+    assert [s for _, s in found] == sorted((s for _, s in found), reverse=True)
+
+    # More asked for than pass: everything that does, once the campus runs out
+    assert {p.user_id for p, _ in ann.shortlist(db, me.profile, women, top_k=10, probes=1)} == wanted
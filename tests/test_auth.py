@@ -0,0 +1,33 @@
+# tests/test_auth.py
+from datetime import datetime, timedelta
+
+from backend import auth, models
+
+
+def test_authenticate_user(db, make_user):
+    user = make_user("me")
+    assert auth.authenticate_user(db, "me@example.com", "pw").id == user.id
+    assert auth.authenticate_user(db, "me@example.com", "wrong") is None
+    assert auth.authenticate_user(db, "nobody@example.com", "pw") is None
+
+
+def test_only_a_successful_login_bumps_last_seen(client, db, make_user):
+    user = make_user("me")
+    long_ago = datetime.utcnow() - timedelta(days=60)
+    db.query(models.User).filter_by(id=user.id).update({"last_seen_at": long_ago})
+    db.commit()
+
+    def last_seen():
+        db.expire_all()
+        return db.query(models.User.last_seen_at).filter_by(id=user.id).scalar()
+
+    resp = client.post("/auth/login", data={"username": "me@example.com", "password": "wrong"})
+    assert resp.status_code == 401
+    assert last_seen() == long_ago
+
+    resp = client.post("/auth/login", data={"username": "me@example.com", "password": "pw"})
+    assert resp.status_code == 200
+    assert last_seen() > long_ago
+    token = resp.json()["access_token"]
+    me = client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert me.status_code == 200 and me.json()["email"] == "me@example.com"
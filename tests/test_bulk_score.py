@@ -0,0 +1,161 @@
+# tests/test_bulk_score.py
+import json
+import os
+
+import pytest
+
+from backend import llm, models
+from backend.jobs import bulk_score
+
+INTERESTS = ["hiking, chess", "chess, jazz", "jazz, film", "film, hiking", "running, chess"]
+
+
+@pytest.fixture
+def campus(make_user):
+    for i in range(9):
+        make_user(f"u{i}", interests=INTERESTS[i % len(INTERESTS)], age=19 + i % 4)
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    return str(tmp_path / "job")
+
+
+def _export(db, job_dir, **kwargs):
+    return bulk_score.export(db, "pittsburgh", job_dir, top_k=3, shard_size=2, workers=1, **kwargs)
+
+
+def _result_keys(job_dir, manifest):
+    keys = []
+    for shard in manifest["shards"]:
+        with open(bulk_score._results_path(job_dir, shard)) as f:
+            keys += [json.loads(line)["key"] for line in f]
+    return sorted(keys)
+
+
+def _request_keys(job_dir, manifest):
+    return sorted(r["key"] for shard in manifest["shards"] for r in bulk_score._read_requests(job_dir, shard))
+
+
+def _calls():
+    return llm.metrics.snapshot().get(bulk_score.TASK, {}).get("calls", 0)
+
+
+def test_export_score_load(db, campus, job_dir):
+    manifest = _export(db, job_dir)
+    assert manifest["pairs"] > 0 and len(manifest["shards"]) > 1
+    assert _request_keys(job_dir, manifest) and manifest["requests"] == len(_request_keys(job_dir, manifest))
+
+    report = bulk_score.score(job_dir)
+    assert report["answered"] == manifest["requests"] and not report["failed"]
+    assert _result_keys(job_dir, manifest) == _request_keys(job_dir, manifest)
+
+    assert bulk_score.load(db, job_dir)["rows"] == report["pairs"]
+    assert db.query(models.MatchScore).count() == manifest["pairs"]
+    assert all(low < high for low, high in db.query(models.MatchScore.user_id, models.MatchScore.other_user_id))
+
+    # Everything loaded: a new export needs no --force and finds nothing stale
+    again = _export(db, job_dir)
+    assert again["pairs"] == 0 and again["skipped_current"] == manifest["pairs"]
+
+
+def test_export_refuses_to_discard_unloaded_results(db, campus, job_dir):
+    _export(db, job_dir)
+    bulk_score.score(job_dir)
+    with pytest.raises(FileExistsError, match="unloaded results"):
+        _export(db, job_dir)
+
+    bulk_score.load(db, job_dir)
+    manifest = bulk_score.read_manifest(job_dir)
+    first = bulk_score._results_path(job_dir, manifest["shards"][0])
+    with open(first, "a") as f:  # scored again after the load
+        f.write(json.dumps({"key": "late", "user_id": 1, "scored_at": "2026-01-01T00:00:00", "scores": []}) + "\n")
+    with pytest.raises(FileExistsError):
+        _export(db, job_dir)
+    assert _export(db, job_dir, force=True)["pairs"] == 0
+
+
+def test_score_resumes_mid_shard_after_a_torn_write(db, campus, job_dir):
+    manifest = _export(db, job_dir)
+    bulk_score.score(job_dir)
+    results = bulk_score._results_path(job_dir, manifest["shards"][0])
+    with open(results) as f:
+        lines = f.readlines()
+    assert len(lines) == 2
+    # Crash mid-shard: first line written, second one torn, later shards untouched
+    with open(results, "w") as f:
+        f.write(lines[0] + lines[1][: len(lines[1]) // 2])
+    for shard in manifest["shards"][1:]:
+        os.remove(bulk_score._results_path(job_dir, shard))
+
+    calls = _calls()
+    report = bulk_score.score(job_dir)
+    assert report["answered"] == manifest["requests"] - 1
+    assert _calls() - calls == manifest["requests"] - 1
+    assert _result_keys(job_dir, manifest) == _request_keys(job_dir, manifest)
+    assert bulk_score.score(job_dir)["answered"] == 0
+
+    bulk_score.load(db, job_dir)
+    assert db.query(models.MatchScore).count() == manifest["pairs"]
+
+
+def test_batch_mode_polls_the_same_jobs_after_a_restart(db, campus, job_dir, monkeypatch):
+    manifest = _export(db, job_dir)
+
+    class Crash(BaseException):
+        pass
+
+    def crash(job_id, task="generate"):
+        raise Crash()
+
+    monkeypatch.setattr(llm, "batch_results", crash)
+    with pytest.raises(Crash):
+        bulk_score.score(job_dir, mode="batch", poll_seconds=0)
+    batch_files = [n for n in os.listdir(job_dir) if n.endswith(".batch")]
+    assert len(batch_files) == len(manifest["shards"])
+    monkeypatch.undo()
+
+    # A new process: nothing in memory, only the job directory and LLM_BATCH_DIR
+    llm.set_provider(llm.FakeProvider())
+    submitted = llm.metrics.snapshot()[bulk_score.TASK]["batch_requests"]
+    report = bulk_score.score(job_dir, mode="batch", poll_seconds=0)
+
+    assert report["answered"] + report["failed"] == manifest["requests"]
+    assert llm.metrics.snapshot()[bulk_score.TASK]["batch_requests"] == submitted == manifest["requests"]
+    assert not [n for n in os.listdir(job_dir) if n.endswith(".batch")]
+    assert not os.listdir(llm.LLM_BATCH_DIR)
+
+
+def test_unknown_batch_job_is_resubmitted_by_the_next_run(db, campus, job_dir):
+    manifest = _export(db, job_dir)
+    batch_file = bulk_score._batch_path(job_dir, manifest["shards"][0])
+    keys = [r["key"] for r in bulk_score._read_requests(job_dir, manifest["shards"][0])]
+    with open(batch_file, "w") as f:
+        json.dump({"job": "stand-in-0000", "keys": keys}, f)
+
+    first = bulk_score.score(job_dir, mode="batch", poll_seconds=0)
+    assert first["failed"] >= len(keys)
+    second = bulk_score.score(job_dir, mode="batch", poll_seconds=0)
+    assert first["answered"] + second["answered"] == manifest["requests"]
+
+
+def test_requests_refused_by_the_limiter_are_failed_in_the_manifest(db, campus, job_dir, monkeypatch):
+    manifest = _export(db, job_dir)
+    attempts = []
+
+    def refused(prompt, **kwargs):
+        attempts.append(prompt)
+        raise llm.RateLimitedError("over quota", retry_after=0.0)
+
+    monkeypatch.setattr(bulk_score, "BULK_SCORE_RATE_LIMIT_RETRIES", 2)
+    monkeypatch.setattr(llm, "generate", refused)
+    report = bulk_score.score(job_dir)
+    assert report["failed"] == manifest["requests"] and not report["stopped"]
+    assert len(attempts) == 3 * manifest["requests"]
+    failed = bulk_score.read_manifest(job_dir)["failed"]
+    assert sorted(failed) == _request_keys(job_dir, manifest)
+    assert all("RateLimitedError" in error for error in failed.values())
+
+    monkeypatch.undo()
+    assert bulk_score.score(job_dir)["answered"] == manifest["requests"]
+    assert bulk_score.read_manifest(job_dir)["failed"] == {}
@@ -0,0 +1,79 @@
+# tests/test_chat_cache.py
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from conftest import auth_headers
+
+from backend import chat_cache, llm, models
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = chat_cache.LRUCache(maxsize=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # a is now the most recent
+    cache.put("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_lru_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(chat_cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    cache = chat_cache.LRUCache(maxsize=10, ttl=60)
+    cache.put("default", 1)
+    cache.put("short", 2, ttl=5)
+
+    now[0] += 5
+    assert cache.get("short") is None and cache.get("default") == 1
+    now[0] += 55
+    assert cache.get("default") is None
+    assert not cache._data  # expired entries are dropped, not just hidden
+
+
+def _calls():
+    return llm.metrics.snapshot().get("chat_helper", {}).get("calls", 0)
+
+
+def test_a_new_message_or_a_profile_edit_changes_the_key(db, client, make_user):
+    me, other = make_user("me"), make_user("other")
+    headers = auth_headers(me)
+
+    def helper():
+        resp = client.get(f"/ai/chat-helper/{other.id}", headers=headers)
+        assert resp.status_code == 200
+        return resp.json()
+
+    first = helper()
+    assert _calls() == 1
+    assert helper() == first and _calls() == 1  # cached
+
+    db.add(models.Message(from_user_id=other.id, to_user_id=me.id, text="hey"))
+    db.commit()
+    helper()
+    assert _calls() == 2
+    helper()
+    assert _calls() == 2
+
+    other.profile.bio = "Rewrote my bio."
+    db.commit()
+    helper()
+    assert _calls() == 3
+
+
+def test_the_persistent_tier_survives_the_memory_cache(db, make_user, monkeypatch):
+    monkeypatch.setattr(chat_cache, "CHAT_CACHE_PERSIST", True)
+    me, other = make_user("me"), make_user("other")
+    key = chat_cache.chat_helper_key(me.profile, other.profile, None)
+    chat_cache.put(db, key, {"summary": "s", "openers": ["o"]})
+    db.commit()
+
+    chat_cache._memory.clear()  # a restart, or another worker process
+    assert chat_cache.get(db, key) == {"summary": "s", "openers": ["o"]}
+    assert chat_cache._memory.get(key) is not None  # and back in memory
+
+    chat_cache._memory.clear()
+    row = db.query(models.AICacheEntry).one()
+    row.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+    assert chat_cache.get(db, key) is None
+    assert db.query(models.AICacheEntry).count() == 0
@@ -0,0 +1,144 @@
+# tests/test_chat_helper.py
+import json
+
+import pytest
+
+from conftest import auth_headers
+
+from backend import llm
+
+
+# --- JSONStreamParser ------------------------------------------------------------
+
+REPLY = (
+    '```json\n{"summary": "Likes \\"jazz\\", \\\\ and {braces}",\n'
+    ' "openers": ["Hi, there]", "Tab\\tand \\u00e9", {"t": ["nested", 1]}, [1, 2]],\n'
+    ' "score": -12.5e1, "ok": true, "none": null}\n```'
+)
+EXPECTED = [
+    ("field", "summary", 'Likes "jazz", \\ and {braces}'),
+    ("item", "openers", 0, "Hi, there]"),
+    ("item", "openers", 1, "Tab\tand é"),
+    ("item", "openers", 2, {"t": ["nested", 1]}),
+    ("item", "openers", 3, [1, 2]),
+    ("field", "openers", ["Hi, there]", "Tab\tand é", {"t": ["nested", 1]}, [1, 2]]),
+    ("field", "score", -125.0),
+    ("field", "ok", True),
+    ("field", "none", None),
+]
+
+
+def _feed(chunks):
+    parser = llm.JSONStreamParser()
+    events = [event for chunk in chunks for event in parser.feed(chunk)]
+    return parser, events
+
+
+def test_parser_whole_reply():
+    parser, events = _feed([REPLY])
+    assert events == EXPECTED
+    assert parser.done
+
+
+def test_parser_any_two_chunk_split():
+    for cut in range(len(REPLY) + 1):
+        _, events = _feed([REPLY[:cut], REPLY[cut:]])
+        assert events == EXPECTED, cut
+
+
+def test_parser_one_character_at_a_time():
+    parser, events = _feed(list(REPLY))
+    assert events == EXPECTED
+    assert parser.done
+
+
+def test_parser_emits_items_as_soon_as_they_close():
+    parser = llm.JSONStreamParser()
+    assert parser.feed('{"openers": ["one", "tw') == [("item", "openers", 0, "one")]
+    assert parser.feed('o"') == [("item", "openers", 1, "two")]
+    assert parser.feed("]") == [("field", "openers", ["one", "two"])]
+
+
+def test_parser_truncated_reply_keeps_what_completed():
+    parser, events = _feed(['{"summary": "done", "openers": ["first", "sec'])
+    assert events == [("field", "summary", "done"), ("item", "openers", 0, "first")]
+    assert not parser.done
+
+
+def test_parser_drops_malformed_values_and_carries_on():
+    _, events = _feed(['{"a": tru, "b": [1, nope, 3], "c": 2}'])
+    assert events == [("item", "b", 0, 1), ("item", "b", 2, 3), ("field", "c", 2)]
+
+
+def test_parser_ignores_text_after_the_object():
+    parser = llm.JSONStreamParser()
+    assert parser.feed('{"a": 1} {"b": 2}') == [("field", "a", 1)]
+    assert parser.feed('{"c": 3}') == []
+
+
+def test_parser_without_an_object_yields_nothing():
+    parser, events = _feed(["Sorry, ", "I can't help with that."])
+    assert events == [] and not parser.done
+
+
+# --- /ai/chat-helper/{id}/stream -------------------------------------------------
+
+
+def _sse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _stream(client, me, other):
+    resp = client.get(f"/ai/chat-helper/{other.id}/stream", headers=auth_headers(me))
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    return _sse_events(resp.text)
+
+
+def test_stream_sends_summary_openers_then_done(client, make_user):
+    me, other = make_user("me"), make_user("other")
+    events = _stream(client, me, other)
+
+    assert [name for name, _ in events] == ["summary", "opener", "opener", "opener", "done"]
+    summary, openers, done = events[0][1], [data for _, data in events[1:4]], events[-1][1]
+    assert [o["index"] for o in openers] == [0, 1, 2]
+    assert done == {"summary": summary["summary"], "openers": [o["text"] for o in openers]}
+
+    # Second request: same sequence, replayed from the cache without a model call
+    calls = llm.metrics.snapshot()["chat_helper"]["calls"]
+    assert _stream(client, me, other) == events
+    assert llm.metrics.snapshot()["chat_helper"]["calls"] == calls
+
+
+def test_stream_reports_an_open_breaker_as_an_error_event(client, make_user):
+    me, other = make_user("me"), make_user("other")
+    for _ in range(llm.breaker.failures):
+        llm.breaker.record(ok=False)
+
+    events = _stream(client, me, other)
+    assert [name for name, _ in events] == ["error"]
+    assert "temporarily unavailable" in events[0][1]["detail"]
+    assert events[0][1]["retry_after"] > 0
+
+
+def test_stream_reports_a_model_failure_as_an_error_event(client, make_user):
+    me, other = make_user("me"), make_user("other")
+
+    class Broken(llm.Provider):
+        def generate(self, prompt, *, model, json_output, timeout, task):
+            raise llm.ProviderError("bad request", code=400)
+
+    llm.set_provider(Broken())
+    events = _stream(client, me, other)
+    assert [name for name, _ in events] == ["error"]
+    assert events[0][1]["retry_after"] is None
+
+
+def test_stream_unknown_user_is_404(client, make_user):
+    me = make_user("me")
+    resp = client.get("/ai/chat-helper/999/stream", headers=auth_headers(me))
+    assert resp.status_code == 404
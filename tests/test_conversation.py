@@ -0,0 +1,111 @@
+# tests/test_conversation.py
+import asyncio
+
+from conftest import auth_headers
+
+from backend import conversation, job_queue, llm, models, worker
+from backend.db import SessionLocal
+
+
+def _summary_row(db):
+    db.expire_all()
+    return db.query(models.ThreadSummary).one()
+
+
+def test_save_summary_upserts_and_only_moves_forward(db):
+    with SessionLocal() as first, SessionLocal() as second:
+        # Both requests saw no row yet
+        conversation._save_summary(first, 2, 1, "folded to 5", 5)
+        first.commit()
+        conversation._save_summary(second, 1, 2, "folded to 3", 3)
+        second.commit()
+
+    row = _summary_row(db)
+    assert (row.user_id, row.other_user_id) == (1, 2)
+    assert (row.summary, row.through_message_id) == ("folded to 5", 5)
+
+    conversation._save_summary(db, 1, 2, "folded to 9", 9)
+    db.commit()
+    assert _summary_row(db).through_message_id == 9
+
+
+def test_concurrent_first_builds_share_one_summary(db, make_user, monkeypatch):
+    monkeypatch.setattr(conversation, "CHAT_RECENT_MESSAGES", 2)
+    me, other = make_user("me"), make_user("other")
+    for i in range(6):
+        sender, receiver = (me, other) if i % 2 else (other, me)
+        db.add(models.Message(from_user_id=sender.id, to_user_id=receiver.id, text=f"message {i}"))
+    db.commit()
+    names = {me.id: "Me", other.id: "Other"}
+
+    async def build(user_id, other_user_id):
+        with SessionLocal() as session:
+            summary, recent = await conversation.abuild_context(session, user_id, other_user_id, names)
+            return summary, await asyncio.to_thread(lambda: [m.text for m in recent])
+
+    async def main():
+        return await asyncio.gather(build(me.id, other.id), build(other.id, me.id))
+
+    (summary_a, recent_a), (summary_b, recent_b) = asyncio.run(main())
+    assert summary_a and summary_b
+    assert recent_a == recent_b == ["message 4", "message 5"]
+
+    row = _summary_row(db)
+    assert row.through_message_id == max(m.id for m in db.query(models.Message)) - 2
+    assert row.summary in (summary_a, summary_b)
+
+
+def _thread(db, me, other, n):
+    for i in range(n):
+        sender, receiver = (me, other) if i % 2 else (other, me)
+        db.add(models.Message(from_user_id=sender.id, to_user_id=receiver.id, text=f"message {i}"))
+    db.commit()
+
+
+def _summary_calls():
+    return llm.metrics.snapshot().get("thread_summary", {}).get("calls", 0)
+
+
+def test_a_request_folds_at_most_the_per_request_cap(db, make_user, monkeypatch):
+    monkeypatch.setattr(conversation, "CHAT_RECENT_MESSAGES", 2)
+    monkeypatch.setattr(conversation, "CHAT_FOLD_BATCH", 2)
+    me, other = make_user("me"), make_user("other")
+    _thread(db, me, other, 10)  # 8 messages behind the window: 4 batches
+    names = {me.id: "Me", other.id: "Other"}
+
+    summary, recent = conversation.build_context(db, me.id, other.id, names)
+    assert summary and [m.text for m in recent] == ["message 8", "message 9"]
+    assert _summary_calls() == conversation.CHAT_MAX_FOLDS_PER_REQUEST == 1
+    ids = [m.id for m in db.query(models.Message).order_by(models.Message.id)]
+    assert _summary_row(db).through_message_id == ids[1]
+
+    with SessionLocal() as session:
+        asyncio.run(conversation.abuild_context(session, me.id, other.id, names))
+    assert _summary_calls() == 2
+    assert _summary_row(db).through_message_id == ids[3]
+
+
+def test_sending_queues_a_background_fold_once_a_batch_waits(db, client, make_user, monkeypatch):
+    monkeypatch.setattr(conversation, "CHAT_RECENT_MESSAGES", 2)
+    monkeypatch.setattr(conversation, "CHAT_FOLD_BATCH", 3)
+    me, other = make_user("me"), make_user("other")
+    _thread(db, me, other, 3)
+
+    def send():
+        r = client.post(
+            "/messages", json={"to_user_id": other.id, "text": "hi"}, headers=auth_headers(me)
+        )
+        assert r.status_code == 200
+
+    send()  # 2 behind the window: not a full batch yet
+    assert db.query(models.MatchJob).filter_by(kind=job_queue.JOB_FOLD_THREADS).count() == 0
+    send()
+    job = db.query(models.MatchJob).filter_by(kind=job_queue.JOB_FOLD_THREADS).one()
+    assert job.user_id == min(me.id, other.id)
+
+    assert worker.work_once(db)
+    ids = [m.id for m in db.query(models.Message).order_by(models.Message.id)]
+    assert _summary_row(db).through_message_id == ids[-3]  # everything before the window
+    calls = _summary_calls()
+    conversation.build_context(db, other.id, me.id, {me.id: "Me", other.id: "Other"})
+    assert _summary_calls() == calls  # nothing left for the request to fold
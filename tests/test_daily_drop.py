@@ -0,0 +1,136 @@
+# tests/test_daily_drop.py
+import os
+import pickle
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import pytest
+
+from conftest import ROOT, auth_headers
+
+from backend import models, prerank
+from backend.jobs import daily_drop
+
+INTERESTS = ["hiking, chess", "chess, jazz", "jazz, film", "film, hiking", "running, chess"]
+TODAY = datetime.utcnow().date()
+
+
+@pytest.fixture
+def campus(make_user):
+    return [
+        make_user(
+            f"u{i}",
+            interests=INTERESTS[i % len(INTERESTS)],
+            class_year=2025 + i % 3,
+            gender="woman" if i % 2 else "man",
+            bio=f"I like {INTERESTS[(i + 1) % len(INTERESTS)]}.",
+        )
+        for i in range(8)
+    ]
+
+
+def _profiles(db):
+    return db.query(models.Profile).order_by(models.Profile.user_id).all()
+
+
+def _drops(db):
+    db.expire_all()
+    drops = defaultdict(list)
+    rows = (
+        db.query(models.DailyDrop)
+        .filter(models.DailyDrop.drop_date == TODAY)
+        .order_by(models.DailyDrop.user_id, models.DailyDrop.rank)
+    )
+    for row in rows:
+        drops[row.user_id].append((row.other_user_id, row.score, row.created_at))
+    return drops
+
+
+def test_encode_campus_flattens_the_rankers_inputs(db, campus):
+    profiles = _profiles(db)
+    arrays = daily_drop.encode_campus(profiles)
+    assert arrays["user_ids"].tolist() == [p.user_id for p in profiles]
+    ptr, idx = arrays["interests_ptr"], arrays["interests_idx"]
+    for i, p in enumerate(profiles):
+        assert ptr[i + 1] - ptr[i] == len(prerank.interest_set(p))
+    # "chess" is one vocabulary entry, wherever it appears
+    chess = [i for i, p in enumerate(profiles) if "chess" in prerank.interest_set(p)]
+    common = set.intersection(*(set(idx[ptr[i]:ptr[i + 1]].tolist()) for i in chess))
+    assert len(common) == 1
+    assert set(arrays["gender_names"][arrays["genders"]]) == {"man", "woman"}
+
+
+def test_two_processes_write_every_users_top_n_and_a_rerun_resumes(db, client, campus):
+    me = campus[0]
+    db.add(models.Preference(user_id=me.id, genders="woman"))
+    db.commit()
+
+    report = daily_drop.run(db, "pittsburgh", TODAY, top_n=3, workers=2, chunk_size=3)
+    assert report["profiles"] == 8 and report["rows_written"] == 8 * 3
+    drops = _drops(db)
+    women = {u.id for u in campus if u.profile.gender == "woman"}
+    assert {other for other, _, _ in drops[me.id]} <= women
+
+    # Everyone else gets the local ranker's top 3, best first
+    profiles = _profiles(db)
+    for p in profiles[1:]:
+        others = [o for o in profiles if o.user_id != p.user_id]
+        expected = [score for _, score in prerank.shortlist(p, others, 3)]
+        assert [score for _, score, _ in drops[p.user_id]] == pytest.approx(expected)
+
+    served = client.get("/matches/daily", headers=auth_headers(me)).json()
+    assert [(r["profile"]["user_id"], r["rank"]) for r in served] == [
+        (other, rank) for rank, (other, _, _) in enumerate(drops[me.id])
+    ]
+
+    # Crash after the first chunk: only its rows and checkpoint were committed
+    first_chunk = [p.user_id for p in profiles[:3]]
+    checkpoint = db.query(models.FeedCursor).filter_by(
+        name=daily_drop.checkpoint_name("pittsburgh", TODAY)
+    ).one()
+    checkpoint.position = first_chunk[-1]
+    db.query(models.DailyDrop).filter(models.DailyDrop.user_id.notin_(first_chunk)).delete(
+        synchronize_session=False
+    )
+    db.commit()
+
+    resumed = daily_drop.run(db, "pittsburgh", TODAY, top_n=3, workers=2, chunk_size=3)
+    assert resumed["profiles"] == 5
+    again = _drops(db)
+    assert {u: [row[:2] for row in rows] for u, rows in again.items()} == {
+        u: [row[:2] for row in rows] for u, rows in drops.items()
+    }
+    for user_id in first_chunk:  # not written again
+        assert again[user_id] == drops[user_id]
+    assert daily_drop.run(db, "pittsburgh", TODAY, top_n=3, workers=2)["profiles"] == 0
+
+
+_ATTACH = """
+import pickle, sys
+from backend.jobs import daily_drop
+daily_drop.attach(pickle.load(sys.stdin.buffer))
+print(daily_drop._arrays["user_ids"].tolist())
+"""
+
+
+def test_a_process_outside_the_pool_leaves_the_blocks_to_their_creator(db, campus, tmp_path):
+    arrays = daily_drop.encode_campus(_profiles(db))
+    blocks, spec = daily_drop.share(arrays)
+    try:
+        done = subprocess.run(
+            [sys.executable, "-c", _ATTACH],
+            input=pickle.dumps(spec), capture_output=True, check=True, cwd=tmp_path,
+            env=dict(os.environ, PYTHONPATH=ROOT),
+        )
+        assert done.stdout.decode().strip() == str(arrays["user_ids"].tolist())
+        assert b"leaked" not in done.stderr
+        # Still there once that process (and its resource tracker) is gone
+        for block in blocks:
+            shared_memory.SharedMemory(name=block.name).close()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,42 @@
+# tests/test_embeddings.py
+import numpy as np
+
+from backend import embeddings
+
+
+def test_pack_unpack_round_trips_float32():
+    vector = np.array([0.5, -1.25, 3e-8, 0.0], dtype=np.float64)
+    blob = embeddings.pack(vector)
+    assert len(blob) == 4 * len(vector)
+    out = embeddings.unpack(blob)
+    assert out.dtype == np.dtype("<f4")
+    assert np.array_equal(out, vector.astype(np.float32))
+
+
+def test_hashing_embedder_is_deterministic_and_unit_length():
+    embedder = embeddings.HashingEmbedder(dim=32)
+    texts = ["Major: CS\nInterests: chess, hiking", "Major: Art\nInterests: film", ""]
+    vectors = embedder.embed(texts)
+    assert vectors.shape == (3, 32) and vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1.0)
+    assert not vectors[2].any()  # nothing to hash: the zero vector, not NaN
+    assert np.array_equal(embeddings.HashingEmbedder(dim=32).embed(texts), vectors)
+
+
+def test_embeddings_are_recomputed_only_when_stale(db, make_user):
+    profiles = [make_user(f"u{i}").profile for i in range(3)]
+    embedder = embeddings.HashingEmbedder(dim=16)
+    assert embeddings.ensure_embeddings(profiles, embedder) == 3
+    db.commit()
+    assert embeddings.ensure_embeddings(profiles, embedder) == 0
+
+    stored = profiles[0].embedding
+    assert np.allclose(np.linalg.norm(embeddings.unpack(stored)), 1.0)
+
+    profiles[1].bio = "Something new."
+    assert embeddings.ensure_embeddings(profiles, embedder) == 1
+    assert profiles[0].embedding == stored
+
+    # A different embedder invalidates every key
+    assert embeddings.ensure_embeddings(profiles, embeddings.HashingEmbedder(dim=8)) == 3
+    assert len(embeddings.unpack(profiles[0].embedding)) == 8
@@ -0,0 +1,74 @@
+# tests/test_interests.py
+from backend import interests, models, prerank
+
+
+def _names(db, user_id):
+    return sorted(
+        name for (name,) in db.query(models.Interest.name)
+        .join(models.ProfileInterest, models.ProfileInterest.interest_id == models.Interest.id)
+        .filter(models.ProfileInterest.user_id == user_id)
+    )
+
+
+def test_sync_replaces_the_rows_with_normalized_names(db, make_user):
+    me = make_user("me")
+    interests.sync_profile_interests(db, me.id, [" Rock  Climbing", "chess", "CHESS", ""])
+    db.commit()
+    assert _names(db, me.id) == ["chess", "rock climbing"]
+
+    interests.sync_profile_interests(db, me.id, ["chess", "Jazz"])
+    db.commit()
+    assert _names(db, me.id) == ["chess", "jazz"]
+    assert db.query(models.Interest).count() == 3  # the vocabulary only grows
+
+    # The local ranker spells interests the same way
+    me.profile.interests = " Rock  Climbing,CHESS"
+    assert prerank.interest_set(me.profile) == {"rock climbing", "chess"}
+
+
+def test_interest_ids_reuses_a_name_another_request_just_added(db, monkeypatch):
+    chess = models.Interest(name="chess")
+    db.add(chess)
+    db.commit()
+
+    # Our lookup ran before the other request's insert was committed
+    lookup = interests._lookup
+    calls = []
+
+    def stale_first(session, names):
+        calls.append(sorted(names))
+        return {} if len(calls) == 1 else lookup(session, names)
+
+    monkeypatch.setattr(interests, "_lookup", stale_first)
+    assert interests.interest_ids(db, ["Chess"]) == [chess.id]
+    db.commit()
+    assert db.query(models.Interest).count() == 1
+    assert calls == [["chess"], ["chess"]]
+
+
+def test_backfill_indexes_existing_profiles(db, make_user):
+    a = make_user("a", interests="hiking, Chess")
+    b = make_user("b", interests="")
+    assert db.query(models.ProfileInterest).count() == 0
+
+    assert interests.backfill(db) == 2
+    assert _names(db, a.id) == ["chess", "hiking"]
+    assert _names(db, b.id) == []
+    interests.backfill(db)  # again: nothing changes
+    assert db.query(models.ProfileInterest).count() == 2
+
+
+def test_shared_interest_query_counts_overlap_within_the_campus(db, make_user):
+    me = make_user("me", interests="hiking, chess, jazz")
+    both = make_user("both", interests="chess, hiking, film")
+    one = make_user("one", interests="jazz")
+    make_user("none", interests="film")
+    make_user("away", interests="hiking, chess", campus="oakland")
+    interests.backfill(db)
+
+    def ids(min_shared):
+        return {p.user_id for p in interests.shared_interest_query(db, me.profile, min_shared)}
+
+    assert ids(1) == {both.id, one.id}
+    assert ids(2) == {both.id}
+    assert ids(3) == set()
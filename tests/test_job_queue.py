@@ -0,0 +1,194 @@
+# tests/test_job_queue.py
+from datetime import datetime, timedelta
+
+from conftest import auth_headers
+
+from backend import job_queue, models, worker
+
+KIND = job_queue.JOB_REFRESH_MATCHES
+
+
+def _job(db, user_id, kind=KIND):
+    db.expire_all()
+    return db.query(models.MatchJob).filter_by(kind=kind, user_id=user_id).one()
+
+
+def _expire_lease(db, job):
+    db.query(models.MatchJob).filter_by(id=job.id).update(
+        {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+
+
+def test_activity_priority():
+    now = datetime(2026, 6, 1, 12)
+    assert job_queue.activity_priority(None, now) == job_queue.PRIORITY_IDLE
+    assert job_queue.activity_priority(now - timedelta(hours=3), now) == job_queue.PRIORITY_ACTIVE_TODAY
+    assert job_queue.activity_priority(now - timedelta(days=3), now) == job_queue.PRIORITY_ACTIVE_WEEK
+    assert job_queue.activity_priority(now - timedelta(days=30), now) == job_queue.PRIORITY_IDLE
+
+
+def test_enqueue_keeps_one_live_job_with_the_highest_priority(db):
+    job_queue.enqueue(db, KIND, 1, priority=10)
+    job_queue.enqueue(db, KIND, 1, priority=50)
+    job_queue.enqueue(db, KIND, 1, priority=20)
+    db.commit()
+    assert db.query(models.MatchJob).count() == 1
+    assert _job(db, 1).priority == 50
+
+
+def test_lease_claims_the_best_ready_job_once(db):
+    job_queue.enqueue(db, KIND, 1, priority=10)
+    job_queue.enqueue(db, KIND, 2, priority=90)
+    job_queue.enqueue(db, KIND, 3, priority=99, run_after=datetime.utcnow() + timedelta(hours=1))
+    db.commit()
+
+    first = job_queue.lease(db)
+    second = job_queue.lease(db)
+    assert (first.user_id, second.user_id) == (2, 1)
+    assert first.status == "leased" and first.attempts == 1 and first.lease_token
+    assert first.lease_token != second.lease_token
+    assert job_queue.lease(db) is None  # user 3 isn't due yet
+
+
+def test_expired_lease_is_reclaimed_and_the_old_holder_is_ignored(db):
+    job_queue.enqueue(db, KIND, 1)
+    db.commit()
+    stale = job_queue.lease(db)
+    stale_token = stale.lease_token
+    assert job_queue.lease(db) is None  # still held
+
+    _expire_lease(db, stale)
+    fresh = job_queue.lease(db)
+    assert fresh.id == stale.id and fresh.attempts == 2
+    assert fresh.lease_token != stale_token
+
+    # The first worker finishing late must not touch the new lease
+    stale.lease_token = stale_token
+    job_queue.complete(db, stale)
+    job = _job(db, 1)
+    assert job.status == "leased" and job.lease_token == fresh.lease_token
+
+    job_queue.complete(db, fresh)
+    job = _job(db, 1)
+    assert job.status == "done" and job.dedupe_key is None
+
+
+def test_a_lease_that_keeps_expiring_ends_dead(db):
+    job_queue.enqueue(db, KIND, 1)
+    db.commit()
+    for attempt in range(1, 6):  # the worker dies holding it, every time
+        job = job_queue.lease(db)
+        assert job.attempts == attempt
+        _expire_lease(db, job)
+
+    assert job_queue.lease(db) is None
+    job = _job(db, 1)
+    assert job.status == "dead" and job.dedupe_key is None and job.lease_token is None
+    assert job.last_error == "lease expired on the last attempt"
+
+    job_queue.enqueue(db, KIND, 1)  # a later change still gets a fresh job
+    db.commit()
+    assert job_queue.lease(db).attempts == 1
+
+
+def test_enqueue_while_leased_runs_the_job_once_more(db):
+    job_queue.enqueue(db, KIND, 1, priority=10)
+    db.commit()
+    job = job_queue.lease(db)
+    job_queue.enqueue(db, KIND, 1, priority=40)
+    db.commit()
+    assert db.query(models.MatchJob).count() == 1
+
+    job_queue.complete(db, job)
+    job = _job(db, 1)
+    assert job.status == "queued" and not job.rerun and job.attempts == 0 and job.priority == 40
+
+    job_queue.complete(db, job_queue.lease(db))
+    assert _job(db, 1).status == "done"
+
+    # Finished jobs free the key: a later enqueue starts a new one
+    job_queue.enqueue(db, KIND, 1)
+    db.commit()
+    assert db.query(models.MatchJob).count() == 2
+
+
+def test_fail_backs_off_then_gives_up(db, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_BASE_SECONDS", 0)
+    job_queue.enqueue(db, KIND, 1)
+    db.commit()
+    for attempt in range(1, 6):
+        job = job_queue.lease(db)
+        assert job.attempts == attempt
+        job_queue.fail(db, job, "boom")
+    job = _job(db, 1)
+    assert job.status == "failed" and job.last_error == "boom" and job.dedupe_key is None
+    assert job_queue.lease(db) is None
+
+
+def test_fail_waits_exponentially(db):
+    job_queue.enqueue(db, KIND, 1)
+    db.commit()
+    before = datetime.utcnow()
+    job_queue.fail(db, job_queue.lease(db), "boom")
+    job = _job(db, 1)
+    assert job.status == "queued"
+    assert job.run_after >= before + timedelta(seconds=job_queue.RETRY_BASE_SECONDS)
+    assert job_queue.lease(db) is None
+
+
+def test_worker_runs_a_refresh_and_queues_suggestions(db, make_user):
+    me = make_user("me")
+    make_user("other")
+    job_queue.enqueue(db, KIND, me.id, priority=job_queue.PRIORITY_NEW_USER)
+    db.commit()
+
+    assert worker.work_once(db)
+    assert _job(db, me.id).status == "done"
+    assert db.query(models.MatchScore).count() == 1
+    suggestions = _job(db, me.id, job_queue.JOB_GENERATE_SUGGESTIONS)
+    assert suggestions.status == "queued" and suggestions.priority == job_queue.PRIORITY_IDLE
+
+
+def test_sweep_prioritizes_by_last_seen(db, make_user):
+    now = datetime.utcnow()
+    active, idle = make_user("active"), make_user("idle")
+    db.query(models.User).filter_by(id=active.id).update({"last_seen_at": now})
+    db.query(models.User).filter_by(id=idle.id).update({"last_seen_at": now - timedelta(days=60)})
+    db.commit()
+
+    assert worker.sweep(db) == 2
+    assert _job(db, active.id).priority == job_queue.PRIORITY_ACTIVE_TODAY
+    assert _job(db, idle.id).priority == job_queue.PRIORITY_IDLE
+
+
+def test_login_and_match_views_bump_last_seen(client, db, make_user):
+    user = make_user("me")
+    make_user("other")
+    long_ago = datetime.utcnow() - timedelta(days=60)
+
+    def last_seen():
+        db.expire_all()
+        return db.query(models.User.last_seen_at).filter_by(id=user.id).scalar()
+
+    db.query(models.User).filter_by(id=user.id).update({"last_seen_at": long_ago})
+    db.commit()
+    resp = client.post("/auth/login", data={"username": "me@example.com", "password": "pw"})
+    assert resp.status_code == 200 and resp.json()["access_token"]
+    assert last_seen() > long_ago
+
+    db.query(models.User).filter_by(id=user.id).update({"last_seen_at": long_ago})
+    db.commit()
+    assert client.get("/matches", headers=auth_headers(user)).status_code == 200
+    assert last_seen() > long_ago
+
+    resp = client.post("/auth/login", data={"username": "me@example.com", "password": "wrong"})
+    assert resp.status_code == 401
+
+
+def test_suggestions_for_a_user_with_no_stored_scores_is_a_no_op(db, make_user):
+    me = make_user("me")
+    job_queue.enqueue(db, job_queue.JOB_GENERATE_SUGGESTIONS, me.id)
+    db.commit()
+    assert worker.work_once(db)
+    assert _job(db, me.id, job_queue.JOB_GENERATE_SUGGESTIONS).status == "done"
@@ -0,0 +1,366 @@
+# tests/test_llm.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend import llm
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        state = llm.quota._MemoryState()
+    else:
+        state = llm.quota._SQLiteState(str(tmp_path / "s.db"))
+    monkeypatch.setattr(llm.quota, "_state", state)
+    return state
+
+
+def _forbid_writes(monkeypatch, state):
+    def atomic(fn):
+        raise AssertionError("took the write lock")
+
+    monkeypatch.setattr(state, "atomic", atomic)
+
+
+# --- Circuit breaker -----------------------------------------------------------
+
+
+def test_breaker_checks_are_read_only_while_closed(state, monkeypatch):
+    breaker = llm.CircuitBreaker(failures=2, cooldown=60)
+    breaker.record(ok=False)
+    breaker.record(ok=True)
+    _forbid_writes(monkeypatch, state)
+
+    assert not breaker.is_open()
+    breaker.before_call()
+    breaker.record(ok=True)  # already clean: nothing to write
+
+
+def test_breaker_refuses_while_open_without_writing(state, monkeypatch):
+    breaker = llm.CircuitBreaker(failures=2, cooldown=60)
+    breaker.record(ok=False)
+    breaker.record(ok=False)
+    _forbid_writes(monkeypatch, state)
+
+    assert breaker.is_open()
+    with pytest.raises(llm.CircuitOpenError) as info:
+        breaker.before_call()
+    assert 0 < info.value.retry_after <= 60
+
+
+def test_breaker_lets_exactly_one_probe_through_after_cooldown(state):
+    breaker = llm.CircuitBreaker(failures=1, cooldown=0.05)
+    breaker.record(ok=False)
+    time.sleep(0.06)
+
+    breaker.before_call()  # the probe
+    with pytest.raises(llm.CircuitOpenError):
+        breaker.before_call()
+    breaker.record(ok=True)
+    assert not breaker.is_open()
+    breaker.before_call()
+
+
+# --- Rate limiter --------------------------------------------------------------
+
+
+def _count_writes(monkeypatch, state):
+    writes = []
+    atomic = state.atomic
+
+    def counted(fn):
+        writes.append(1)
+        return atomic(fn)
+
+    monkeypatch.setattr(state, "atomic", counted)
+    return writes
+
+
+def test_limiter_takes_shared_quota_a_slice_at_a_time(state, monkeypatch):
+    limiter = llm.RateLimiter(rpm=1000, tpm=0)  # slices of 20 requests
+    writes = _count_writes(monkeypatch, state)
+    for _ in range(40):
+        assert limiter._try_take(100) == 0.0
+    assert len(writes) == 2
+
+    other = llm.RateLimiter(rpm=1000, tpm=0)  # another process, same state
+    other._try_take(100)
+    assert state.read()["bucket:rpm"] == pytest.approx(1000 - 40 - 20, abs=1)
+
+
+def test_limiter_gives_back_unspent_quota(state, monkeypatch):
+    monkeypatch.setattr(llm.quota, "LLM_LIMITER_SYNC", 0.01)
+    limiter = llm.RateLimiter(rpm=60, tpm=0)  # slice = 1.2 requests
+    limiter._try_take(100)
+    time.sleep(0.02)
+    limiter._try_take(100)  # returns the 0.2 held back, takes a new slice
+    assert state.read()["bucket:rpm"] == pytest.approx(60 - 2 - 0.2, abs=0.1)
+
+
+def test_limiter_refuses_when_the_shared_buckets_are_empty(state):
+    limiter = llm.RateLimiter(rpm=60, tpm=0)
+    state.atomic(lambda rows: rows.update({"bucket:rpm": 0.0, "bucket:rpm:at": time.time()}))
+    assert 0 < limiter._try_take(100) <= 1.0
+
+
+# --- Single flight -------------------------------------------------------------
+
+
+class _Gated(llm.Provider):
+    """Answers "answer" (or raises `error`) once `release` is set; counts calls."""
+
+    def __init__(self, error: Exception = None):
+        self.release = threading.Event()
+        self.error = error
+        self.calls = 0
+
+    async def agenerate(self, prompt, *, model, json_output, timeout, task):
+        self.calls += 1
+        while not self.release.is_set():
+            await asyncio.sleep(0.001)
+        if self.error is not None:
+            raise self.error
+        return "answer"
+
+
+def _call_from_threads(n: int, provider: _Gated) -> list:
+    """n threads calling generate("p") at once; their results / errors, once all joined."""
+    results = []
+
+    def call():
+        try:
+            results.append(llm.generate("p", task="t", retries=0))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    while llm.metrics.snapshot().get("t", {}).get("coalesced", 0) < n - 1:
+        time.sleep(0.001)
+    provider.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_sync_calls_from_threads_share_one_call():
+    provider = _Gated()
+    llm.set_provider(provider)
+    assert _call_from_threads(3, provider) == ["answer"] * 3
+    assert provider.calls == 1
+    assert not llm.gateway._aflights._flights
+
+
+def test_sync_callers_all_get_the_leaders_error_and_the_key_is_freed():
+    provider = _Gated(error=llm.ProviderError("bad request", code=400))
+    llm.set_provider(provider)
+    results = _call_from_threads(2, provider)
+    assert all(isinstance(r, llm.LLMError) for r in results) and results[0] is results[1]
+    assert provider.calls == 1
+
+    llm.set_provider(llm.FakeProvider())
+    assert llm.generate("p", task="t") == ""  # nothing remembered
+
+
+def test_async_single_flight_cancelled_waiter_leaves_the_leader_running():
+    async def main():
+        flights = llm.AsyncSingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flights.do("k", fn))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flights.do("k", fn))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        assert await leader == "answer"
+        assert len(calls) == 1
+        assert not flights._flights
+
+    asyncio.run(main())
+
+
+def test_async_single_flight_leader_error_reaches_waiters_and_frees_the_key():
+    async def main():
+        flights = llm.AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise ValueError("boom")
+
+        leader = asyncio.create_task(flights.do("k", failing))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flights.do("k", failing))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(leader, waiter, return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert not flights._flights
+
+        async def fresh():
+            return "fresh"
+
+        assert await flights.do("k", fresh) == "fresh"
+
+    asyncio.run(main())
+
+
+def test_async_single_flight_waiter_takes_over_from_a_cancelled_leader():
+    async def main():
+        flights = llm.AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return "leader's"
+
+        async def mine():
+            return "mine"
+
+        leader = asyncio.create_task(flights.do("k", slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flights.do("k", mine))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert await waiter == "mine"
+        assert not flights._flights
+
+    asyncio.run(main())
+
+
+# --- Retries -------------------------------------------------------------------
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm.gateway, "_backoff", lambda attempt: 0.0)
+
+
+def _attempts(*outcomes):
+    """attempt_fn raising / returning outcomes in turn; .calls counts attempts."""
+    outcomes = list(outcomes)
+
+    async def attempt():
+        attempt.calls += 1
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    attempt.calls = 0
+    return attempt
+
+
+def _retry(retries, attempt):
+    return asyncio.run(llm.gateway._with_retries("t", retries, attempt))
+
+
+def test_only_transport_quota_and_server_errors_are_retryable():
+    assert llm.is_retryable(TimeoutError())
+    assert llm.is_retryable(ConnectionResetError())
+    assert llm.is_retryable(llm.ProviderError("slow down", code=429))
+    assert llm.is_retryable(llm.ProviderError("busy", code=503))
+    assert not llm.is_retryable(llm.ProviderError("bad request", code=400))
+    assert not llm.is_retryable(llm.ProviderError("no key", code=403))
+    assert not llm.is_retryable(llm.LLMParseError("not json"))
+    assert not llm.is_retryable(ValueError("a bug"))
+
+
+def test_retries_retryable_errors_then_succeeds(no_backoff):
+    attempt = _attempts(llm.ProviderError("busy", code=503), "ok")
+    assert _retry(2, attempt) == "ok"
+    assert attempt.calls == 2
+    assert llm.metrics.snapshot()["t"]["retries"] == 1
+
+
+def test_gives_up_after_the_last_retry(no_backoff):
+    attempt = _attempts(*[llm.ProviderError("busy", code=503)] * 3)
+    with pytest.raises(llm.LLMError, match="after 3 attempts"):
+        _retry(2, attempt)
+    assert attempt.calls == 3
+
+
+def test_does_not_retry_rejected_requests_or_refusals(no_backoff):
+    attempt = _attempts(llm.ProviderError("bad request", code=400))
+    with pytest.raises(llm.LLMError):
+        _retry(2, attempt)
+    assert attempt.calls == 1
+
+    attempt = _attempts(llm.RateLimitedError("no quota", retry_after=3))
+    with pytest.raises(llm.RateLimitedError):
+        _retry(2, attempt)
+    assert attempt.calls == 1
+
+
+def test_parse_errors_are_counted_and_not_retried(no_backoff):
+    attempt = _attempts(llm.LLMParseError("not json", raw="x"), "ok")
+    with pytest.raises(llm.LLMParseError) as info:
+        _retry(1, attempt)
+    assert info.value.raw == "x"
+    assert attempt.calls == 1
+    assert llm.metrics.snapshot()["t"]["parse_errors"] == 1
+
+
+class _FlakyStream(llm.Provider):
+    """Streams "a", "b", "c"; the first `fail_before` calls fail up front, and
+    every call fails after the first chunk if `fail_mid`."""
+
+    def __init__(self, fail_before: int = 0, fail_mid: bool = False):
+        self.fail_before = fail_before
+        self.fail_mid = fail_mid
+        self.calls = 0
+
+    async def astream(self, prompt, *, model, json_output, timeout, task):
+        self.calls += 1
+        if self.calls <= self.fail_before:
+            raise llm.ProviderError("busy", code=503)
+        yield "a"
+        if self.fail_mid:
+            raise llm.ProviderError("dropped", code=503)
+        yield "b"
+        yield "c"
+
+
+def test_stream_retries_only_before_the_first_chunk(no_backoff):
+    provider = _FlakyStream(fail_before=1)
+    llm.set_provider(provider)
+    assert "".join(llm.stream("p", task="t", retries=1)) == "abc"
+    assert provider.calls == 2
+
+    provider = _FlakyStream(fail_mid=True)
+    llm.set_provider(provider)
+    received = []
+    with pytest.raises(llm.LLMError, match="stream failed"):
+        for chunk in llm.stream("p", task="t", retries=3):
+            received.append(chunk)
+    assert received == ["a"]
+    assert provider.calls == 1
+
+
+def test_astream_retries_only_before_the_first_chunk(no_backoff):
+    async def collect(**kwargs):
+        return [chunk async for chunk in llm.astream("p", task="t", **kwargs)]
+
+    provider = _FlakyStream(fail_before=1)
+    llm.set_provider(provider)
+    assert asyncio.run(collect(retries=1)) == ["a", "b", "c"]
+    assert provider.calls == 2
+
+    llm.set_provider(_FlakyStream(fail_before=2))
+    with pytest.raises(llm.LLMError):
+        asyncio.run(collect(retries=1))
@@ -0,0 +1,90 @@
+# tests/test_match_cache.py
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+from backend import llm, match_cache, matching, models
+
+
+def _add_rows(db):
+    db.add_all([
+        models.MatchScore(user_id=1, other_user_id=2, score=70, fingerprint="f"),
+        models.MatchScore(user_id=3, other_user_id=1, score=40, fingerprint="f"),
+    ])
+    db.commit()
+
+
+def _pairs(db):
+    return sorted(db.query(models.MatchScore.user_id, models.MatchScore.other_user_id).all())
+
+
+def test_importing_the_app_deletes_nothing(db):
+    _add_rows(db)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, "-c", "import backend.main"], check=True, env=env)
+    db.expire_all()
+    assert _pairs(db) == [(1, 2), (3, 1)]
+
+
+def test_cli_drops_non_canonical_rows(db):
+    _add_rows(db)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run(
+        [sys.executable, "-m", "backend.match_cache"],
+        check=True, env=env, capture_output=True, text=True,
+    ).stdout
+    assert "dropped 1 " in out
+    db.expire_all()
+    assert _pairs(db) == [(1, 2)]
+
+
+def _model_calls():
+    return llm.metrics.snapshot().get("match_scores", {}).get("calls", 0)
+
+
+def _sources(rows):
+    return {p.user_id: source for p, _, source in rows}
+
+
+def test_a_reversed_pair_is_served_from_the_cache(db, make_user):
+    a, b = make_user("a"), make_user("b")
+    first = matching.score_candidates(db, b.profile, allow_degraded=False)
+    assert _sources(first) == {a.id: "model"}
+    calls = _model_calls()
+
+    again = matching.score_candidates(db, a.profile, allow_degraded=False)
+    assert _sources(again) == {b.id: "cache"}
+    assert [s for _, s, _ in again] == [s for _, s, _ in first]
+    assert _model_calls() == calls
+    assert _pairs(db) == [(a.id, b.id)]  # one row, stored under the canonical key
+
+
+def test_editing_a_profile_invalidates_only_that_users_pairs(db, make_user):
+    a, b, c = make_user("a"), make_user("b"), make_user("c")
+    matching.score_candidates(db, a.profile, allow_degraded=False)
+    matching.score_candidates(db, b.profile, allow_degraded=False)
+    assert _pairs(db) == [(a.id, b.id), (a.id, c.id), (b.id, c.id)]
+
+    c.profile.bio = "Something new."
+    assert match_cache.invalidate_user(db, c.id) == 2
+    db.commit()
+    db.expire_all()
+    stale = {
+        (r.user_id, r.other_user_id) for r in db.query(models.MatchScore).filter_by(fingerprint=None)
+    }
+    assert stale == {(a.id, c.id), (b.id, c.id)}
+
+    rows = matching.score_candidates(db, a.profile, allow_degraded=False)
+    assert _sources(rows) == {b.id: "cache", c.id: "model"}
+
+
+def test_a_changed_profile_misses_the_cache_even_without_invalidation(db, make_user):
+    a, b, c = make_user("a"), make_user("b"), make_user("c")
+    matching.score_candidates(db, a.profile, allow_degraded=False)
+
+    b.profile.interests = "jazz, film"  # the pair fingerprint no longer matches
+    db.commit()
+    rows = matching.score_candidates(db, a.profile, allow_degraded=False)
+    assert _sources(rows) == {b.id: "model", c.id: "cache"}
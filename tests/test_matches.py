@@ -0,0 +1,145 @@
+# tests/test_matches.py
+import json
+
+import pytest
+
+from conftest import auth_headers
+
+from backend import auth, llm, main, matching, models, pagination
+
+INTERESTS = ["hiking, chess", "chess, jazz", "jazz, film", "film, hiking", "running, chess"]
+
+
+@pytest.fixture
+def me(make_user):
+    user = make_user("me")
+    for i in range(11):
+        make_user(f"u{i}", interests=INTERESTS[i % len(INTERESTS)], age=19 + i % 4)
+    return user
+
+
+def _key(row):
+    return (-row["score"], row["profile"]["user_id"])
+
+
+def test_cursor_round_trip():
+    cursor = pagination.encode_cursor(72.5, 41)
+    assert "=" not in cursor
+    assert pagination.decode_cursor(cursor) == (72.5, 41)
+    for bad in ("", "not-base64!", pagination.encode_cursor(1, 2)[:-3], "WzFd"):
+        with pytest.raises(ValueError):
+            pagination.decode_cursor(bad)
+
+
+@pytest.mark.parametrize("scoring", ["inline", "precomputed"])
+def test_pages_walk_the_whole_ranking_once(client, me, monkeypatch, scoring):
+    headers = auth_headers(me)
+    full = client.get("/matches", params={"limit": 100}, headers=headers)
+    assert full.status_code == 200 and "X-Next-Cursor" not in full.headers
+    ranking = full.json()
+    assert len(ranking) == 11 and ranking == sorted(ranking, key=_key)
+
+    monkeypatch.setattr(main, "MATCHES_SCORING", scoring)  # precomputed: scores stored above
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 4, **({"cursor": cursor} if cursor else {})}
+        resp = client.get("/matches", params=params, headers=headers)
+        assert resp.status_code == 200
+        seen += resp.json()
+        pages += 1
+        cursor = resp.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        assert len(resp.json()) == 4
+
+    assert pages == 3
+    assert [r["profile"]["user_id"] for r in seen] == [r["profile"]["user_id"] for r in ranking]
+    assert [r["score"] for r in seen] == [r["score"] for r in ranking]
+
+
+def test_precomputed_by_default_scoring_inline_until_the_worker_has_run(client, me, db):
+    assert main.MATCHES_SCORING == "precomputed"
+    headers = auth_headers(me)
+    first = client.get("/matches", params={"limit": 100}, headers=headers).json()
+    assert len(first) == 11 and not any(r["provisional"] for r in first)
+    assert db.query(models.MatchScore).count() == 11
+    calls = llm.metrics.snapshot()["match_scores"]["calls"]
+
+    # Stored now: read back without the model
+    assert client.get("/matches", params={"limit": 100}, headers=headers).json() == first
+    assert llm.metrics.snapshot()["match_scores"]["calls"] == calls
+
+
+def test_exact_last_page_has_no_cursor(client, me):
+    resp = client.get("/matches", params={"limit": 11}, headers=auth_headers(me))
+    assert len(resp.json()) == 11 and "X-Next-Cursor" not in resp.headers
+
+
+def test_invalid_cursor_is_400(client, me):
+    resp = client.get("/matches", params={"cursor": "garbage!"}, headers=auth_headers(me))
+    assert resp.status_code == 400
+    assert resp.json()["detail"] == "Invalid cursor"
+
+
+def test_matches_need_a_profile(client, db):
+    user = models.User(email="nobody@example.com", hashed_password=auth.get_password_hash("pw"))
+    db.add(user)
+    db.commit()
+    assert client.get("/matches", headers=auth_headers(user)).status_code == 400
+    assert client.get("/matches/stream", headers=auth_headers(user)).status_code == 400
+
+
+def test_stream_sends_each_match_then_the_order(client, me):
+    headers = auth_headers(me)
+    resp = client.get("/matches/stream", headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    frames = [json.loads(line) for line in resp.text.splitlines()]
+
+    matches, done = frames[:-1], frames[-1]
+    assert [f["type"] for f in matches] == ["match"] * 11
+    assert done["type"] == "done"
+    by_id = {f["profile"]["user_id"]: f for f in matches}
+    assert sorted(done["order"]) == sorted(by_id)
+    assert done["order"] == sorted(by_id, key=lambda uid: (-by_id[uid]["score"], uid))
+    for f in matches:
+        assert f["source"] in ("cache", "model", "local")
+        assert f["provisional"] == (f["source"] == "local")
+
+    # Same scores as the paged endpoint
+    ranking = client.get("/matches", params={"limit": 100}, headers=headers).json()
+    assert [r["profile"]["user_id"] for r in ranking] == done["order"]
+
+
+def _match_score_calls():
+    return llm.metrics.snapshot().get("match_scores", {}).get("calls", 0)
+
+
+def test_an_open_breaker_serves_provisional_scores_that_are_not_stored(client, me, db, monkeypatch):
+    monkeypatch.setattr(main, "MATCHES_SCORING", "inline")
+    for _ in range(llm.breaker.failures):
+        llm.breaker.record(ok=False)
+    assert llm.breaker.is_open()
+
+    headers = auth_headers(me)
+    degraded = client.get("/matches", params={"limit": 100}, headers=headers).json()
+    assert len(degraded) == 11 and all(r["provisional"] for r in degraded)
+    assert _match_score_calls() == 0 and db.query(models.MatchScore).count() == 0
+    job = db.query(models.MatchJob).filter_by(user_id=me.id).one()  # upgraded in the background
+    assert job.kind == "refresh_matches"
+
+    # Provider back: the same request gets model scores, and keeps them
+    llm.breaker.record(ok=True)
+    scored = client.get("/matches", params={"limit": 100}, headers=headers).json()
+    assert not any(r["provisional"] for r in scored)
+    assert db.query(models.MatchScore).count() == 11
+
+
+def test_the_worker_still_scores_while_requests_are_degraded(me, db, monkeypatch):
+    monkeypatch.setattr(llm.health, "degraded", lambda: True)  # slow, but answering
+    rows = matching.score_candidates(db, me.profile)
+    assert {source for _, _, source in rows} == {"local"} and _match_score_calls() == 0
+
+    rows = matching.score_candidates(db, me.profile, allow_degraded=False)
+    assert {source for _, _, source in rows} == {"model"}
+    assert db.query(models.MatchScore).count() == 11
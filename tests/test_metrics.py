@@ -0,0 +1,41 @@
+# tests/test_metrics.py
+"""/metrics: who may scrape it, and the series a model call leaves there."""
+from fastapi.testclient import TestClient
+
+from backend import llm, main
+
+
+def test_metrics_are_refused_to_remote_clients_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "")
+    assert client.get("/metrics").status_code == 403  # TestClient's host is "testclient"
+
+    local = TestClient(main.app, client=("127.0.0.1", 50000))
+    assert local.get("/metrics").status_code == 200
+
+
+def test_metrics_token_is_required_once_set(client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "s3cret")
+    local = TestClient(main.app, client=("127.0.0.1", 50000))
+    assert local.get("/metrics").status_code == 401  # the token applies to localhost too
+    wrong = client.get("/metrics", headers={"Authorization": "Bearer nope"})
+    assert wrong.status_code == 401
+    assert wrong.headers["WWW-Authenticate"] == "Bearer"
+
+    ok = client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert ok.status_code == 200
+    assert ok.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+
+def test_a_model_call_shows_up_as_counters_and_histograms(client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "s3cret")
+    llm.generate("p", task="t")
+
+    body = client.get("/metrics", headers={"Authorization": "Bearer s3cret"}).text
+    assert 'llm_calls_total{task="t"} 1' in body
+    assert 'llm_call_duration_seconds_bucket{task="t",le="+Inf"} 1' in body
+    assert 'llm_call_duration_seconds_count{task="t"} 1' in body
+    assert 'llm_call_duration_seconds_sum{task="t"}' in body
+    assert 'llm_prompt_tokens_bucket{task="t",le=' in body
+    assert 'llm_response_tokens_count{task="t"} 1' in body
+    assert "llm_degraded 0" in body
+    assert "llm_breaker_open 0" in body
@@ -0,0 +1,77 @@
+# tests/test_preferences.py
+from conftest import auth_headers
+
+from backend import matching, preferences, schemas
+
+
+def _candidates(db, profile):
+    return sorted(p.user_id for p in matching.candidate_query(db, profile))
+
+
+def _save(db, user, **prefs):
+    preferences.save_preferences(db, user.id, schemas.PreferencesIn(**prefs))
+    db.commit()
+
+
+def test_filters_and_exclusions_drop_candidates_in_sql(db, make_user):
+    me = make_user("me")
+    young = make_user("young", age=18)
+    old = make_user("old", age=30)
+    woman = make_user("woman", gender="woman")
+    senior = make_user("senior", class_year=2025)
+    elsewhere = make_user("elsewhere", campus="qatar")
+    plain = make_user("plain")
+    everyone = sorted(u.id for u in (young, old, woman, senior, plain))
+    assert _candidates(db, me.profile) == everyone  # other campuses are never candidates
+    assert elsewhere.id not in _candidates(db, me.profile)
+
+    _save(db, me, min_age=19, max_age=25)
+    assert _candidates(db, me.profile) == sorted([woman.id, senior.id, plain.id])
+
+    _save(db, me, genders=["woman"])
+    assert _candidates(db, me.profile) == [woman.id]
+
+    _save(db, me, min_class_year=2026, max_class_year=2028)
+    assert senior.id not in _candidates(db, me.profile)
+
+    _save(db, me, exclude_user_ids=[plain.id, young.id])
+    assert _candidates(db, me.profile) == sorted([old.id, woman.id, senior.id])
+
+    _save(db, me, min_age=19, max_age=25, genders=["other"], exclude_user_ids=[plain.id])
+    query = matching.candidate_query(db, me.profile)
+    sql = str(query.statement)
+    assert "profiles.age >=" in sql and "profiles.gender IN" in sql and "NOT IN" in sql
+    assert [p.user_id for p in query] == [senior.id]
+
+
+def test_preferences_only_apply_to_their_owner(db, make_user):
+    me, other, third = make_user("me"), make_user("other"), make_user("third")
+    _save(db, me, exclude_user_ids=[third.id])
+    assert _candidates(db, me.profile) == [other.id]
+    assert _candidates(db, other.profile) == sorted([me.id, third.id])
+
+
+def test_preferences_round_trip(client, make_user):
+    me = make_user("me")
+    headers = auth_headers(me)
+    empty = client.get("/preferences/me", headers=headers).json()
+    assert empty == {
+        "user_id": me.id, "min_age": None, "max_age": None, "genders": [],
+        "min_class_year": None, "max_class_year": None, "exclude_user_ids": [],
+    }
+
+    prefs = {
+        "min_age": 19, "max_age": 24, "genders": ["woman", "other"],
+        "min_class_year": 2026, "max_class_year": 2028, "exclude_user_ids": [9, 3, 9],
+    }
+    saved = client.post("/preferences", json=prefs, headers=headers)
+    assert saved.status_code == 200
+    expected = dict(prefs, user_id=me.id, exclude_user_ids=[3, 9])
+    assert saved.json() == expected
+    assert client.get("/preferences/me", headers=headers).json() == expected
+
+    # Saving again replaces the previous preferences, exclusions included
+    client.post("/preferences", json={"exclude_user_ids": [5]}, headers=headers)
+    assert client.get("/preferences/me", headers=headers).json() == dict(
+        empty, exclude_user_ids=[5]
+    )
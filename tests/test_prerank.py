@@ -0,0 +1,40 @@
+# tests/test_prerank.py
+import random
+
+import numpy as np
+
+from backend import prerank
+
+
+def _brute_jaccard(a: set, b: set) -> float:
+    union = a | b
+    return len(a & b) / len(union) if union else 0.0
+
+
+def test_jaccard_matches_a_brute_force_reference():
+    rng = random.Random(7)
+    vocab = [f"t{i}" for i in range(30)]
+    for _ in range(50):
+        me = set(rng.sample(vocab, rng.randint(0, 8)))
+        others = [set(rng.sample(vocab, rng.randint(0, 8))) for _ in range(rng.randint(1, 20))]
+        expected = [_brute_jaccard(me, o) for o in others]
+        assert np.allclose(prerank._jaccard(me, others), expected)
+
+
+def test_jaccard_edge_cases():
+    assert prerank._jaccard({"a"}, []).shape == (0,)
+    assert list(prerank._jaccard(set(), [set(), set()])) == [0.0, 0.0]
+    assert list(prerank._jaccard({"a", "b"}, [{"a", "b"}, set(), {"c"}])) == [1.0, 0.0, 0.0]
+
+
+def test_shortlist_keeps_the_best_local_scores_in_order(make_user):
+    me = make_user("me", interests="chess, hiking, jazz").profile
+    interests = ["chess, hiking, jazz", "chess", "film", "hiking, jazz", "running", "jazz"]
+    candidates = [make_user(f"u{i}", interests=x).profile for i, x in enumerate(interests)]
+
+    scores = prerank.local_scores(me, candidates)
+    best = prerank.shortlist(me, candidates, top_k=3)
+    assert [s for _, s in best] == sorted(scores, reverse=True)[:3]
+    assert best[0][0] is candidates[0]
+    assert len(prerank.shortlist(me, candidates, top_k=50)) == len(candidates)
+    assert prerank.shortlist(me, candidates, top_k=0) == []
@@ -0,0 +1,57 @@
+# tests/test_rescorer.py
+from backend import ai, match_cache, matching, models, rescorer
+
+INTERESTS = ["hiking, chess", "chess, jazz", "jazz, film", "film, hiking", "running, chess"]
+
+
+def _rows(db):
+    db.expire_all()
+    return {(r.user_id, r.other_user_id): (r.score, r.fingerprint) for r in db.query(models.MatchScore)}
+
+
+def test_a_profile_change_rescores_only_that_users_partners_and_shortlist(
+    db, make_user, monkeypatch
+):
+    me = make_user("me", interests="hiking, chess")
+    others = [make_user(f"u{i}", interests=INTERESTS[i % 5]) for i in range(7)]
+    matching.score_candidates(db, me.profile, top_k=2, allow_degraded=False)
+    matching.score_candidates(db, others[5].profile, top_k=2, allow_degraded=False)
+    before = _rows(db)
+    partners = set(match_cache.partner_ids(db, me.id))
+    assert len(partners) == 2
+
+    # What upsert_profile does for an edit to a scored field
+    me.profile.interests, me.profile.major, me.profile.bio = "film, jazz", "Art", "Painting now."
+    match_cache.invalidate_user(db, me.id)
+    change = models.ProfileChange(
+        user_id=me.id, version=2, fingerprint=match_cache.profile_fingerprint(me.profile)
+    )
+    db.add(change)
+    db.commit()
+
+    scored = []
+    score_matches = ai.score_matches
+
+    def spy(my_profile, candidates):
+        scored.append((my_profile.user_id, {p.user_id for p in candidates}))
+        return score_matches(my_profile, candidates)
+
+    monkeypatch.setattr(ai, "score_matches", spy)
+    candidates = matching.candidate_query(db, me.profile)
+    shortlist = {p.user_id for p, _ in matching.shortlist(db, me.profile, candidates, 2)}
+    assert shortlist != partners  # the edit moved the shortlist
+
+    assert rescorer.run_once(db, top_k=2) == (1, len(partners | shortlist))
+    assert scored == [(me.id, partners | shortlist)]
+    assert db.query(models.FeedCursor).filter_by(name=rescorer.CONSUMER).one().position == change.id
+
+    after = _rows(db)
+    for pair, (score, fingerprint) in after.items():
+        if me.id in pair:
+            other = pair[0] if pair[1] == me.id else pair[1]
+            assert other in partners | shortlist and fingerprint is not None
+        else:
+            assert before[pair] == (score, fingerprint)  # nobody else's pairs were touched
+
+    assert rescorer.run_once(db, top_k=2) == (0, 0)
+    assert len(scored) == 1
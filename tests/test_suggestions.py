@@ -0,0 +1,87 @@
+# tests/test_suggestions.py
+from datetime import datetime
+
+from conftest import auth_headers
+
+from backend import job_queue, llm, matching, models, suggestions, worker
+
+RESULT = {"summary": "Likes chess.", "openers": ["Chess later?"]}
+
+
+def test_next_offpeak(monkeypatch):
+    day = datetime(2026, 6, 1)
+    monkeypatch.setattr(suggestions, "SUGGESTIONS_OFFPEAK_HOURS", "")
+    assert suggestions.next_offpeak(day.replace(hour=15)) == day.replace(hour=15)
+
+    monkeypatch.setattr(suggestions, "SUGGESTIONS_OFFPEAK_HOURS", "2-6")
+    assert suggestions.next_offpeak(day.replace(hour=1, minute=30)) == day.replace(hour=2)
+    assert suggestions.next_offpeak(day.replace(hour=3)) == day.replace(hour=3)
+    assert suggestions.next_offpeak(day.replace(hour=6)) == day.replace(day=2, hour=2)
+
+    monkeypatch.setattr(suggestions, "SUGGESTIONS_OFFPEAK_HOURS", "22-3")  # across midnight
+    assert suggestions.next_offpeak(day.replace(hour=23)) == day.replace(hour=23)
+    assert suggestions.next_offpeak(day.replace(hour=2)) == day.replace(hour=2)
+    assert suggestions.next_offpeak(day.replace(hour=12)) == day.replace(hour=22)
+
+
+def test_a_stored_row_is_current_until_a_message_or_an_edit(db, make_user):
+    me, other = make_user("me"), make_user("other")
+    suggestions.store(db, me.profile, other.profile, None, RESULT)
+    db.commit()
+    assert suggestions.lookup(db, me.profile, other.profile, None) == RESULT
+    assert suggestions.lookup(db, other.profile, me.profile, None) is None  # one direction only
+    assert suggestions.lookup(db, me.profile, other.profile, 7) is None
+
+    other.profile.bio = "Rewrote my bio."
+    assert suggestions.lookup(db, me.profile, other.profile, None) is None
+    suggestions.store(db, me.profile, other.profile, None, RESULT)
+    me.profile.major = "Art"
+    assert suggestions.lookup(db, me.profile, other.profile, None) is None
+
+
+def test_generate_for_user_fills_top_matches_without_a_thread(db, make_user):
+    me = make_user("me")
+    others = [make_user(f"u{i}") for i in range(4)]
+    assert suggestions.generate_for_user(db, me.id) == 0  # nothing scored yet
+    matching.score_candidates(db, me.profile, allow_degraded=False)
+    db.add(models.Message(from_user_id=others[0].id, to_user_id=me.id, text="hey"))
+    db.commit()
+
+    assert suggestions.generate_for_user(db, me.id, top_n=4) == 3
+    stored = {row.other_user_id for row in db.query(models.AISuggestion)}
+    assert stored == {u.id for u in others[1:]}  # the live path knows the thread
+    assert suggestions.generate_for_user(db, me.id, top_n=4) == 0  # all current
+
+
+def test_a_refresh_queues_suggestions_for_the_offpeak_window(db, make_user, monkeypatch):
+    monkeypatch.setattr(suggestions, "SUGGESTIONS_OFFPEAK_HOURS", "2-6")
+    me = make_user("me")
+    make_user("other")
+    job_queue.enqueue(db, job_queue.JOB_REFRESH_MATCHES, me.id)
+    db.commit()
+    before = datetime.utcnow()
+    assert worker.work_once(db)
+
+    job = db.query(models.MatchJob).filter_by(kind=job_queue.JOB_GENERATE_SUGGESTIONS).one()
+    assert 2 <= job.run_after.hour < 6 or (2 <= before.hour < 6 and job.run_after >= before)
+
+
+def test_chat_helper_serves_a_stored_suggestion_until_a_profile_changes(db, client, make_user):
+    me, other = make_user("me"), make_user("other")
+    matching.score_candidates(db, me.profile, allow_degraded=False)
+    assert suggestions.generate_for_user(db, me.id) == 1
+    stored = suggestions.lookup(db, me.profile, other.profile, None)
+    calls = llm.metrics.snapshot()["chat_helper"]["calls"]
+
+    def helper():
+        resp = client.get(f"/ai/chat-helper/{other.id}", headers=auth_headers(me))
+        assert resp.status_code == 200
+        return resp.json()
+
+    assert helper() == stored
+    assert llm.metrics.snapshot()["chat_helper"]["calls"] == calls
+
+    other.profile.interests = "knitting"
+    db.commit()
+    helper()
+    assert llm.metrics.snapshot()["chat_helper"]["calls"] == calls + 1